@@ -0,0 +1,90 @@
+"""
+Check that `artifacts.prepare_ldavis` gives the same pyLDAvis data as
+`pyLDAvis.gensim_models.prepare`, for an LDA model trained on a synthetic corpus. Exits with a
+nonzero status if any table differs.
+"""
+
+import os, sys
+import argparse as ap
+import numpy as np
+import pandas as pd
+from gensim.corpora import Dictionary
+from gensim.models import LdaModel
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import artifacts
+from benchmarks.synthetic import generate_corpus
+
+# Tables of pyLDAvis' PreparedData
+TABLES = ["topic_coordinates", "topic_info", "token_table"]
+
+
+def get_args():
+    p = ap.ArgumentParser()
+    p.add_argument("--n_docs", type=int, default=2000)
+    p.add_argument("--vocab_size", type=int, default=2000)
+    p.add_argument("--n_topics", type=int, default=10)
+    p.add_argument("--doc_length", type=int, default=50)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--n_jobs", type=int, default=1)
+    p.add_argument(
+        "--chunk_size",
+        help="Documents prepare_ldavis infers at a time; smaller than n_docs to cover chunking",
+        type=int,
+        default=500,
+    )
+    p.add_argument("--rtol", help="Relative tolerance of numeric columns", type=float, default=1e-5)
+    return p.parse_args()
+
+
+def compare_tables(name, expected, actual, rtol):
+    if list(expected.columns) != list(actual.columns) or expected.shape != actual.shape:
+        print(name, "DIFFER: columns or shape", expected.shape, actual.shape)
+        return False
+
+    matches = True
+    for column in expected.columns:
+        a, b = expected[column].to_numpy(), actual[column].to_numpy()
+        if pd.api.types.is_numeric_dtype(expected[column]):
+            same = np.allclose(a, b, rtol=rtol, atol=0)
+        else:
+            same = bool(np.all(a == b))
+        if not same:
+            print(name, "DIFFER: column", column)
+            matches = False
+    if matches:
+        print(name, "match")
+    return matches
+
+
+def main(args):
+    import pyLDAvis.gensim_models
+
+    data, _ = generate_corpus(
+        args.n_docs, args.vocab_size, args.n_topics, args.doc_length, seed=args.seed
+    )
+    texts = [text.split() for text in data["text"]]
+    dictionary = Dictionary(texts)
+    corpus = [dictionary.doc2bow(text) for text in texts]
+    model = LdaModel(corpus, id2word=dictionary, num_topics=args.n_topics, random_state=args.seed)
+
+    # Inference starts from random document-topic weights, so both start from the same state
+    model.random_state = np.random.RandomState(args.seed)
+    expected = pyLDAvis.gensim_models.prepare(model, corpus, dictionary, n_jobs=args.n_jobs)
+    model.random_state = np.random.RandomState(args.seed)
+    actual = artifacts.prepare_ldavis(
+        model, corpus, dictionary, n_jobs=args.n_jobs, chunk_size=args.chunk_size
+    )
+
+    all_match = True
+    for name in TABLES:
+        all_match &= compare_tables(name, getattr(expected, name), getattr(actual, name), args.rtol)
+    if list(expected.topic_order) != list(actual.topic_order):
+        print("topic_order DIFFER")
+        all_match = False
+
+    sys.exit(0 if all_match else 1)
+
+
+if __name__ == "__main__":
+    main(get_args())
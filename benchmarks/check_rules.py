@@ -0,0 +1,78 @@
+"""
+Check that the compiled replace/remove rules of one or more experiments give the same documents
+and removal counts as ogm's `replace_words`/`remove_words` on their whole datasets. Exits with a
+nonzero status if any phase differs.
+"""
+
+import os, sys, json
+import argparse as ap
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ogm.trainer import TextTrainer
+from common import preprocess
+from common.rules import RuleSet
+
+PHASES = [
+    ("replace_before_stemming", "remove_before_stemming"),
+    ("replace_after_stemming", "remove_after_stemming"),
+]
+
+
+def get_args():
+    p = ap.ArgumentParser()
+    p.add_argument("experiment_configs", help="Paths to experiment JSON files", nargs="+")
+    p.add_argument(
+        "--show", help="Number of differing documents to print per phase", type=int, default=5
+    )
+    return p.parse_args()
+
+
+def check_phase(data, text_key, replacements, removals, n_show):
+    rules = RuleSet(replacements, removals)
+    if not rules.single_token and any(isinstance(t, list) for t in data[text_key]):
+        print("  Phrase rules after stemming are applied by ogm")
+        return True
+    texts, n_removed = rules.apply_column(data[text_key])
+    expected, expected_removed = preprocess.apply_rules_ogm(data, text_key, replacements, removals)
+    differing = [i for i, (a, b) in enumerate(zip(texts, expected)) if a != b]
+    for i in differing[:n_show]:
+        print("  Document", i)
+        print("    compiled:", repr(texts[i]))
+        print("    ogm:     ", repr(expected[i]))
+    if n_removed != expected_removed:
+        print("  Removed", n_removed, "instances, ogm removed", expected_removed)
+    return not differing and n_removed == expected_removed
+
+
+def main(args):
+    all_match = True
+    for config_path in args.experiment_configs:
+        with open(config_path, "r") as infile:
+            setup_dict = json.load(infile)
+        text_key = setup_dict["text_key"]
+
+        trainer = TextTrainer()
+        trainer.parse_file(os.getenv("DATA_DIR") + "/" + setup_dict["data_path"])
+        data = trainer.data
+
+        # Compare each phase on the output of ogm's previous steps
+        for i, (replace_key, remove_key) in enumerate(PHASES):
+            replacements = setup_dict.get(replace_key)
+            removals = setup_dict.get(remove_key)
+            if i == 1:
+                trainer.data = data
+                trainer.lemmatize_stem_words(text_key)
+                data = trainer.data
+            if replacements or removals:
+                matches = check_phase(data, text_key, replacements, removals, args.show)
+                print(setup_dict["name"], replace_key, remove_key, "match" if matches else "DIFFER")
+                all_match &= matches
+
+            texts, _ = preprocess.apply_rules_ogm(data, text_key, replacements, removals)
+            data = data.assign(**{text_key: texts})
+
+    sys.exit(0 if all_match else 1)
+
+
+if __name__ == "__main__":
+    main(get_args())
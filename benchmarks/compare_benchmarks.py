@@ -0,0 +1,60 @@
+"""
+Compare two results files from `run_benchmarks.py`, e.g. before and after a change
+"""
+
+import json
+import argparse as ap
+
+
+def get_args():
+    p = ap.ArgumentParser()
+    p.add_argument("baseline", help="Results JSON file to compare against")
+    p.add_argument("candidate", help="Results JSON file of the new run")
+    p.add_argument(
+        "--threshold",
+        type=float,
+        default=1.1,
+        help="Flag timings at least this many times slower than the baseline",
+    )
+    return p.parse_args()
+
+
+def main(args):
+    with open(args.baseline, "r") as infile:
+        baseline = json.load(infile)
+    with open(args.candidate, "r") as infile:
+        candidate = json.load(infile)
+
+    if baseline["config"] != candidate["config"]:
+        print("WARNING: the runs used different benchmark settings")
+    if baseline["environment"] != candidate["environment"]:
+        print("WARNING: the runs used different environments")
+
+    print(
+        "benchmark".ljust(40),
+        baseline["commit"].rjust(10),
+        candidate["commit"].rjust(10),
+        "ratio".rjust(8),
+    )
+
+    # Compare medians; anything only in one of the runs is listed without a ratio
+    for name in sorted(set(baseline["timings"]) | set(candidate["timings"])):
+        old = baseline["timings"].get(name, {}).get("median")
+        new = candidate["timings"].get(name, {}).get("median")
+        if old is None or new is None:
+            ratio = ""
+        else:
+            ratio = "%.2fx" % (new / old) if old > 0 else "inf"
+            if old > 0 and new / old >= args.threshold:
+                ratio += " SLOWER"
+
+        print(
+            name.ljust(40),
+            ("-" if old is None else "%.3fs" % old).rjust(10),
+            ("-" if new is None else "%.3fs" % new).rjust(10),
+            ratio.rjust(8),
+        )
+
+
+if __name__ == "__main__":
+    main(get_args())
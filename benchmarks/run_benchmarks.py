@@ -0,0 +1,286 @@
+"""
+Time the hot paths of the experiment scripts on a synthetic corpus and save the results as JSON,
+so runs can be compared across commits with `compare_benchmarks.py`.
+
+Each repeat runs in fresh `$MODEL_DIR` and `$CACHE_DIR` directories, so preprocessing is always
+timed cold. Stage breakdowns come from the `metadata.json` files the scripts write.
+"""
+
+import os, sys, json, time, tempfile, platform, subprocess, importlib.util
+import argparse as ap
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+from common import cache, preprocess
+from common.coherence import CoherenceEngine, get_model_topics
+from benchmarks.synthetic import generate_corpus, TIME_FORMAT
+
+BENCHMARKS = ["lda", "coherence", "ldaseq", "topic_dists"]
+MEASURES = ["u_mass", "c_v", "c_uci", "c_npmi"]
+
+
+def get_args():
+    p = ap.ArgumentParser()
+    p.add_argument("--n_docs", type=int, default=5000)
+    p.add_argument("--vocab_size", type=int, default=3000)
+    p.add_argument("--n_topics", type=int, default=20, help="Topics in the corpus and models")
+    p.add_argument("--doc_length", type=int, default=80, help="Mean number of words per doc")
+    p.add_argument("--n_slices", type=int, default=4, help="Time slices for the dynamic model")
+    p.add_argument("--n_trials", type=int, default=2, help="LDA models trained per repeat")
+    p.add_argument("--passes", type=int, default=2, help="Passes for the dynamic model")
+    p.add_argument("--n_workers", type=int, default=2, help="gensim workers per LDA model")
+    p.add_argument("--repeat", type=int, default=3, help="Times to run each benchmark")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument(
+        "--only",
+        nargs="+",
+        choices=BENCHMARKS,
+        default=BENCHMARKS,
+        help="Benchmarks to run; defaults to all of them",
+    )
+    p.add_argument(
+        "--gensim_baseline",
+        action="store_true",
+        help="Also time gensim's CoherenceModel for each coherence measure",
+    )
+    p.add_argument(
+        "--output_file",
+        help="Where to save the results; defaults to benchmarks/results/<commit>-<time>.json",
+    )
+    return p.parse_args()
+
+
+def load_script(name, path):
+    # The scripts aren't packages, so load them straight from their files
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_DIR, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def get_environment():
+    import gensim, pandas
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pandas.__version__,
+        "gensim": gensim.__version__,
+    }
+
+
+def get_setup_dict(args, name, data_file):
+    return {
+        "name": name,
+        "min_topics": args.n_topics,
+        "max_topics": args.n_topics,
+        "n_trials": args.n_trials,
+        "text_key": "text",
+        "data_path": data_file,
+        "time_filter": {
+            "arg_format": "%Y-%m-%d",
+            "start": "2020-01-01",
+            "end": "2021-01-01",
+            "data_format": TIME_FORMAT,
+            "time_key": "timestamp",
+        },
+        "days_in_interval": int(np.ceil(366 / args.n_slices)),
+        "passes": args.passes,
+        "n_workers": args.n_workers,
+    }
+
+
+def read_metadata(setup_dict, n_topics):
+    with open(
+        os.getenv("MODEL_DIR")
+        + "/"
+        + setup_dict["name"]
+        + "/"
+        + str(n_topics)
+        + "topics/metadata.json"
+    ) as infile:
+        return json.load(infile)
+
+
+def sum_stages(stage_dicts, name):
+    return sum(s[name]["wall_time"] for s in stage_dicts if name in s)
+
+
+def bench_lda(args, data_file, timings):
+    lda = load_script("lda_script", "lda/lda.py")
+    setup_dict = get_setup_dict(args, "bench_lda", data_file)
+
+    start = time.perf_counter()
+    lda.main(setup_dict)
+    timings["lda/total"] = time.perf_counter() - start
+
+    metadata = read_metadata(setup_dict, args.n_topics)
+    for stage, info in metadata["preprocessing"].items():
+        timings["lda/preprocessing/" + stage] = info["wall_time"]
+
+    trials = [v["stages"] for k, v in metadata.items() if k.startswith("model_")]
+    for stage in ["training", "coherence", "save"]:
+        timings["lda/per_trial/" + stage] = sum_stages(trials, stage) / len(trials)
+
+
+def bench_coherence(args, data_file, timings):
+    from gensim.models import CoherenceModel, LdaModel
+
+    setup_dict = get_setup_dict(args, "bench_coherence", data_file)
+    data, dictionary, corpus = cache.load_preprocessed(
+        setup_dict, data_file, lambda: preprocess.preprocess_file(setup_dict, data_file)
+    )
+    texts = list(data["text"])
+
+    # Any reasonable model will do; its training isn't timed
+    model = LdaModel(corpus, id2word=dictionary, num_topics=args.n_topics, random_state=args.seed)
+    topics = get_model_topics(model)
+
+    # Each measure from scratch, with no statistics cached on disk
+    for m in MEASURES:
+        engine = CoherenceEngine(texts, corpus, dictionary)
+        start = time.perf_counter()
+        engine.precompute([m])
+        timings["coherence/" + m + "/statistics"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        engine.get_coherence(topics, m)
+        timings["coherence/" + m + "/score"] = time.perf_counter() - start
+
+        if args.gensim_baseline:
+            start = time.perf_counter()
+            CoherenceModel(
+                model=model, corpus=corpus, texts=texts, dictionary=dictionary, coherence=m
+            ).get_coherence()
+            timings["coherence/" + m + "/gensim"] = time.perf_counter() - start
+
+    # What calculate_coherence.py does with --measure all
+    engine = CoherenceEngine(texts, corpus, dictionary)
+    start = time.perf_counter()
+    engine.precompute(MEASURES)
+    for m in MEASURES:
+        engine.get_coherence(topics, m)
+    timings["coherence/all/total"] = time.perf_counter() - start
+
+
+def bench_ldaseq(args, data_file, timings):
+    ldaseq = load_script("ldaseq_script", "dlda/ldaseq.py")
+    setup_dict = get_setup_dict(args, "bench_ldaseq", data_file)
+
+    start = time.perf_counter()
+    ldaseq.main(setup_dict)
+    timings["ldaseq/total"] = time.perf_counter() - start
+
+    metadata = read_metadata(setup_dict, args.n_topics)
+    timings["ldaseq/training"] = metadata["stages"]["training"]["wall_time"]
+    slices = [v["stages"] for k, v in metadata.items() if k.startswith("time_")]
+    timings["ldaseq/slice_coherence"] = sum_stages(slices, "coherence")
+
+
+def bench_topic_dists(args, data_file, timings):
+    get_topic_dists = load_script("get_topic_dists_script", "dlda/get_topic_dists.py")
+    setup_dict = get_setup_dict(args, "bench_ldaseq", data_file)
+
+    # Extracts from the model the ldaseq benchmark trained
+    config_file = os.getenv("MODEL_DIR") + "/bench_ldaseq.json"
+    with open(config_file, "w") as output:
+        json.dump(setup_dict, output)
+
+    start = time.perf_counter()
+    get_topic_dists.main(
+        ap.Namespace(
+            expt_config=config_file,
+            n_topics=args.n_topics,
+            data_id="id",
+            output_file=os.getenv("MODEL_DIR") + "/topic_dists.csv",
+        )
+    )
+    timings["topic_dists/total"] = time.perf_counter() - start
+
+
+def summarize(runs):
+    summary = {}
+    for name in runs[0]:
+        values = [r[name] for r in runs if name in r]
+        summary[name] = {"runs": values, "min": min(values), "median": float(np.median(values))}
+    return summary
+
+
+def main(args):
+    # In the order they have to run
+    benchmarks = {
+        "lda": bench_lda,
+        "coherence": bench_coherence,
+        "ldaseq": bench_ldaseq,
+        "topic_dists": bench_topic_dists,
+    }
+    only = set(args.only)
+    if "topic_dists" in only:
+        # Needs a trained dynamic model
+        only.add("ldaseq")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print("Generating synthetic corpus")
+        data, _ = generate_corpus(
+            args.n_docs, args.vocab_size, args.n_topics, args.doc_length, seed=args.seed
+        )
+        data_file = tmp_dir + "/synthetic.csv"
+        data.to_csv(data_file, index=False)
+
+        runs = []
+        for r in range(args.repeat):
+            run_dir = tmp_dir + "/run_" + str(r)
+            os.environ["DATA_DIR"] = tmp_dir
+            os.environ["MODEL_DIR"] = run_dir + "/models"
+            os.environ["CACHE_DIR"] = run_dir + "/cache"
+            os.makedirs(os.environ["MODEL_DIR"])
+
+            timings = {}
+            for name, bench in benchmarks.items():
+                if name in only:
+                    print("[" + str(r + 1) + "/" + str(args.repeat) + "] Running", name)
+                    bench(args, data_file, timings)
+            runs.append(timings)
+
+    results = {
+        "commit": get_commit(),
+        "created": time.time(),
+        "environment": get_environment(),
+        "config": {k: v for k, v in vars(args).items() if k != "output_file"},
+        "timings": summarize(runs),
+    }
+
+    if args.output_file is None:
+        os.makedirs(os.path.join(REPO_DIR, "benchmarks", "results"), exist_ok=True)
+        args.output_file = os.path.join(
+            REPO_DIR,
+            "benchmarks",
+            "results",
+            results["commit"] + "-" + time.strftime("%Y%m%d-%H%M%S") + ".json",
+        )
+    with open(args.output_file, "w") as output:
+        json.dump(results, output, indent=4)
+
+    for name, t in results["timings"].items():
+        print(name.ljust(40), "%.3fs" % t["median"])
+    print("Saved results to", args.output_file)
+
+
+if __name__ == "__main__":
+    main(get_args())
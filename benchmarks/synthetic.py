@@ -0,0 +1,86 @@
+"""
+Synthetic corpora drawn from LDA's generative process, for benchmarking.
+
+Every document draws a topic mixture from Dirichlet(alpha), and every word draws a topic from
+that mixture and then a word from the topic's Dirichlet(beta) distribution over the vocabulary.
+Words are made of letters only so they survive the ogm preprocessing, and documents get evenly
+spread timestamps so the same file can train a dynamic topic model.
+"""
+
+import argparse as ap
+import numpy as np
+import pandas as pd
+
+SYLLABLES = [c + v for c in "bdfgklmnprstvz" for v in "aeiou"]
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def make_vocab(vocab_size, rng):
+    # Distinct three-syllable words; 70^3 combinations is plenty for any realistic vocabulary
+    ids = rng.choice(len(SYLLABLES) ** 3, size=vocab_size, replace=False)
+    n = len(SYLLABLES)
+    return [SYLLABLES[i // (n * n)] + SYLLABLES[(i // n) % n] + SYLLABLES[i % n] for i in ids]
+
+
+def generate_corpus(
+    n_docs,
+    vocab_size,
+    n_topics,
+    doc_length,
+    start="2020-01-01",
+    end="2020-12-31",
+    alpha=0.1,
+    beta=0.01,
+    seed=0,
+):
+    """
+    Returns a data table with `id`, `text` and `timestamp` columns, and the true topic-word
+    distributions as a `n_topics` x `vocab_size` array.
+
+    Document lengths are Poisson-distributed around `doc_length`.
+    """
+    rng = np.random.default_rng(seed)
+    vocab = np.array(make_vocab(vocab_size, rng))
+    topics = rng.dirichlet(np.full(vocab_size, beta), size=n_topics)
+    mixtures = rng.dirichlet(np.full(n_topics, alpha), size=n_docs)
+    lengths = np.maximum(1, rng.poisson(doc_length, size=n_docs))
+
+    # Draw every document's topic assignments, then the words for each topic in one go
+    doc_ids = np.repeat(np.arange(n_docs), lengths)
+    word_topics = np.empty(len(doc_ids), dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    for d in range(n_docs):
+        word_topics[offsets[d] : offsets[d + 1]] = rng.choice(
+            n_topics, size=lengths[d], p=mixtures[d]
+        )
+
+    words = np.empty(len(doc_ids), dtype=np.int64)
+    for k in range(n_topics):
+        in_topic = word_topics == k
+        words[in_topic] = rng.choice(vocab_size, size=in_topic.sum(), p=topics[k])
+
+    texts = [" ".join(vocab[words[offsets[d] : offsets[d + 1]]]) for d in range(n_docs)]
+    timestamps = pd.to_datetime(
+        np.linspace(pd.Timestamp(start).value, pd.Timestamp(end).value, n_docs)
+    ).strftime(TIME_FORMAT)
+
+    data = pd.DataFrame({"id": np.arange(n_docs), "text": texts, "timestamp": timestamps})
+    return data, topics
+
+
+if __name__ == "__main__":
+    p = ap.ArgumentParser()
+    p.add_argument("output_file", help="Path of the CSV file to write")
+    p.add_argument("--n_docs", type=int, default=10000)
+    p.add_argument("--vocab_size", type=int, default=5000)
+    p.add_argument("--n_topics", type=int, default=20)
+    p.add_argument("--doc_length", type=int, default=100, help="Mean number of words per doc")
+    p.add_argument("--start", default="2020-01-01", help="Timestamp of the first document")
+    p.add_argument("--end", default="2020-12-31", help="Timestamp of the last document")
+    p.add_argument("--seed", type=int, default=0)
+    a = p.parse_args()
+
+    data, _ = generate_corpus(
+        a.n_docs, a.vocab_size, a.n_topics, a.doc_length, a.start, a.end, seed=a.seed
+    )
+    data.to_csv(a.output_file, index=False)
@@ -0,0 +1,213 @@
+"""
+Saving and memory-mapped loading of trained models, and the top terms and pyLDAvis data cached
+next to LDA models.
+
+`save_lda` and `save_ldaseq` write the large arrays of a model (`sstats`, `expElogbeta`, `gammas`
+and the topics' `sslm` arrays) to their own `.npy` files, and the loaders memory-map them
+read-only.
+"""
+
+import os, pickle
+import numpy as np
+from gensim import utils
+from gensim.models import LdaModel, LdaSeqModel
+from common import results
+
+# Documents inferred at a time when preparing pyLDAvis data
+LDAVIS_CHUNK_SIZE = 10000
+
+
+def save_lda(model, path):
+    # LdaModel.save would write the state without passing `separately` on to it, so the state is
+    # detached while the model is saved and then written once with sstats split out
+    state, model.state = model.state, None
+    try:
+        model.save(path, separately=["expElogbeta"])
+    finally:
+        model.state = state
+    state.save(utils.smart_extension(path, ".state"), separately=["sstats"])
+
+
+def load_lda(path, id2word=None, mmap="r"):
+    """
+    Load an LDA model with its large arrays memory-mapped. `id2word`, e.g. the experiment's
+    dictionary, replaces the copy saved with the model.
+    """
+    model = LdaModel.load(path, mmap=mmap)
+    if id2word is not None:
+        model.id2word = id2word
+    return model
+
+
+def get_best_lda_dir(setup_dict, n_topics):
+    """
+    Directory of the highest-coherence trial saved for `n_topics` topics, and its coherence
+    """
+    best_dir, best_coherence = results.get_best_trial(setup_dict["name"], n_topics)
+    if best_dir is None:
+        raise ValueError(
+            "No trial with a coherence score is recorded for "
+            + str(n_topics)
+            + " topics of "
+            + setup_dict["name"]
+        )
+    return best_dir, best_coherence
+
+
+def get_top_terms(model, top_n):
+    """
+    Term ids and weights of the `top_n` most probable terms of every topic, highest first, as
+    (topics, top_n) arrays. Weights are the probabilities `show_topic` reports.
+    """
+    topics = model.get_topics()
+    top_n = min(top_n, topics.shape[1])
+
+    # Partial sort of every topic at once, then order just the top terms
+    ids = np.argpartition(-topics, top_n - 1, axis=1)[:, :top_n]
+    weights = np.take_along_axis(topics, ids, axis=1)
+    order = np.argsort(-weights, axis=1, kind="stable")
+    return np.take_along_axis(ids, order, axis=1), np.take_along_axis(weights, order, axis=1)
+
+
+def get_top_terms_path(path):
+    return path + ".top_terms.npz"
+
+
+def load_top_terms(model, path, top_n):
+    """
+    Top `top_n` term ids, weights and words of every topic of the LDA model saved at `path`.
+    They're cached next to the model, and recomputed if the model is newer than the cache or
+    more terms are asked for than were cached.
+    """
+    cache_path = get_top_terms_path(path)
+    try:
+        if os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            with np.load(cache_path) as cached:
+                if cached["ids"].shape[1] >= min(top_n, model.num_terms):
+                    return (
+                        cached["ids"][:, :top_n],
+                        cached["weights"][:, :top_n],
+                        cached["words"][:, :top_n],
+                    )
+    except (FileNotFoundError, KeyError, ValueError):
+        pass
+
+    ids, weights = get_top_terms(model, top_n)
+    ids, weights = ids.astype(np.int32), weights.astype(np.float32)
+    words = np.array([[model.id2word[i] for i in row] for row in ids], dtype=str)
+
+    tmp_path = cache_path + ".tmp" + str(os.getpid())
+    with open(tmp_path, "wb") as output:
+        np.savez(output, ids=ids, weights=weights, words=words)
+    os.replace(tmp_path, cache_path)
+    return ids, weights, words
+
+
+def prepare_ldavis(model, corpus, dictionary, n_jobs=-1, chunk_size=LDAVIS_CHUNK_SIZE):
+    """
+    pyLDAvis' data for an LDA model, as `pyLDAvis.gensim_models.prepare` makes it. The corpus is
+    read `chunk_size` documents at a time, summing term frequencies and each topic's share of the
+    corpus' tokens, so memory doesn't grow with the number of documents (it can be streamed from
+    disk). The topic-term relevance is computed in `n_jobs` processes.
+    """
+    import pyLDAvis
+    from gensim import matutils
+
+    term_freqs = np.zeros(len(dictionary))
+    topic_freqs = np.zeros(model.num_topics)
+    for chunk in utils.grouper(corpus, chunk_size):
+        counts = matutils.corpus2csc(chunk, num_terms=len(dictionary))
+        term_freqs += np.asarray(counts.sum(axis=1)).ravel()
+
+        gamma, _ = model.inference(chunk)
+        doc_lengths = np.asarray(counts.sum(axis=0)).ravel()
+        topic_freqs += (gamma / gamma.sum(axis=1, keepdims=True)).T @ doc_lengths
+
+    # pyLDAvis can't take terms that never occur
+    term_freqs[term_freqs == 0] = 0.01
+
+    # pyLDAvis only uses the documents' topic distributions and lengths to weigh each topic by
+    # its share of the corpus' tokens, so one document with the summed weights gives the same data
+    n_tokens = topic_freqs.sum()
+    return pyLDAvis.prepare(
+        topic_term_dists=model.get_topics(),
+        doc_topic_dists=(topic_freqs / n_tokens)[np.newaxis, :],
+        doc_lengths=np.array([n_tokens]),
+        vocab=[dictionary[i] for i in range(len(dictionary))],
+        term_frequency=term_freqs,
+        n_jobs=n_jobs,
+    )
+
+
+def get_ldavis_path(path):
+    return path + ".ldavis.pkl"
+
+
+def load_ldavis(path, get_inputs, n_jobs=-1):
+    """
+    pyLDAvis' prepared data for the LDA model saved at `path`, cached next to the model.
+    `get_inputs` returns the (model, corpus, dictionary) to prepare it from, and is only called
+    if there's no cache or the model is newer than it.
+    """
+    cache_path = get_ldavis_path(path)
+    try:
+        if os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            with open(cache_path, "rb") as infile:
+                return pickle.load(infile)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        pass
+
+    prepared = prepare_ldavis(*get_inputs(), n_jobs=n_jobs)
+    tmp_path = cache_path + ".tmp" + str(os.getpid())
+    with open(tmp_path, "wb") as output:
+        pickle.dump(prepared, output, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+    return prepared
+
+
+def get_sslm_array_path(path, attrib):
+    return path + ".sslm_" + attrib + ".npy"
+
+
+def save_ldaseq(model, path):
+    """
+    Save a dynamic topic model with `gammas` and each per-topic chain array in its own file
+    """
+    chains = model.topic_chains
+    stacked = [
+        attrib
+        for attrib, value in vars(chains[0]).items()
+        if isinstance(value, np.ndarray) and value.ndim >= 2
+    ]
+
+    # Pull the chain arrays out of the pickle and write each as one (topics, ...) array
+    saved = []
+    for attrib in stacked:
+        np.save(get_sslm_array_path(path, attrib), np.stack([getattr(c, attrib) for c in chains]))
+        saved.append([getattr(c, attrib) for c in chains])
+        for c in chains:
+            setattr(c, attrib, None)
+
+    try:
+        model.save(path, separately=["gammas"])
+    finally:
+        for attrib, values in zip(stacked, saved):
+            for c, value in zip(chains, values):
+                setattr(c, attrib, value)
+
+
+def load_ldaseq(path, mmap="r"):
+    """
+    Load a dynamic topic model saved by `save_ldaseq` (or plain `LdaSeqModel.save`), mapping its
+    large arrays from disk
+    """
+    model = LdaSeqModel.load(path, mmap=mmap)
+    prefix = os.path.basename(path) + ".sslm_"
+    for filename in os.listdir(os.path.dirname(path) or "."):
+        if filename.startswith(prefix) and filename.endswith(".npy"):
+            attrib = filename[len(prefix) : -len(".npy")]
+            stacked = np.load(get_sslm_array_path(path, attrib), mmap_mode=mmap)
+            for k, chain in enumerate(model.topic_chains):
+                setattr(chain, attrib, stacked[k])
+
+    return model
@@ -0,0 +1,197 @@
+"""
+Content-addressed on-disk cache of preprocessed experiment data: the data table, gensim
+dictionary and BoW corpus.
+
+Entries are keyed by a hash of the data file's contents, every experiment JSON key in
+`PREPROCESS_KEYS` and `PREPROCESS_VERSION`. Least recently used entries are evicted first.
+
+Environment:
+- `$CACHE_DIR`: where entries are stored; defaults to `$MODEL_DIR/.preprocess_cache`
+- `$CACHE_MAX_GB`: size cap for the whole cache directory; defaults to 20
+"""
+
+import os, json, hashlib, pickle, shutil, time
+from ogm.trainer import TextTrainer
+from gensim.corpora import Dictionary, MmCorpus
+from common.manifest import write_json_atomic
+from common.instrument import StageTimer
+
+# Experiment JSON keys which change the output of preprocessing
+PREPROCESS_KEYS = [
+    "text_key",
+    "time_filter",
+    "attribute_filters",
+    "replace_before_stemming",
+    "remove_before_stemming",
+    "replace_after_stemming",
+    "remove_after_stemming",
+]
+
+# Bump whenever a change to the pipeline could change its output:
+# 2: lemmatizing once per distinct token
+# 3: replace/remove rules compiled into a RuleSet
+# 4: rules before stemming applied as substrings again, checked against ogm
+PREPROCESS_VERSION = 4
+
+
+def get_cache_dir():
+    if os.getenv("CACHE_DIR"):
+        return os.getenv("CACHE_DIR")
+    return os.getenv("MODEL_DIR") + "/.preprocess_cache"
+
+
+def hash_file(path):
+    """
+    SHA-256 of a file's contents. Hashes are remembered by path, size and modification time so
+    that unchanged data files are only read once.
+    """
+    stat = os.stat(path)
+    abs_path = os.path.abspath(path)
+    index_path = get_cache_dir() + "/file_hashes.json"
+    try:
+        with open(index_path, "r") as infile:
+            index = json.load(infile)
+    except (FileNotFoundError, json.JSONDecodeError):
+        index = {}
+
+    known = index.get(abs_path)
+    if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+        return known["sha256"]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as infile:
+        for block in iter(lambda: infile.read(1 << 20), b""):
+            h.update(block)
+
+    index[abs_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": h.hexdigest()}
+    os.makedirs(get_cache_dir(), exist_ok=True)
+    write_json_atomic(index_path, index)
+    return h.hexdigest()
+
+
+def cache_key(setup_dict, data_file):
+    h = hashlib.sha256()
+    h.update(str(PREPROCESS_VERSION).encode())
+    h.update(hash_file(data_file).encode())
+    preprocess_config = {k: setup_dict[k] for k in PREPROCESS_KEYS if k in setup_dict}
+    h.update(json.dumps(preprocess_config, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def get_entry_size(entry_path):
+    total = 0
+    for dirpath, _, filenames in os.walk(entry_path):
+        for f in filenames:
+            total += os.path.getsize(dirpath + "/" + f)
+    return total
+
+
+def evict(keep=None):
+    """
+    Delete least recently used entries until the cache fits under `$CACHE_MAX_GB`.
+    The entry named `keep` is never evicted.
+    """
+    max_bytes = float(os.getenv("CACHE_MAX_GB", 20)) * 1024**3
+    cache_dir = get_cache_dir()
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        info_path = cache_dir + "/" + name + "/info.json"
+        if os.path.isfile(info_path):
+            entries.append(
+                (os.path.getmtime(info_path), name, get_entry_size(cache_dir + "/" + name))
+            )
+
+    total = sum(e[2] for e in entries)
+    for _, name, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(cache_dir + "/" + name, ignore_errors=True)
+        total -= size
+        print("Evicted preprocessing cache entry", name)
+
+
+def load_entry(entry_path):
+    with open(entry_path + "/data.pkl", "rb") as infile:
+        data = pickle.load(infile)
+    dictionary = Dictionary.load(entry_path + "/dictionary.dict")
+    corpus = MmCorpus(entry_path + "/corpus.mm")
+
+    # Mark this entry as most recently used
+    os.utime(entry_path + "/info.json")
+    return data, dictionary, corpus
+
+
+def save_entry(entry_path, data, text_key, info, timer=None):
+    if timer is None:
+        timer = StageTimer()
+
+    # Build the dictionary and corpus exactly as the trainer would
+    trainer = TextTrainer()
+    trainer.data = data
+    with timer.stage("dictionary_corpus", n_docs=len(data)):
+        trainer.make_dict_and_corpus(text_key)
+
+    # Write into a scratch directory and move it into place once it's complete
+    tmp_path = entry_path + ".tmp" + str(os.getpid())
+    os.makedirs(tmp_path, exist_ok=True)
+    with open(tmp_path + "/data.pkl", "wb") as output:
+        pickle.dump(data, output, protocol=pickle.HIGHEST_PROTOCOL)
+    trainer.dictionary.save(tmp_path + "/dictionary.dict")
+    MmCorpus.serialize(tmp_path + "/corpus.mm", trainer.corpus)
+    write_json_atomic(tmp_path + "/info.json", info)
+
+    try:
+        os.replace(tmp_path, entry_path)
+    except OSError:
+        # Another process finished the same entry first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def get_entry_path(setup_dict, data_file):
+    """
+    Directory of this experiment's cache entry, where other per-corpus data can be kept
+    """
+    return get_cache_dir() + "/" + cache_key(setup_dict, data_file)
+
+
+def load_preprocessed(setup_dict, data_file, preprocess, timer=None):
+    """
+    Get the preprocessed data table, gensim dictionary and BoW corpus for an experiment.
+
+    `preprocess` takes no arguments and returns the preprocessed data table; it's only called
+    when the cache has no entry for this data file and preprocessing configuration. Building
+    the corpus and loading a cache entry are recorded as stages in `timer` if one is given.
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    entry_path = get_entry_path(setup_dict, data_file)
+    key = os.path.basename(entry_path)
+
+    if os.path.isfile(entry_path + "/info.json"):
+        print("Loading preprocessed data from cache entry", key)
+        with timer.stage("load_cache") as stage:
+            entry = load_entry(entry_path)
+            stage["n_docs"] = len(entry[0])
+        return entry
+
+    data = preprocess()
+    save_entry(
+        entry_path,
+        data,
+        setup_dict["text_key"],
+        {
+            "data_file": os.path.abspath(data_file),
+            "config": {k: setup_dict[k] for k in PREPROCESS_KEYS if k in setup_dict},
+            "created": time.time(),
+            "n_docs": len(data),
+            # How the token-wise lemmas were checked against ogm
+            "lemma_check": data.attrs.get("lemma_check"),
+        },
+        timer,
+    )
+    evict(keep=key)
+    return load_entry(entry_path)
@@ -0,0 +1,371 @@
+"""
+Topic coherence computed from co-occurrence statistics shared across models.
+
+Word occurrence and co-occurrence counts are gathered once per corpus and window size into a
+sparse vocabulary x vocabulary matrix (occurrence counts on its diagonal), and any set of topics
+is scored against it. Scores match gensim's `u_mass`, `c_v`, `c_uci` and `c_npmi` measures with
+their default window sizes.
+"""
+
+import os
+import numpy as np
+import scipy.sparse as sps
+from gensim import matutils
+
+# Same smoothing constant as gensim's confirmation measures
+EPSILON = 1e-12
+
+# gensim's default window size for each measure; None means boolean documents from the corpus
+WINDOW_SIZES = {"u_mass": None, "c_v": 110, "c_uci": 10, "c_npmi": 10}
+
+# Number of (window, word) entries to collect before folding them into the counts
+CHUNK_ENTRIES = 5_000_000
+
+
+class CooccurrenceStats:
+    """
+    Number of windows (or documents) containing each word and each pair of words
+    """
+
+    def __init__(self, co_occurrences, num_docs):
+        self.co_occurrences = co_occurrences.tocsr()
+        self.occurrences = self.co_occurrences.diagonal()
+        self.num_docs = num_docs
+
+    @classmethod
+    def from_documents(cls, docs, vocab_size, window_size=None):
+        """
+        Count co-occurrences over an iterable of documents, each an array of word IDs in which
+        negative IDs are placeholders for words outside the vocabulary. Without a window size,
+        each document is a single window.
+        """
+        accumulator = CooccurrenceAccumulator(vocab_size, window_size)
+        for ids in docs:
+            accumulator.add(ids)
+        return accumulator.finish()
+
+    @classmethod
+    def from_corpus(cls, corpus, vocab_size):
+        """
+        Boolean-document statistics from a BoW corpus, as used by `u_mass`
+        """
+        return cls.from_documents(
+            (np.array([word_id for word_id, _ in doc], dtype=np.int64) for doc in corpus),
+            vocab_size,
+        )
+
+    @classmethod
+    def from_texts(cls, texts, dictionary, window_size):
+        """
+        Boolean sliding-window statistics from tokenized texts, as used by `c_v`, `c_uci` and
+        `c_npmi`
+        """
+        return cls.from_documents(
+            (np.array(dictionary.doc2idx(list(text)), dtype=np.int64) for text in texts),
+            len(dictionary.token2id),
+            window_size,
+        )
+
+    @classmethod
+    def from_texts_multi(cls, texts, dictionary, window_sizes):
+        """
+        Statistics for several window sizes (None for boolean documents) in one pass over the
+        texts. Returns a dict keyed by window size.
+        """
+        accumulators = {
+            w: CooccurrenceAccumulator(len(dictionary.token2id), w) for w in set(window_sizes)
+        }
+        for text in texts:
+            ids = np.array(dictionary.doc2idx(list(text)), dtype=np.int64)
+            for accumulator in accumulators.values():
+                accumulator.add(ids)
+
+        return {w: accumulator.finish() for w, accumulator in accumulators.items()}
+
+    def save(self, path):
+        co = self.co_occurrences
+        np.savez(
+            path,
+            data=co.data,
+            indices=co.indices,
+            indptr=co.indptr,
+            shape=co.shape,
+            num_docs=self.num_docs,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            co_occurrences = sps.csr_matrix(
+                (f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"])
+            )
+            return cls(co_occurrences, int(f["num_docs"]))
+
+    def probabilities(self, word_ids):
+        """
+        Dense occurrence and co-occurrence probabilities for just these word IDs
+        """
+        word_ids = np.asarray(word_ids)
+        co = self.co_occurrences[word_ids][:, word_ids].toarray()
+        return self.occurrences[word_ids] / self.num_docs, co / self.num_docs
+
+    def topic_coherences(self, topics, measure):
+        """
+        Coherence of each topic, where a topic is an ordered array of word IDs
+        """
+        all_ids, positions = np.unique(np.concatenate(topics), return_inverse=True)
+        p_word, p_pair = self.probabilities(all_ids)
+
+        coherences = []
+        offset = 0
+        for topic in topics:
+            idx = positions[offset : offset + len(topic)]
+            offset += len(topic)
+            coherences.append(score_topic(p_word[idx], p_pair[np.ix_(idx, idx)], measure))
+
+        return coherences
+
+
+class CooccurrenceAccumulator:
+    """
+    Builds `CooccurrenceStats` for one window size from documents added one at a time, folding
+    them into the sparse counts in bounded-size batches
+    """
+
+    def __init__(self, vocab_size, window_size=None):
+        self.vocab_size = vocab_size
+        self.window_size = window_size
+        self.co_occurrences = sps.csr_matrix((vocab_size, vocab_size), dtype=np.int64)
+        self.num_docs = 0
+        self.batch = []
+        self.batch_entries = 0
+
+    def add(self, ids):
+        self.batch.append(ids)
+        self.batch_entries += len(ids) * (self.window_size or 1)
+        if self.batch_entries >= CHUNK_ENTRIES:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            rows, cols, n_rows = window_entries(self.batch, self.window_size)
+            self.co_occurrences = self.co_occurrences + count_entries(
+                rows, cols, n_rows, self.vocab_size
+            )
+            self.num_docs += n_rows
+        self.batch = []
+        self.batch_entries = 0
+
+    def finish(self):
+        self.flush()
+        return CooccurrenceStats(self.co_occurrences, self.num_docs)
+
+
+def count_entries(rows, cols, n_rows, vocab_size):
+    windows = sps.csr_matrix(
+        (np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=(n_rows, vocab_size)
+    )
+    return (windows.T @ windows).tocsr()
+
+
+def window_entries(docs, window_size=None):
+    """
+    (window, word) pairs for every window of a batch of documents.
+
+    Windows follow gensim's `WordOccurrenceAccumulator` so that scores are comparable with
+    `CoherenceModel`: a document no longer than the window is a single window, and empty
+    documents still count as a window. gensim also updates a document's word set incrementally
+    as the window slides, so a word is dropped as soon as any copy of it leaves the window and
+    added back only when another copy enters; that behaviour is reproduced here.
+    """
+    rows, cols = [], []
+    sliding, sliding_offsets = [], []
+    n_rows = 0
+
+    for ids in docs:
+        if window_size is None or len(ids) <= window_size:
+            words = np.unique(ids[ids >= 0])
+            rows.append(np.full(len(words), n_rows, dtype=np.int64))
+            cols.append(words)
+            n_rows += 1
+        else:
+            sliding.append(ids)
+            sliding_offsets.append(n_rows)
+            n_rows += len(ids) - window_size + 1
+
+    if sliding:
+        sliding_rows, sliding_cols = sliding_window_entries(sliding, sliding_offsets, window_size)
+        rows.append(sliding_rows)
+        cols.append(sliding_cols)
+
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), n_rows
+    return np.concatenate(rows), np.concatenate(cols), n_rows
+
+
+def sliding_window_entries(docs, offsets, window_size):
+    lengths = np.array([len(ids) for ids in docs])
+    n_windows = lengths - window_size + 1
+    ids = np.concatenate(docs)
+    doc = np.repeat(np.arange(len(docs)), lengths)
+    pos = np.arange(len(ids)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    first_row = np.repeat(offsets, lengths)
+    last_row = first_row + np.repeat(n_windows, lengths)
+
+    # Each token enters the window set when it reaches the window's right edge (or is in the
+    # document's first window) and leaves it once it slides past the left edge
+    enter = first_row + np.maximum(0, pos - window_size + 1)
+    leave = first_row + pos + 1
+    has_leave = leave < last_row
+
+    known = ids >= 0
+    has_leave &= known
+    event_word = np.concatenate([ids[known], ids[has_leave]])
+    event_doc = np.concatenate([doc[known], doc[has_leave]])
+    event_row = np.concatenate([enter[known], leave[has_leave]])
+    event_end = np.concatenate([last_row[known], last_row[has_leave]])
+    event_in = np.concatenate([np.ones(known.sum(), bool), np.zeros(has_leave.sum(), bool)])
+
+    # Within a window, gensim removes the departing token before adding the arriving one, so
+    # only the last event for a word in each window matters
+    order = np.lexsort((event_in, event_row, event_word, event_doc))
+    same_word_next = (event_doc[order][1:] == event_doc[order][:-1]) & (
+        event_word[order][1:] == event_word[order][:-1]
+    )
+    same_row_next = same_word_next & (event_row[order][1:] == event_row[order][:-1])
+    order = order[~np.append(same_row_next, False)]
+    event_doc = event_doc[order]
+    event_word = event_word[order]
+    event_row = event_row[order]
+    event_end = event_end[order]
+    event_in = event_in[order]
+
+    # A word stays in the window set from the row it enters until its next event
+    same_word_next = np.append(
+        (event_doc[1:] == event_doc[:-1]) & (event_word[1:] == event_word[:-1]), False
+    )
+    stop = np.where(same_word_next, np.append(event_row[1:], 0), event_end)
+    start = event_row[event_in]
+    span = (stop - event_row)[event_in]
+    words = event_word[event_in]
+
+    rows = np.repeat(start, span) + np.arange(span.sum()) - np.repeat(np.cumsum(span) - span, span)
+    return rows, np.repeat(words, span)
+
+
+def _npmi(p_word, p_pair):
+    pmi = np.log((p_pair + EPSILON) / np.outer(p_word, p_word))
+    return pmi / -np.log(p_pair + EPSILON)
+
+
+def score_topic(p_word, p_pair, measure):
+    """
+    Mean confirmation over one topic's segments, given probabilities for the topic's words in
+    the order the topic ranks them
+    """
+    n = len(p_word)
+    if measure == "u_mass":
+        # s_one_pre segmentation: each word against every higher-ranked word
+        w_prime, w_star = np.tril_indices(n, k=-1)
+        return np.mean(np.log((p_pair[w_prime, w_star] + EPSILON) / p_word[w_star]))
+
+    if measure in ("c_uci", "c_npmi"):
+        # s_one_one segmentation: every ordered pair of distinct words
+        w_prime, w_star = np.nonzero(~np.eye(n, dtype=bool))
+        if measure == "c_uci":
+            pmi = np.log((p_pair + EPSILON) / np.outer(p_word, p_word))
+            return np.mean(pmi[w_prime, w_star])
+        return np.mean(_npmi(p_word, p_pair)[w_prime, w_star])
+
+    if measure == "c_v":
+        # s_one_set segmentation with indirect cosine similarity of NPMI context vectors
+        npmi = _npmi(p_word, p_pair)
+        topic_vector = npmi.sum(axis=0)
+        sims = npmi @ topic_vector / (np.linalg.norm(npmi, axis=1) * np.linalg.norm(topic_vector))
+        return np.mean(sims)
+
+    raise ValueError("Unsupported coherence measure: " + measure)
+
+
+def get_model_topics(model, topn=20):
+    """
+    Top word IDs for each of a model's topics, the way `CoherenceModel` picks them
+    """
+    return [matutils.argsort(topic, topn=topn, reverse=True) for topic in model.get_topics()]
+
+
+def get_word_topics(topics, dictionary):
+    """
+    Convert topics given as lists of words (e.g. from `LdaSeqModel.dtm_coherence`) to word IDs
+    """
+    return [np.array([dictionary.token2id[word] for word in topic]) for topic in topics]
+
+
+class CoherenceEngine:
+    """
+    Scores topics for any number of models trained on one preprocessed corpus.
+
+    Statistics are computed lazily the first time a window size is needed and, if `cache_dir`
+    is given, saved there so later runs on the same corpus can skip computing them entirely.
+    """
+
+    def __init__(self, texts, corpus, dictionary, cache_dir=None):
+        self.texts = texts
+        self.corpus = corpus
+        self.dictionary = dictionary
+        self.cache_dir = cache_dir
+        self.stats = {}
+
+    def get_stats_path(self, window_size):
+        if self.cache_dir is None:
+            return None
+        key = "document" if window_size is None else "window" + str(window_size)
+        return self.cache_dir + "/cooccurrence_" + key + ".npz"
+
+    def save_stats(self, window_size, stats):
+        savepath = self.get_stats_path(window_size)
+        if savepath is not None:
+            tmp_path = savepath[: -len(".npz")] + ".tmp" + str(os.getpid()) + ".npz"
+            stats.save(tmp_path)
+            os.replace(tmp_path, savepath)
+
+    def precompute(self, measures):
+        """
+        Make sure statistics exist for every measure given, computing whatever is missing in a
+        single pass over the texts
+        """
+        missing = set()
+        for measure in measures:
+            window_size = WINDOW_SIZES[measure]
+            if window_size in self.stats:
+                continue
+            savepath = self.get_stats_path(window_size)
+            if savepath is not None and os.path.isfile(savepath):
+                self.stats[window_size] = CooccurrenceStats.load(savepath)
+            else:
+                missing.add(window_size)
+
+        if not missing:
+            return
+
+        # Boolean documents alone don't need the texts; the corpus has the same information
+        if missing == {None}:
+            computed = {
+                None: CooccurrenceStats.from_corpus(self.corpus, len(self.dictionary.token2id))
+            }
+        else:
+            computed = CooccurrenceStats.from_texts_multi(self.texts, self.dictionary, missing)
+
+        for window_size, stats in computed.items():
+            self.save_stats(window_size, stats)
+            self.stats[window_size] = stats
+
+    def get_stats(self, measure):
+        self.precompute([measure])
+        return self.stats[WINDOW_SIZES[measure]]
+
+    def get_coherence_per_topic(self, topics, measure="c_v"):
+        return self.get_stats(measure).topic_coherences(topics, measure)
+
+    def get_coherence(self, topics, measure="c_v"):
+        return float(np.mean(self.get_coherence_per_topic(topics, measure)))
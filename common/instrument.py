@@ -0,0 +1,148 @@
+"""
+Per-stage instrumentation. A `StageTimer` records each stage's wall time, CPU time, peak resident
+memory and document throughput, for `metadata.json` and optionally a JSON lines log.
+
+`peak_rss_mb` is sampled every `RSS_SAMPLE_INTERVAL` seconds while the stage runs (Linux only).
+`process_peak_rss_mb` is the process' own peak, including its finished child processes.
+"""
+
+import os, sys, json, time, threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# Seconds between samples of the resident set size while a stage runs
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+def get_cpu_time():
+    # Includes finished child processes, e.g. gensim's worker pool
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def get_rss_mb():
+    # Current resident set size of this process, or None where /proc isn't available
+    try:
+        with open("/proc/self/statm", "r") as infile:
+            pages = int(infile.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+@contextmanager
+def sample_peak_rss(interval=RSS_SAMPLE_INTERVAL):
+    """
+    Sample this process' resident set size in a background thread while the `with` block runs.
+    The yielded dict's `rss_mb` holds the largest sample, or None if it can't be read.
+    """
+    peak = {"rss_mb": get_rss_mb()}
+    if peak["rss_mb"] is None:
+        yield peak
+        return
+
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            peak["rss_mb"] = max(peak["rss_mb"], get_rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield peak
+    finally:
+        done.set()
+        sampler.join()
+        peak["rss_mb"] = max(peak["rss_mb"], get_rss_mb())
+
+
+def get_process_peak_rss_mb():
+    if resource is None:
+        return None
+
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+    # ru_maxrss is in bytes on macOS and kilobytes everywhere else
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+class StageTimer:
+    """
+    Records every stage run inside `stage()`. A stage that runs more than once (e.g. once per
+    chunk of a streamed data file) is summed into a single record.
+
+    If `log_path` is set, every stage is also appended to that file as a JSON line, together
+    with `context` (e.g. the experiment name, topic count and trial).
+    """
+
+    def __init__(self, log_path=None, **context):
+        self.stages = {}
+        self.log_path = log_path
+        self.context = context
+
+    def child(self, **context):
+        """
+        A new timer logging to the same file, with extra context
+        """
+        return StageTimer(self.log_path, **(self.context | context))
+
+    @contextmanager
+    def stage(self, name, n_docs=None):
+        """
+        Time the body of a `with` block. The yielded dict can be used to set `n_docs` once it's
+        known, e.g. after parsing a file.
+        """
+        info = {"n_docs": n_docs}
+        wall_start = time.perf_counter()
+        cpu_start = get_cpu_time()
+        with sample_peak_rss() as peak:
+            yield info
+
+        record = {
+            "wall_time": time.perf_counter() - wall_start,
+            "cpu_time": get_cpu_time() - cpu_start,
+            "peak_rss_mb": peak["rss_mb"],
+            "process_peak_rss_mb": get_process_peak_rss_mb(),
+        }
+        if info["n_docs"] is not None:
+            record["n_docs"] = info["n_docs"]
+        self.add(name, record)
+        self.log(name, record)
+
+    def add(self, name, record):
+        if name in self.stages:
+            total = self.stages[name]
+            total["wall_time"] += record["wall_time"]
+            total["cpu_time"] += record["cpu_time"]
+            for key in ["peak_rss_mb", "process_peak_rss_mb"]:
+                if record[key] is not None:
+                    total[key] = max(total.get(key) or 0, record[key])
+            if "n_docs" in record:
+                total["n_docs"] = total.get("n_docs", 0) + record["n_docs"]
+        else:
+            total = dict(record)
+            self.stages[name] = total
+
+        if "n_docs" in total and total["wall_time"] > 0:
+            total["docs_per_sec"] = total["n_docs"] / total["wall_time"]
+
+    def log(self, name, record):
+        if self.log_path is None:
+            return
+
+        line = json.dumps({"time": time.time(), "stage": name} | self.context | record)
+
+        # One write per line so concurrent trials appending to the same log don't interleave
+        with open(self.log_path, "a") as output:
+            output.write(line + "\n")
@@ -0,0 +1,49 @@
+"""
+Per-trial completion manifests. A manifest is written atomically once a unit of work (an LDA
+trial, a trained dynamic model, a time slice's coherence) has finished, so an interrupted sweep
+can be resumed without redoing it and its aggregated statistics can be rebuilt from disk.
+"""
+
+import os, json, time
+
+
+def write_json_atomic(path, obj):
+    # Write to a scratch file first so a crash never leaves a half-written file behind
+    tmp_path = path + ".tmp" + str(os.getpid())
+    with open(tmp_path, "w") as output:
+        json.dump(obj, output)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_manifest(path, record):
+    write_json_atomic(path, {"completed": time.time(), "record": record})
+
+
+def read_manifest(path):
+    """
+    Return the record saved in the manifest at `path`, or None if that work never finished
+    """
+    try:
+        with open(path, "r") as infile:
+            return json.load(infile)["record"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+
+
+def remove_manifest(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def clear_manifests(manifest_dir, prefix=""):
+    """
+    Remove the manifests in `manifest_dir` whose names start with `prefix` (a string or tuple of
+    strings), so work about to be redone isn't resumed from an earlier run's records
+    """
+    for filename in os.listdir(manifest_dir):
+        if filename.startswith(prefix) and filename.endswith(".json"):
+            remove_manifest(manifest_dir + "/" + filename)
@@ -0,0 +1,297 @@
+"""
+The preprocessing pipeline every script runs on an experiment's dataset: time filter -> attribute
+filters -> replace/remove before stemming -> lemmatize/stem -> replace/remove after stemming.
+
+Replace/remove phases use a `RuleSet` (see `rules.py`), checked on a sample against ogm.
+Lemmatizing is done once per distinct token, kept in a memo in the preprocessing cache directory,
+and checked against ogm on whole documents.
+"""
+
+import os, pickle, random
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from gensim.utils import simple_preprocess
+from ogm.trainer import TextTrainer
+from common import cache
+from common.instrument import StageTimer
+from common.rules import RuleSet
+
+# Documents compared against ogm's replace/remove rules on every run
+CHECK_SAMPLE_SIZE = 200
+
+# Most documents compared against whole-document lemmatizing on every run
+LEMMA_CHECK_SIZE = 2000
+
+
+def get_ogm_version():
+    try:
+        from importlib.metadata import version
+
+        return version("ogm")
+    except Exception:
+        return "unknown"
+
+
+def get_memo_path():
+    # Lemmas depend on the lemmatizer, so a new ogm version starts a new memo
+    return cache.get_cache_dir() + "/lemma_memo_" + get_ogm_version() + ".pkl"
+
+
+def load_memo():
+    try:
+        with open(get_memo_path(), "rb") as infile:
+            return pickle.load(infile)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return {}
+
+
+def save_memo(memo):
+    path = get_memo_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp" + str(os.getpid())
+    with open(tmp_path, "wb") as output:
+        pickle.dump(memo, output, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def lemmatize_chunk(strings):
+    # Run ogm's lemmatizer over a column of strings; used in the worker processes
+    trainer = TextTrainer()
+    trainer.data = pd.DataFrame({"text": strings})
+    trainer.lemmatize_stem_words("text")
+    return dict(zip(strings, trainer.get_attribute_list("text")))
+
+
+def lemmatize_distinct(strings, n_processes):
+    """
+    Map each of the distinct `strings` to its lemmatized token list, in parallel
+    """
+    strings = list(strings)
+    if n_processes <= 1 or len(strings) < 1000:
+        return lemmatize_chunk(strings) if strings else {}
+
+    # A few chunks per process evens out the load
+    chunk_size = -(-len(strings) // (n_processes * 4))
+    chunks = [strings[i : i + chunk_size] for i in range(0, len(strings), chunk_size)]
+    lemmas = {}
+    with ProcessPoolExecutor(max_workers=n_processes) as pool:
+        for result in pool.map(lemmatize_chunk, chunks):
+            lemmas |= result
+    return lemmas
+
+
+def get_check_documents(docs, doc_tokens, n_check):
+    # The first documents, in order, that each have a token no earlier one checked has
+    checked = []
+    seen = set()
+    for d in docs:
+        if len(checked) >= n_check:
+            break
+        if not seen.issuperset(doc_tokens[d]):
+            checked.append(d)
+            seen.update(doc_tokens[d])
+    return checked, len(seen)
+
+
+def lemmatize(data, text_key, n_processes=None, memo=None, n_check=LEMMA_CHECK_SIZE):
+    """
+    Lemmatize and stem the `text_key` column of `data` as ogm's `lemmatize_stem_words` would,
+    and return it as a new column. Its `attrs["lemma_check"]` says how the token-wise lemmas
+    were checked against ogm.
+
+    A long-running process can pass its own `memo` to keep it in memory between calls; it's
+    updated in place and never saved here. Up to `n_check` documents are checked against ogm:
+    the first ones with a token not yet checked, so every token is checked in context if the
+    documents allow.
+    """
+    if n_processes is None:
+        n_processes = os.cpu_count()
+
+    docs = [d for d in pd.unique(data[text_key]) if isinstance(d, str)]
+    doc_tokens = {d: simple_preprocess(d) for d in docs}
+
+    # Only tokens never seen before need the lemmatizer
+    save = memo is None
+    if memo is None:
+        memo = load_memo()
+    new_tokens = {t for tokens in doc_tokens.values() for t in tokens if t not in memo}
+    memo |= lemmatize_distinct(sorted(new_tokens), n_processes)
+    lemmatized = {d: [l for t in tokens for l in memo[t]] for d, tokens in doc_tokens.items()}
+
+    # Make sure token-wise lemmatizing gives the same documents as ogm does
+    checked, n_covered = get_check_documents(docs, doc_tokens, n_check)
+    expected = lemmatize_chunk(checked) if checked else {}
+    matches = all(lemmatized[d] == expected[d] for d in checked)
+    if matches:
+        if new_tokens and save:
+            save_memo(memo)
+    else:
+        print("Token-wise lemmatizing doesn't match ogm; lemmatizing whole documents instead")
+        lemmatized = lemmatize_distinct(docs, n_processes)
+
+    # Anything that isn't a string goes through ogm as it is
+    others = [d for d in pd.unique(data[text_key]) if not isinstance(d, str)]
+    if others:
+        lemmatized |= lemmatize_chunk(others)
+
+    lemmas = pd.Series([lemmatized[d] for d in data[text_key]], index=data.index, dtype=object)
+    lemmas.attrs["lemma_check"] = {
+        "n_documents": len(checked),
+        "n_tokens": n_covered,
+        "n_distinct_tokens": len({t for tokens in doc_tokens.values() for t in tokens}),
+        "token_wise": matches,
+    }
+    return lemmas
+
+
+def apply_rules_ogm(data, text_key, replacements, removals):
+    # A phase's replacements and removals as ogm applies them
+    trainer = TextTrainer()
+    trainer.data = data.copy()
+    n_removed = 0
+    if replacements:
+        trainer.replace_words(text_key, replacements)
+    if removals:
+        n_removed = trainer.remove_words(text_key, set(removals))
+    return list(trainer.data[text_key]), n_removed
+
+
+def apply_rules(data, text_key, replacements, removals, n_check=CHECK_SAMPLE_SIZE, verbose=True):
+    """
+    Apply a phase's replacements and removals to the `text_key` column of `data`. `n_check`
+    documents are compared against ogm's `replace_words`/`remove_words`.
+    """
+    rules = RuleSet(replacements, removals)
+    if not rules:
+        return data
+
+    # Phrases in token lists are left to ogm
+    if not rules.single_token and any(isinstance(t, list) for t in data[text_key]):
+        texts, n_removed = apply_rules_ogm(data, text_key, replacements, removals)
+    else:
+        texts, n_removed = rules.apply_column(data[text_key])
+
+        # Make sure the compiled rules give the same documents and removal count as ogm does
+        sample = random.Random(0).sample(range(data.shape[0]), min(n_check, data.shape[0]))
+        if sample:
+            sample_data = data.iloc[sample]
+            expected, expected_removed = apply_rules_ogm(
+                sample_data, text_key, replacements, removals
+            )
+            _, sample_removed = rules.apply_column(sample_data[text_key])
+            if [texts[i] for i in sample] != expected or sample_removed != expected_removed:
+                print("Compiled rules don't match ogm; applying them with ogm instead")
+                texts, n_removed = apply_rules_ogm(data, text_key, replacements, removals)
+
+    if removals and verbose:
+        print("Removed " + str(n_removed) + " instances of", removals)
+    return data.assign(**{text_key: pd.Series(texts, index=data.index, dtype=object)})
+
+
+def preprocess_data(setup_dict, data, timer=None, memo=None, verbose=True):
+    """
+    Run the pipeline on an already parsed data table, e.g. one chunk of a streamed file. A
+    lemma `memo` kept between calls is updated in place and never saved here, as in `lemmatize`.
+    Without `verbose`, the post and removal counts aren't printed.
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    trainer = TextTrainer()
+    trainer.data = data
+    text_key = setup_dict["text_key"]
+
+    if "time_filter" in setup_dict:
+        time_filter = setup_dict["time_filter"]
+        # Without an end, keep everything up to now
+        end = (
+            time_filter["end"]
+            if "end" in time_filter
+            else pd.Timestamp.now().strftime(time_filter["arg_format"])
+        )
+        with timer.stage("time_filter", n_docs=trainer.data.shape[0]):
+            trainer.filter_within_time_range(
+                col=time_filter["time_key"],
+                data_format=time_filter.get("data_format"),
+                input_format=time_filter["arg_format"],
+                start=time_filter["start"],
+                end=end,
+            )
+
+    if "attribute_filters" in setup_dict:
+        with timer.stage("attribute_filters", n_docs=trainer.data.shape[0]):
+            for attr_filter in setup_dict["attribute_filters"]:
+                trainer.filter_data(attr_filter["filter_key"], set(attr_filter["filter_vals"]))
+
+    if verbose:
+        print("Found " + str(trainer.data.shape[0]) + " posts")
+    n_docs = trainer.data.shape[0]
+
+    with timer.stage("replace_remove", n_docs=n_docs):
+        trainer.data = apply_rules(
+            trainer.data,
+            text_key,
+            setup_dict.get("replace_before_stemming"),
+            setup_dict.get("remove_before_stemming"),
+            verbose=verbose,
+        )
+
+    with timer.stage("lemmatize", n_docs=n_docs):
+        lemmas = lemmatize(trainer.data, text_key, setup_dict.get("preprocess_processes"), memo)
+        trainer.data = trainer.data.assign(**{text_key: lemmas})
+        lemma_check = lemmas.attrs["lemma_check"]
+
+    # Counted as the same stage as the replacements and removals before stemming
+    with timer.stage("replace_remove"):
+        trainer.data = apply_rules(
+            trainer.data,
+            text_key,
+            setup_dict.get("replace_after_stemming"),
+            setup_dict.get("remove_after_stemming"),
+            verbose=verbose,
+        )
+
+    trainer.data.attrs["lemma_check"] = lemma_check
+    return trainer.data
+
+
+def preprocess_texts(setup_dict, texts, memo=None, n_check=CHECK_SAMPLE_SIZE):
+    """
+    Run the text steps of the pipeline (replace/remove, lemmatize/stem, replace/remove) on new
+    documents, e.g. ones to infer topics for, and return their token lists. The filters don't
+    apply to documents without the dataset's other columns. `n_check` documents are checked
+    against ogm at each step.
+    """
+    text_key = setup_dict["text_key"]
+    data = pd.DataFrame({text_key: pd.Series(list(texts), dtype=object)})
+    data = apply_rules(
+        data,
+        text_key,
+        setup_dict.get("replace_before_stemming"),
+        setup_dict.get("remove_before_stemming"),
+        n_check,
+    )
+    lemmas = lemmatize(data, text_key, setup_dict.get("preprocess_processes"), memo, n_check)
+    data = apply_rules(
+        data.assign(**{text_key: lemmas}),
+        text_key,
+        setup_dict.get("replace_after_stemming"),
+        setup_dict.get("remove_after_stemming"),
+        n_check,
+    )
+    return list(data[text_key])
+
+
+def preprocess_file(setup_dict, data_file, timer=None):
+    """
+    Parse `data_file` and run the pipeline on it
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    trainer = TextTrainer()
+    with timer.stage("parse") as stage:
+        trainer.parse_file(data_file)
+        stage["n_docs"] = trainer.data.shape[0]
+
+    return preprocess_data(setup_dict, trainer.data, timer)
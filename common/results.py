@@ -0,0 +1,351 @@
+"""
+An SQLite index of every experiment's `metadata.json` files, kept at `$RESULTS_DB` (defaults to
+`$MODEL_DIR/results.sqlite`).
+
+Each `metadata.json` is recorded in one transaction per topic count: the `aggregated` section,
+trials (`model_i`, `update_i`) and time slices (`time_i`), with per-topic coherences kept as
+float32 arrays. Queries import any `metadata.json` that is new or newer than its rows;
+`import_results.py` imports whole experiments.
+"""
+
+import os, json, sqlite3
+import numpy as np
+from contextlib import closing
+from common.manifest import write_json_atomic
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS topic_counts (
+    experiment TEXT NOT NULL,
+    topics INTEGER NOT NULL,
+    avg_coherence REAL,
+    info TEXT NOT NULL,
+    PRIMARY KEY (experiment, topics)
+);
+CREATE TABLE IF NOT EXISTS trials (
+    experiment TEXT NOT NULL,
+    topics INTEGER NOT NULL,
+    trial TEXT NOT NULL,
+    path TEXT,
+    coherence REAL,
+    info TEXT NOT NULL,
+    PRIMARY KEY (experiment, topics, trial)
+);
+CREATE INDEX IF NOT EXISTS trials_by_coherence ON trials (experiment, topics, coherence);
+CREATE TABLE IF NOT EXISTS time_slices (
+    experiment TEXT NOT NULL,
+    topics INTEGER NOT NULL,
+    time_slice INTEGER NOT NULL,
+    start_time TEXT,
+    coherence REAL,
+    info TEXT NOT NULL,
+    PRIMARY KEY (experiment, topics, time_slice)
+);
+CREATE TABLE IF NOT EXISTS topic_coherences (
+    experiment TEXT NOT NULL,
+    topics INTEGER NOT NULL,
+    entry TEXT NOT NULL,
+    measure_key TEXT NOT NULL,
+    coherences BLOB NOT NULL,
+    PRIMARY KEY (experiment, topics, entry, measure_key)
+);
+CREATE TABLE IF NOT EXISTS metadata_files (
+    experiment TEXT NOT NULL,
+    topics INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    PRIMARY KEY (experiment, topics)
+);
+CREATE TABLE IF NOT EXISTS experiment_dirs (
+    experiment TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+"""
+
+# Keys of metadata.json entries stored as trials and time slices; everything else is kept
+# with the topic count
+TRIAL_PREFIXES = ("model_", "update_")
+TIME_SLICE_PREFIX = "time_"
+
+# Keys of trial and time slice entries holding per-topic coherences, one per measure; they're
+# stored as float32 arrays rather than in the entries' JSON
+TOPIC_COHERENCES_KEY = "topic_coherences"
+
+
+def get_db_path():
+    return os.getenv("RESULTS_DB") or os.getenv("MODEL_DIR") + "/results.sqlite"
+
+
+def connect():
+    path = get_db_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    # Trials finishing at the same time wait for each other's transactions
+    conn = sqlite3.connect(path, timeout=60)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def get_metadata_path(experiment, num_topics):
+    return (
+        os.getenv("MODEL_DIR") + "/" + experiment + "/" + str(num_topics) + "topics/metadata.json"
+    )
+
+
+def to_real(value):
+    # Missing and non-finite scores are stored as NULL so they never sort as the best
+    if value is None or not np.isfinite(value):
+        return None
+    return float(value)
+
+
+def record_metadata(conn, experiment, num_topics, metadata, mtime=None):
+    """
+    Replace everything recorded for one topic count with the contents of its `metadata`. `mtime`
+    is the modification time of the `metadata.json` file it was read from or written to.
+    """
+    with conn:
+        for table in [
+            "topic_counts",
+            "trials",
+            "time_slices",
+            "topic_coherences",
+            "metadata_files",
+        ]:
+            conn.execute(
+                "DELETE FROM " + table + " WHERE experiment = ? AND topics = ?",
+                (experiment, num_topics),
+            )
+
+        others = {}
+        for key, entry in metadata.items():
+            if key.startswith(TRIAL_PREFIXES + (TIME_SLICE_PREFIX,)):
+                entry = record_topic_coherences(conn, experiment, num_topics, key, entry)
+
+            if key.startswith(TRIAL_PREFIXES):
+                conn.execute(
+                    "INSERT INTO trials VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        experiment,
+                        num_topics,
+                        key,
+                        entry.get("path"),
+                        to_real(entry.get("coherence")),
+                        json.dumps(entry),
+                    ),
+                )
+            elif key.startswith(TIME_SLICE_PREFIX):
+                conn.execute(
+                    "INSERT INTO time_slices VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        experiment,
+                        num_topics,
+                        int(key[len(TIME_SLICE_PREFIX) :]),
+                        entry.get("start_time"),
+                        to_real(entry.get("coherence")),
+                        json.dumps(entry),
+                    ),
+                )
+            else:
+                others[key] = entry
+
+        conn.execute(
+            "INSERT INTO topic_counts VALUES (?, ?, ?, ?)",
+            (
+                experiment,
+                num_topics,
+                to_real(others.get("aggregated", {}).get("avg_coherence")),
+                json.dumps(others),
+            ),
+        )
+        if mtime is not None:
+            conn.execute(
+                "INSERT INTO metadata_files VALUES (?, ?, ?)", (experiment, num_topics, mtime)
+            )
+
+
+def record_topic_coherences(conn, experiment, num_topics, key, entry):
+    # Returns the entry without its per-topic coherences
+    stripped = {}
+    for name, value in entry.items():
+        if name.startswith(TOPIC_COHERENCES_KEY):
+            coherences = np.array([np.nan if c is None else c for c in value], dtype=np.float32)
+            conn.execute(
+                "INSERT INTO topic_coherences VALUES (?, ?, ?, ?, ?)",
+                (experiment, num_topics, key, name, coherences.tobytes()),
+            )
+        else:
+            stripped[name] = value
+    return stripped
+
+
+def save_metadata(experiment, num_topics, metadata):
+    """
+    Write a topic count's `metadata.json` and record it in the results database
+    """
+    path = get_metadata_path(experiment, num_topics)
+    write_json_atomic(path, metadata)
+    with closing(connect()) as conn:
+        record_metadata(conn, experiment, num_topics, metadata, os.path.getmtime(path))
+
+
+def get_experiment_dir(experiment):
+    return os.getenv("MODEL_DIR") + "/" + experiment
+
+
+def list_metadata_files(experiment):
+    # (number of topics, metadata.json path) of every topic count of an experiment that has one
+    experiment_dir = get_experiment_dir(experiment)
+    if not os.path.isdir(experiment_dir):
+        return []
+
+    files = []
+    for d in sorted(os.listdir(experiment_dir)):
+        path = experiment_dir + "/" + d + "/metadata.json"
+        if d.endswith("topics") and d[: -len("topics")].isdigit() and os.path.isfile(path):
+            files.append((int(d[: -len("topics")]), path))
+    return files
+
+
+def import_topic_count(conn, experiment, num_topics, path):
+    # Returns whether the file could be read; it may be gone or half-written by another process
+    try:
+        mtime = os.path.getmtime(path)
+        with open(path, "r") as infile:
+            metadata = json.load(infile)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    record_metadata(conn, experiment, num_topics, metadata, mtime)
+    return True
+
+
+def get_dir_mtime(experiment):
+    try:
+        return os.path.getmtime(get_experiment_dir(experiment))
+    except FileNotFoundError:
+        return None
+
+
+def record_scan(conn, experiment, dir_mtime):
+    # The experiment directory's modification time when its files were last scanned; taken
+    # before the scan, so anything added during it is scanned again next time
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO experiment_dirs VALUES (?, ?)", (experiment, dir_mtime)
+        )
+
+
+def import_experiment(conn, experiment):
+    """
+    Record every topic count of an experiment that has a `metadata.json`. Returns how many
+    were imported.
+    """
+    dir_mtime = get_dir_mtime(experiment)
+    n_imported = 0
+    for num_topics, path in list_metadata_files(experiment):
+        n_imported += import_topic_count(conn, experiment, num_topics, path)
+    if dir_mtime is not None:
+        record_scan(conn, experiment, dir_mtime)
+    return n_imported
+
+
+def ensure_imported(conn, experiment):
+    # Each recorded topic count costs one stat call; the directory is only listed again when it
+    # changed since the last scan, i.e. a topic count may have been added
+    dir_mtime = get_dir_mtime(experiment)
+    if dir_mtime is None:
+        return
+    recorded = dict(
+        conn.execute(
+            "SELECT topics, mtime FROM metadata_files WHERE experiment = ?", (experiment,)
+        ).fetchall()
+    )
+    row = conn.execute(
+        "SELECT mtime FROM experiment_dirs WHERE experiment = ?", (experiment,)
+    ).fetchone()
+    dir_changed = row is None or row[0] != dir_mtime
+    if dir_changed:
+        files = list_metadata_files(experiment)
+    else:
+        files = [(n, get_metadata_path(experiment, n)) for n in sorted(recorded)]
+
+    # Topic counts whose metadata.json has no row yet, or is newer than the one recorded
+    for num_topics, path in files:
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            continue
+        if num_topics not in recorded or mtime > recorded[num_topics]:
+            import_topic_count(conn, experiment, num_topics, path)
+    if dir_changed:
+        record_scan(conn, experiment, dir_mtime)
+
+
+def get_aggregates(experiment):
+    """
+    The `aggregated` section of each topic count of an experiment, by number of topics
+    """
+    with closing(connect()) as conn:
+        ensure_imported(conn, experiment)
+        rows = conn.execute(
+            "SELECT topics, info FROM topic_counts WHERE experiment = ? ORDER BY topics",
+            (experiment,),
+        ).fetchall()
+
+    aggregates = {}
+    for topics, info in rows:
+        info = json.loads(info)
+        if "aggregated" in info:
+            aggregates[topics] = info["aggregated"]
+    return aggregates
+
+
+def get_time_slices(experiment, num_topics=None):
+    """
+    Each time slice's metadata entry, in order, by number of topics
+    """
+    query = "SELECT topics, info FROM time_slices WHERE experiment = ?"
+    params = (experiment,)
+    if num_topics is not None:
+        query += " AND topics = ?"
+        params += (num_topics,)
+
+    with closing(connect()) as conn:
+        ensure_imported(conn, experiment)
+        rows = conn.execute(query + " ORDER BY topics, time_slice", params).fetchall()
+
+    slices = {}
+    for topics, info in rows:
+        slices.setdefault(topics, []).append(json.loads(info))
+    return slices
+
+
+def get_best_trial(experiment, num_topics):
+    """
+    Directory and coherence of the highest-coherence trial of a topic count, or (None, None)
+    """
+    with closing(connect()) as conn:
+        ensure_imported(conn, experiment)
+        row = conn.execute(
+            "SELECT path, coherence FROM trials WHERE experiment = ? AND topics = ? "
+            + "AND trial LIKE 'model~_%' ESCAPE '~' AND coherence IS NOT NULL "
+            + "ORDER BY coherence DESC LIMIT 1",
+            (experiment, num_topics),
+        ).fetchone()
+
+    return row if row is not None else (None, None)
+
+
+def get_topic_coherences(experiment, num_topics, measure_key=TOPIC_COHERENCES_KEY):
+    """
+    Per-topic coherence arrays of every trial and time slice of a topic count that has them, by
+    metadata key (`model_i`, `time_i`, ...). `measure_key` picks the measure, as named in
+    metadata.json (`topic_coherences` for C_V, `topic_coherences_u_mass`, ...).
+    """
+    with closing(connect()) as conn:
+        ensure_imported(conn, experiment)
+        rows = conn.execute(
+            "SELECT entry, coherences FROM topic_coherences "
+            + "WHERE experiment = ? AND topics = ? AND measure_key = ?",
+            (experiment, num_topics, measure_key),
+        ).fetchall()
+
+    return {entry: np.frombuffer(coherences, dtype=np.float32) for entry, coherences in rows}
@@ -0,0 +1,168 @@
+"""
+A preprocessing phase's replacement and removal rules, applied to a whole column at once.
+
+Before stemming, documents are strings and the rules are substrings, applied the way sequential
+`str.replace` calls would be: each replacement in config order, then each removal. Consecutive
+rules whose keys and outputs can't share characters are grouped into a stage, compiled into one
+regex and applied in one scan of the string. Deleting text can join it into a new match, so if a
+stage that deletes leaves any of its keys in a document, the stage is redone one rule at a time.
+
+After stemming, documents are token lists. Only single-token replacements and removals are
+handled here, as one lookup per token; `preprocess.apply_rules` leaves phrases to ogm.
+"""
+
+import re
+
+
+def suffix_is_prefix(a, b):
+    # Whether a proper suffix of string `a` is a prefix of string `b`
+    return any(b.startswith(a[i:]) for i in range(1, len(a)))
+
+
+def strings_overlap(a, b):
+    # Whether occurrences of `a` and `b` can share characters in some string
+    return a in b or b in a or suffix_is_prefix(a, b) or suffix_is_prefix(b, a)
+
+
+def is_token(word):
+    return bool(word) and word.split() == [word]
+
+
+class SubstringStage:
+    """
+    Consecutive substring rules that can be applied together in one scan of a string
+    """
+
+    def __init__(self):
+        self.rules = []
+        self.index = {}
+        self.pattern = None
+        self.has_deletion = False
+
+    def conflicts(self, key, output):
+        # A key that overlaps itself is applied on its own, since where its matches fall can
+        # depend on the rules before it
+        if suffix_is_prefix(key, key) or any(suffix_is_prefix(k, k) for k, _, _ in self.rules):
+            return True
+        return any(
+            strings_overlap(key, k)
+            or (o and strings_overlap(key, o))
+            or (output and strings_overlap(output, k))
+            for k, o, _ in self.rules
+        )
+
+    def add(self, key, output, is_removal):
+        self.index[key] = len(self.rules)
+        self.rules.append((key, output, is_removal))
+        self.has_deletion |= not output
+
+    def compile(self):
+        # Longest first, though no key of a stage can contain another
+        keys = sorted((k for k, _, _ in self.rules), key=len, reverse=True)
+        self.pattern = re.compile("|".join(re.escape(k) for k in keys))
+
+    def apply_sequentially(self, text):
+        n_removed = 0
+        for key, output, is_removal in self.rules:
+            if is_removal:
+                n_removed += text.count(key)
+            text = text.replace(key, output)
+        return text, n_removed
+
+    def apply(self, text):
+        """
+        Returns the new string and how many removals were made
+        """
+        n_removed = 0
+
+        def substitute(match):
+            nonlocal n_removed
+            _, output, is_removal = self.rules[self.index[match.group()]]
+            n_removed += is_removal
+            return output
+
+        result = self.pattern.sub(substitute, text)
+
+        # A deletion joined text into a key that sequential replacements could have matched
+        if self.has_deletion and self.pattern.search(result):
+            return self.apply_sequentially(text)
+        return result, n_removed
+
+
+class RuleSet:
+    """
+    A phase's `replacements` (dict of phrase -> replacement phrase, applied in order) and
+    `removals` (phrases to delete), compiled into as few single-scan stages as possible
+    """
+
+    def __init__(self, replacements=None, removals=None):
+        self.replacements = [(k, v) for k, v in (replacements or {}).items() if k]
+        self.removals = [k for k in (removals or []) if k]
+
+        # Substring rules for documents that are still strings
+        self.text_stages = []
+        for key, output in self.replacements:
+            self.get_text_stage(key, output).add(key, output, False)
+        for key in self.removals:
+            self.get_text_stage(key, "").add(key, "", True)
+        for stage in self.text_stages:
+            stage.compile()
+
+        # Token rules for documents that are token lists
+        self.single_token = all(is_token(k) and is_token(v) for k, v in self.replacements) and all(
+            is_token(k) for k in self.removals
+        )
+        self.token_map = {}
+        if self.single_token:
+            for key, output in self.replacements:
+                # Tokens that have become `key` by now are replaced too
+                for token, current in self.token_map.items():
+                    if current == key:
+                        self.token_map[token] = output
+                self.token_map.setdefault(key, output)
+        self.removed_tokens = set(self.removals)
+
+    def get_text_stage(self, key, output):
+        # Substring rules keep their config order, so a rule joins the last stage or starts one
+        if not self.text_stages or self.text_stages[-1].conflicts(key, output):
+            self.text_stages.append(SubstringStage())
+        return self.text_stages[-1]
+
+    def __bool__(self):
+        return bool(self.replacements or self.removals)
+
+    def apply_text(self, text):
+        """
+        Returns the new string and how many removals were made
+        """
+        n_removed = 0
+        for stage in self.text_stages:
+            text, n = stage.apply(text)
+            n_removed += n
+        return text, n_removed
+
+    def apply(self, tokens):
+        """
+        Returns the new token list and how many tokens were removed; only for `single_token` rules
+        """
+        tokens = [self.token_map.get(t, t) for t in tokens]
+        result = [t for t in tokens if t not in self.removed_tokens]
+        return result, len(tokens) - len(result)
+
+    def apply_column(self, texts):
+        """
+        Apply the rules to every document of a column, either strings (before stemming) or token
+        lists (after). Returns the new documents and the number of phrases removed.
+        """
+        result = []
+        n_removed = 0
+        for text in texts:
+            if isinstance(text, str):
+                text, n = self.apply_text(text)
+            elif isinstance(text, list):
+                text, n = self.apply(text)
+            else:
+                n = 0
+            result.append(text)
+            n_removed += n
+        return result, n_removed
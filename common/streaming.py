@@ -0,0 +1,149 @@
+"""
+Out-of-core corpus building for datasets too large to preprocess in memory.
+
+The data file is read and preprocessed in chunks; tokenized texts go to a JSON lines file and the
+BoW corpus to a Matrix Market file, both read back from disk.
+"""
+
+import os, json, shutil, time
+import pandas as pd
+from gensim.corpora import Dictionary, MmCorpus
+from common import cache, preprocess
+from common.instrument import StageTimer
+from common.manifest import write_json_atomic
+
+
+def starts_with_array(data_file):
+    with open(data_file, "r") as infile:
+        while True:
+            c = infile.read(1)
+            if not c.isspace():
+                return c == "["
+
+
+def iter_data_chunks(data_file, chunk_size):
+    """
+    Yield the data table in DataFrames of at most `chunk_size` rows
+    """
+    ext = os.path.splitext(data_file)[1].lower()
+    if ext == ".csv":
+        yield from pd.read_csv(data_file, chunksize=chunk_size)
+    elif ext == ".tsv":
+        yield from pd.read_csv(data_file, sep="\t", chunksize=chunk_size)
+    elif ext in (".json", ".jsonl"):
+        # Only JSON lines can be split into chunks without parsing the whole file
+        if starts_with_array(data_file):
+            raise ValueError(
+                "Streaming mode reads JSON files as JSON lines, one record per line, but "
+                + data_file
+                + " is a JSON array; convert it to JSON lines or turn streaming off"
+            )
+        yield from pd.read_json(data_file, lines=True, chunksize=chunk_size)
+    elif ext == ".parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(data_file).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        raise ValueError("Streaming mode can't read " + ext + " files in chunks: " + data_file)
+
+
+class StreamedTexts:
+    """
+    Re-iterable view of the tokenized texts saved on disk
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, "r") as infile:
+            for line in infile:
+                yield json.loads(line)
+
+
+def build_streamed_corpus(entry_path, preprocessed_chunks, text_key):
+    """
+    Write texts, dictionary and corpus for an iterable of preprocessed DataFrame chunks
+    """
+    tmp_path = entry_path + ".tmp" + str(os.getpid())
+    os.makedirs(tmp_path, exist_ok=True)
+
+    dictionary = Dictionary()
+    n_docs = 0
+    lemma_checks = []
+    with open(tmp_path + "/texts.jsonl", "w") as output:
+        for chunk in preprocessed_chunks:
+            texts = list(chunk[text_key])
+            dictionary.add_documents(texts)
+            for text in texts:
+                output.write(json.dumps(list(text)) + "\n")
+            n_docs += len(texts)
+            lemma_checks.append(chunk.attrs.get("lemma_check"))
+            print("Preprocessed", n_docs, "posts so far")
+
+    dictionary.save(tmp_path + "/dictionary.dict")
+    MmCorpus.serialize(
+        tmp_path + "/corpus.mm",
+        (dictionary.doc2bow(text) for text in StreamedTexts(tmp_path + "/texts.jsonl")),
+    )
+    write_json_atomic(
+        tmp_path + "/info.json",
+        # How each chunk's token-wise lemmas were checked against ogm
+        {"created": time.time(), "n_docs": n_docs, "lemma_checks": lemma_checks},
+    )
+
+    try:
+        os.replace(tmp_path, entry_path)
+    except OSError:
+        # Another process finished the same corpus first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_streamed_corpus(entry_path):
+    """
+    Texts, dictionary and corpus written by `build_streamed_corpus`; texts and corpus are read
+    lazily from disk
+    """
+    os.utime(entry_path + "/info.json")
+    return (
+        StreamedTexts(entry_path + "/texts.jsonl"),
+        Dictionary.load(entry_path + "/dictionary.dict"),
+        MmCorpus(entry_path + "/corpus.mm"),
+    )
+
+
+def load_streamed(setup_dict, data_file, timer=None):
+    """
+    Cache entry path and (texts, dictionary, corpus) of an experiment's streamed corpus, built
+    chunk by chunk if it isn't cached yet
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    # Streamed corpora live in the preprocessing cache next to the in-memory entries
+    entry_path = cache.get_entry_path(setup_dict, data_file) + "_streamed"
+    if not os.path.isfile(entry_path + "/info.json"):
+        chunks = iter_data_chunks(data_file, setup_dict.get("chunk_size", 100000))
+
+        # The lemma memo is loaded once and shared by every chunk, then saved if it grew
+        memo = preprocess.load_memo()
+        n_memo = len(memo)
+
+        # Chunks are read and preprocessed as the corpus is built, so this stage covers
+        # the per-chunk stages too
+        with timer.stage("streamed_corpus"):
+            build_streamed_corpus(
+                entry_path,
+                (preprocess.preprocess_data(setup_dict, chunk, timer, memo) for chunk in chunks),
+                setup_dict["text_key"],
+            )
+        if len(memo) > n_memo:
+            preprocess.save_memo(memo)
+        cache.evict(keep=os.path.basename(entry_path))
+    else:
+        print("Loading streamed corpus from", entry_path)
+
+    with timer.stage("load_cache"):
+        corpus = load_streamed_corpus(entry_path)
+    return entry_path, corpus
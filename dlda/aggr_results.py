@@ -1,8 +1,11 @@
-import json, os, random
+import os, sys, random
 import matplotlib.pyplot as plt
 from matplotlib.ticker import FormatStrFormatter
 import argparse as ap
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import results
+
 # Experiment parameters obtained by CLI args
 argparser = ap.ArgumentParser()
 argparser.add_argument("--plot_title", help="Title to appear on plot")
@@ -38,52 +41,38 @@ argparser.add_argument(
 args = argparser.parse_args()
 
 
-# Read in all metadata files
-models_parent_dir = os.getenv("MODEL_DIR") + "/" + args.experiment_name
-topic_num_subdirs = os.listdir(models_parent_dir)
-json_files = [models_parent_dir + "/" + x + "/metadata.json" for x in topic_num_subdirs]
-topic_nums = [int(x.replace("topics", "")) for x in topic_num_subdirs]
+# Every time slice of every n_topics that has finished, from the results database. Since LdaSeq
+# takes so long to train, it may serve to analyze before all of them finish.
+time_slices = results.get_time_slices(args.experiment_name)
 
 ax = plt.figure().gca()
 
-# This will loop through all the "metadata" files, corresponding to different n_topics
-for filename, n_topics in zip(json_files, topic_nums):
+for n_topics, slices in time_slices.items():
     x_time = []
     y_coherence = []
 
-    try:
-        with open(filename, "r") as json_file:
-            info = json.load(json_file)
-
-            # This is how many timeslices there were
-            # Each timeslice has its own section, but there's
-            # one extra section listed as "aggregated"
-            for i in range(len(info.keys()) - 1):
-                x_label = info["time_" + str(i)]["start_time"]
-                if args.remove_from_label is not None:
-                    for item in args.remove_from_label:
-                        x_label = x_label.replace(item, "")
-
-                x_time.append(x_label)
-                y_coherence.append(info["time_" + str(i)]["coherence"])
+    for info in slices:
+        x_label = info["start_time"]
+        if args.remove_from_label is not None:
+            for item in args.remove_from_label:
+                x_label = x_label.replace(item, "")
 
-        # Plot time vs coherence for each n_topics
-        plt.xticks(rotation=args.label_rotation)
-        ax.yaxis.set_major_formatter(FormatStrFormatter("%.2f"))
-        if args.shuffle_colors:
-            r = lambda: random.randint(0, 255)
-            ax.plot(
-                x_time,
-                y_coherence,
-                label=str(n_topics) + " Topics",
-                color="#%02X%02X%02X" % (r(), r(), r()),
-            )
-        else:
-            ax.plot(x_time, y_coherence, label=str(n_topics) + " Topics")
+        x_time.append(x_label)
+        y_coherence.append(info["coherence"])
 
-    # Since LdaSeq takes so long to train, it may serve to analyze before it finishes
-    except FileNotFoundError:
-        continue
+    # Plot time vs coherence for each n_topics
+    plt.xticks(rotation=args.label_rotation)
+    ax.yaxis.set_major_formatter(FormatStrFormatter("%.2f"))
+    if args.shuffle_colors:
+        r = lambda: random.randint(0, 255)
+        ax.plot(
+            x_time,
+            y_coherence,
+            label=str(n_topics) + " Topics",
+            color="#%02X%02X%02X" % (r(), r(), r()),
+        )
+    else:
+        ax.plot(x_time, y_coherence, label=str(n_topics) + " Topics")
 
 
 ax.set_ylabel("Coherence score ($C_v$)")
@@ -1,8 +1,17 @@
-import os, json
+import os, sys, json
+import numpy as np
 import pandas as pd
 import argparse as ap
 from ogm.trainer import TextTrainer
-from ogm.utils import text_data_preprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import artifacts, cache, preprocess
+
+# Documents normalized and written at a time
+CHUNK_SIZE = 100000
+
+# Rows in an Excel sheet, including the header
+EXCEL_MAX_ROWS = 1048576
 
 
 def get_setup_dict():
@@ -12,10 +21,77 @@ def get_setup_dict():
         "n_topics", help="Number of topics to identify saved Sequential LDA model", type=int
     )
     parser.add_argument("data_id", help="Column of dataset containing a unique ID value")
-    parser.add_argument("--output_file", help="Name of Excel output file", default="output.xlsx")
+    parser.add_argument(
+        "--output_file",
+        help="Name of output file; its extension picks the format: .xlsx (the default), .csv, "
+        + ".parquet, or .npy (the distributions only, with the IDs in <name>_ids.csv)",
+        default="output.xlsx",
+    )
     return parser.parse_args()
 
 
+def iter_topic_dists(gammas, chunk_size=CHUNK_SIZE):
+    """
+    Yield (start row, topic distributions) for chunks of documents; each row is that document's
+    gammas normalized to sum to 1, as `LdaSeqModel.doc_topics` does
+    """
+    for start in range(0, gammas.shape[0], chunk_size):
+        chunk = np.asarray(gammas[start : start + chunk_size], dtype=np.float64)
+        yield start, chunk / chunk.sum(axis=1, keepdims=True)
+
+
+def write_topic_dists(output_file, ids, id_key, gammas):
+    n_docs, n_topics = gammas.shape
+    columns = ["topic_" + str(i) for i in range(n_topics)]
+    ext = os.path.splitext(output_file)[1].lower()
+
+    if ext == ".xlsx":
+        if n_docs >= EXCEL_MAX_ROWS:
+            raise ValueError(
+                str(n_docs)
+                + " documents don't fit in an Excel sheet; use a .csv, .parquet or "
+                + ".npy output file instead"
+            )
+        df = pd.DataFrame(next(iter_topic_dists(gammas, n_docs))[1], columns=columns)
+        df.insert(0, id_key, ids)
+        df.to_excel(output_file, index=False)
+
+    elif ext == ".csv":
+        for start, dists in iter_topic_dists(gammas):
+            df = pd.DataFrame(dists, columns=columns)
+            df.insert(0, id_key, ids[start : start + len(dists)])
+            df.to_csv(output_file, mode="w" if start == 0 else "a", header=start == 0, index=False)
+
+    elif ext == ".parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        for start, dists in iter_topic_dists(gammas):
+            df = pd.DataFrame(dists, columns=columns)
+            df.insert(0, id_key, ids[start : start + len(dists)])
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(output_file, table.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+
+    elif ext == ".npy":
+        output = np.lib.format.open_memmap(
+            output_file, mode="w+", dtype=np.float64, shape=(n_docs, n_topics)
+        )
+        for start, dists in iter_topic_dists(gammas):
+            output[start : start + len(dists)] = dists
+        output.flush()
+        pd.DataFrame({id_key: ids}).to_csv(
+            os.path.splitext(output_file)[0] + "_ids.csv", index=False
+        )
+
+    else:
+        raise ValueError("Can't write topic distributions to a " + ext + " file: " + output_file)
+
+
 def main(args):
     with open(args.expt_config, "r") as infile:
         setup_dict = json.load(infile)
@@ -23,9 +99,12 @@ def main(args):
     # Load dataset and perform same preprocessing on it as the experiment
     if not os.path.isfile(setup_dict["data_path"]):
         setup_dict["data_path"] = os.getenv("DATA_DIR") + "/" + setup_dict["data_path"]
-    preprocessed_data = text_data_preprocess(setup_dict, output=False)
     trainer = TextTrainer()
-    trainer.data = preprocessed_data
+    trainer.data, trainer.dictionary, trainer.corpus = cache.load_preprocessed(
+        setup_dict,
+        setup_dict["data_path"],
+        lambda: preprocess.preprocess_file(setup_dict, setup_dict["data_path"]),
+    )
     if "time_filter" not in setup_dict:
         raise ValueError("A time filter is required for running a sequential LDA")
     time_to_begin = pd.Timestamp(setup_dict["time_filter"]["start"])
@@ -51,26 +130,32 @@ def main(args):
         + str(args.n_topics)
         + "topics/ldaseq.model"
     )
-    trainer.load_model("ldaseq", model_savepath)
+    trainer.model = artifacts.load_ldaseq(model_savepath)
+
+    # Models extended with --append list the rows of their documents, which leave out documents
+    # added to time slices that were already trained
+    documents_path = os.path.dirname(model_savepath) + "/documents.npy"
+    if os.path.isfile(documents_path):
+        documents = np.load(documents_path)
+        print(
+            "Writing the",
+            len(documents),
+            "documents in the model, out of",
+            trainer.data.shape[0],
+        )
+        trainer.data = trainer.data.iloc[documents]
 
     # Model's gamma list had also better match the size of the dataset
     assert trainer.data.shape[0] == len(trainer.model.gammas)
 
-    # Get topic distribution for each doc
-    output_array = []
-    for doc_index in range(len(trainer.data)):
-        doc_id = trainer[doc_index][args.data_id]
-        topic_dist = trainer.model.doc_topics(doc_index)
-        topic_dist = topic_dist.tolist()
-        topic_dist.insert(0, doc_id)
-        output_array.append(topic_dist)
-
-    # Write distributions
-    pd.DataFrame(
-        output_array,
-        columns=[args.data_id]
-        + ["topic_" + str(i) for i, _ in enumerate(trainer.model.doc_topics(0))],
-    ).to_excel(args.output_file, index=False)
+    # Normalize the model's gammas into each doc's topic distribution, a chunk at a time, and
+    # write them out as they're computed
+    write_topic_dists(
+        args.output_file,
+        trainer.data[args.data_id].to_numpy(),
+        args.data_id,
+        trainer.model.gammas,
+    )
 
 
 if __name__ == "__main__":
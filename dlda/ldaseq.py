@@ -1,23 +1,507 @@
-import os, json
+import os, sys, json, time, shutil, hashlib
 import argparse as ap
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
-from pandas import to_datetime
+import gensim
+from pandas import to_datetime, Timedelta
 from ogm.trainer import TextTrainer
-from ogm.utils import text_data_preprocess
-from gensim.models import CoherenceModel
+from gensim.models import CoherenceModel, LdaModel, LdaSeqModel
+from gensim.models.ldaseqmodel import sslm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import artifacts, cache, preprocess, results
+from common.manifest import write_manifest, read_manifest, clear_manifests
+from common.instrument import StageTimer
+from common.coherence import CoherenceEngine, get_word_topics
+
+# Coherence engine inherited by each worker process of the time slice pool
+_slice_engine = None
+
+# Training with checkpoints re-implements gensim's `LdaSeqModel.fit_lda_seq` one iteration at a
+# time, with the defaults and constants below copied from this version of gensim
+LDASEQ_GENSIM_VERSION = "4."
+
+# gensim's LdaSeqModel defaults, which ogm's `train_ldaseq` leaves in place; the `ldaseq` key of
+# the experiment JSON overrides them for both training paths
+LDASEQ_DEFAULTS = {
+    "alphas": 0.01,
+    "chain_variance": 0.005,
+    "lda_inference_max_iter": 25,
+    "em_min_iter": 6,
+    "em_max_iter": 20,
+    "chunksize": 100,
+}
+
+# Constants of gensim's `LdaSeqModel.fit_lda_seq`
+EM_THRESHOLD = 1e-4
+LOWER_ITER = 10
+ITER_MULT_LOW = 2
+MAX_ITER = 500
 
 
 def get_setup_dict():
     p = ap.ArgumentParser()
     p.add_argument("filepath", help="Path to experiment's JSON file")
+    p.add_argument(
+        "--resume",
+        help="Reuse trained models and time slice coherences finished by a previous run",
+        action="store_true",
+    )
+    p.add_argument(
+        "--append",
+        help="Extend each existing model with the time slices of documents newer than its last "
+        + "slice, instead of training from scratch",
+        action="store_true",
+    )
     a = p.parse_args()
     with open(a.filepath, "r") as infile:
         input_dict = json.load(infile)
 
-    return input_dict
+    return input_dict, a
+
+
+def init_slice_worker(engine):
+    global _slice_engine
+    _slice_engine = engine
+
+
+def score_slice(topics, savepath, timer, n_docs):
+    """
+    c_v coherence of one time slice's topics (lists of words), and a saved coherence model if
+    `savepath` is given. Returns the coherence, each topic's coherence and the slice's stage
+    timings.
+    """
+    engine = _slice_engine
+    with timer.stage("coherence", n_docs=n_docs):
+        topic_coherences = engine.get_coherence_per_topic(
+            get_word_topics(topics, engine.dictionary), "c_v"
+        )
+        coherence = float(np.mean(topic_coherences))
+
+    if savepath is not None:
+        with timer.stage("save"):
+            CoherenceModel(
+                corpus=engine.corpus,
+                texts=engine.texts,
+                topics=topics,
+                coherence="c_v",
+                dictionary=engine.dictionary,
+            ).save(savepath)
+
+    return coherence, [float(c) for c in topic_coherences], timer.stages
+
+
+def score_slices(engine, jobs, n_processes):
+    """
+    Run `score_slice` for each (time slice, args) job, yielding (time slice, result) as they
+    finish. Forked workers share the parent's copy of the texts and co-occurrence statistics.
+    """
+    if n_processes <= 1 or len(jobs) <= 1:
+        init_slice_worker(engine)
+        for i, args in jobs:
+            yield i, score_slice(*args)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=min(n_processes, len(jobs)), initializer=init_slice_worker, initargs=(engine,)
+    ) as pool:
+        futures = {pool.submit(score_slice, *args): i for i, args in jobs}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def get_ldaseq_params(setup_dict):
+    """
+    Hyperparameters dynamic topic models are trained with, with or without checkpoints
+    """
+    params = dict(LDASEQ_DEFAULTS, passes=setup_dict.get("passes", 10))
+    params.update(setup_dict.get("ldaseq", {}))
+
+    # Only checkpointed training seeds the initial LDA model
+    if "checkpoint" in setup_dict:
+        params["random_state"] = setup_dict.get("random_state")
+    return params
+
+
+def init_ldaseq(corpus, dictionary, num_topics, time_slice, params):
+    """
+    A dynamic topic model initialized from an LDA model of `passes` passes, as gensim does,
+    before any EM iterations
+    """
+    model = LdaSeqModel(
+        id2word=dictionary,
+        time_slice=time_slice,
+        num_topics=num_topics,
+        alphas=params["alphas"],
+        chain_variance=params["chain_variance"],
+    )
+    model.corpus_len = len(corpus)
+    model.max_doc_len = max(len(doc) for doc in corpus)
+    lda_model = LdaModel(
+        corpus,
+        id2word=dictionary,
+        num_topics=num_topics,
+        passes=params["passes"],
+        alpha=model.alphas,
+        random_state=params.get("random_state"),
+        dtype=np.float64,
+    )
+    model.sstats = np.transpose(lda_model.state.sstats)
+    model.init_ldaseq_ss(
+        model.topic_chains[0].chain_variance,
+        model.topic_chains[0].obs_variance,
+        model.alphas,
+        model.sstats,
+    )
+    return model
+
+
+def fit_ldaseq_iteration(model, corpus, state, params):
+    """
+    One EM iteration of gensim's `LdaSeqModel.fit_lda_seq`. `state` holds the loop's variables
+    between iterations, and the bound after each one.
+    """
+    old_bound = state["bound"]
+    topic_suffstats = [
+        np.zeros((model.vocab_len, model.num_time_slices)) for _ in range(model.num_topics)
+    ]
+    gammas = np.zeros((model.corpus_len, model.num_topics))
+    lhoods = np.zeros((model.corpus_len, model.num_topics + 1))
+    bound, model.gammas = model.lda_seq_infer(
+        corpus,
+        topic_suffstats,
+        gammas,
+        lhoods,
+        state["iteration"],
+        state["lda_inference_max_iter"],
+        params["chunksize"],
+    )
+    bound += model.fit_lda_seq_topics(topic_suffstats)
+
+    if bound - old_bound < 0 and state["lda_inference_max_iter"] < LOWER_ITER:
+        state["lda_inference_max_iter"] *= ITER_MULT_LOW
+
+    with np.errstate(divide="ignore"):
+        convergence = float(np.fabs((bound - old_bound) / old_bound))
+    if convergence < EM_THRESHOLD:
+        state["lda_inference_max_iter"] = MAX_ITER
+        convergence = 1.0
+
+    state["bound"] = float(bound)
+    state["convergence"] = convergence
+    state["iteration"] += 1
+    state["bounds"].append(float(bound))
+
+
+def is_converged(state, params):
+    return state["iteration"] >= params["em_min_iter"] and (
+        state["convergence"] <= EM_THRESHOLD or state["iteration"] > params["em_max_iter"]
+    )
+
+
+def save_checkpoint(model, state, model_savepath, manifest_dir, last_path):
+    # Alternate between two directories, so a crash while saving leaves the last one intact
+    name = "checkpoint_a"
+    if last_path is not None and "/checkpoint_a/" in last_path:
+        name = "checkpoint_b"
+    path = model_savepath + "/" + name + "/ldaseq.model"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    artifacts.save_ldaseq(model, path)
+    write_manifest(manifest_dir + "/checkpoint.json", {"path": path, "state": state})
+    return path
+
+
+def train_checkpointed(
+    corpus,
+    dictionary,
+    setup_dict,
+    num_topics,
+    time_slice,
+    model_savepath,
+    manifest_dir,
+    timer,
+    resume,
+):
+    """
+    Train a dynamic topic model one EM iteration at a time, saving it every
+    `checkpoint.every_iterations` iterations or `checkpoint.every_minutes` minutes. With
+    `resume`, training picks up from the last checkpoint. Returns the model and its bound after
+    each iteration. Saving checkpoints is timed as its own stage, outside `training`.
+    """
+    if not gensim.__version__.startswith(LDASEQ_GENSIM_VERSION):
+        raise ValueError(
+            "Training with checkpoints follows gensim "
+            + LDASEQ_GENSIM_VERSION
+            + "x's LdaSeqModel, but gensim "
+            + gensim.__version__
+            + " is installed"
+        )
+
+    params = get_ldaseq_params(setup_dict)
+    every_iterations = setup_dict["checkpoint"].get("every_iterations")
+    every_minutes = setup_dict["checkpoint"].get("every_minutes")
+    if every_iterations is None and every_minutes is None:
+        every_iterations = 1
+
+    # Only the first part of training records the documents, so they're counted once
+    n_docs = len(corpus)
+    saved = read_manifest(manifest_dir + "/checkpoint.json") if resume else None
+    if saved is not None:
+        print(
+            "[" + str(num_topics) + " topics] Resuming from EM iteration",
+            saved["state"]["iteration"],
+        )
+        model = artifacts.load_ldaseq(saved["path"], mmap=None)
+        state = saved["state"]
+        last_path = saved["path"]
+    else:
+        with timer.stage("training", n_docs=n_docs):
+            model = init_ldaseq(corpus, dictionary, num_topics, time_slice, params)
+        n_docs = None
+        state = {
+            "iteration": 0,
+            "bound": 0.0,
+            "convergence": EM_THRESHOLD + 1,
+            "lda_inference_max_iter": params["lda_inference_max_iter"],
+            "bounds": [],
+        }
+        with timer.stage("checkpoint"):
+            last_path = save_checkpoint(model, state, model_savepath, manifest_dir, None)
+
+    last_time = time.perf_counter()
+    last_iteration = state["iteration"]
+    while not is_converged(state, params):
+        with timer.stage("training", n_docs=n_docs):
+            fit_ldaseq_iteration(model, corpus, state, params)
+        n_docs = None
+        print(
+            "[" + str(num_topics) + " topics] EM iteration",
+            state["iteration"],
+            "bound",
+            state["bound"],
+        )
+
+        if (every_iterations and state["iteration"] - last_iteration >= every_iterations) or (
+            every_minutes and time.perf_counter() - last_time >= every_minutes * 60
+        ):
+            with timer.stage("checkpoint"):
+                last_path = save_checkpoint(model, state, model_savepath, manifest_dir, last_path)
+            last_time = time.perf_counter()
+            last_iteration = state["iteration"]
+
+    return model, state["bounds"]
+
+
+def get_time_slices(data, setup_dict, origin=None):
+    # Document counts and start dates of each `days_in_interval` window of the (sorted) data,
+    # starting on the first document's day or at `origin`
+    time_key = setup_dict["time_filter"]["time_key"]
+    if origin is None:
+        resampler = (
+            data[["__ts", time_key]]
+            .set_index("__ts")
+            .resample(str(setup_dict["days_in_interval"]) + "D")
+        )
+    else:
+        # Newer pandas ignores `origin` for day frequencies, so the window is given in hours
+        resampler = (
+            data[["__ts", time_key]]
+            .set_index("__ts")
+            .resample(str(setup_dict["days_in_interval"] * 24) + "h", origin=origin)
+        )
+    ts_df = resampler.agg({time_key: "count"}).reset_index()
+    return [y for y in ts_df[time_key]], [x.strftime("%Y-%m-%d") for x in ts_df["__ts"]]
 
 
-def main(setup_dict):
+class ContinuedSslm(sslm):
+    """
+    A topic chain whose forward pass starts from the posterior mean and variance of each word at
+    the last time slice of the chain it continues (`init_mean`, `init_variance`), rather than
+    from gensim's zero mean and very large variance. The rest is gensim's `sslm`.
+    """
+
+    def compute_post_variance(self, word, chain_variance):
+        T = self.num_time_slices
+        variance = self.variance[word]
+        fwd_variance = self.fwd_variance[word]
+        fwd_variance[0] = self.init_variance[word]
+        for t in range(1, T + 1):
+            if self.obs_variance:
+                c = self.obs_variance / (fwd_variance[t - 1] + chain_variance + self.obs_variance)
+            else:
+                c = 0
+            fwd_variance[t] = c * (fwd_variance[t - 1] + chain_variance)
+
+        variance[T] = fwd_variance[T]
+        for t in range(T - 1, -1, -1):
+            if fwd_variance[t] > 0.0:
+                c = np.power((fwd_variance[t] / (fwd_variance[t] + chain_variance)), 2)
+            else:
+                c = 0
+            variance[t] = (c * (variance[t + 1] - chain_variance)) + ((1 - c) * fwd_variance[t])
+
+        return variance, fwd_variance
+
+    def compute_post_mean(self, word, chain_variance):
+        T = self.num_time_slices
+        obs = self.obs[word]
+        fwd_variance = self.fwd_variance[word]
+        mean = self.mean[word]
+        fwd_mean = self.fwd_mean[word]
+        fwd_mean[0] = self.init_mean[word]
+        for t in range(1, T + 1):
+            c = self.obs_variance / (fwd_variance[t - 1] + chain_variance + self.obs_variance)
+            fwd_mean[t] = c * fwd_mean[t - 1] + (1 - c) * obs[t - 1]
+
+        mean[T] = fwd_mean[T]
+        for t in range(T - 1, -1, -1):
+            if chain_variance == 0.0:
+                c = 0.0
+            else:
+                c = chain_variance / (fwd_variance[t] + chain_variance)
+            mean[t] = c * fwd_mean[t] + (1 - c) * mean[t + 1]
+        return mean, fwd_mean
+
+
+def continue_chain(chain, new_chain):
+    # Start `new_chain` where `chain` ends: its observations at every new slice are the last
+    # slice's, and its forward pass starts from the last slice's posterior
+    new_chain.__class__ = ContinuedSslm
+    new_chain.obs_variance = chain.obs_variance
+    new_chain.chain_variance = chain.chain_variance
+    new_chain.init_mean = np.array(chain.mean[:, -1])
+    new_chain.init_variance = np.array(chain.variance[:, -1])
+    new_chain.obs = np.repeat(np.array(chain.obs[:, -1:]), new_chain.num_time_slices, axis=1)
+    for w in range(new_chain.vocab_len):
+        new_chain.variance[w], new_chain.fwd_variance[w] = new_chain.compute_post_variance(
+            w, new_chain.chain_variance
+        )
+        new_chain.mean[w], new_chain.fwd_mean[w] = new_chain.compute_post_mean(
+            w, new_chain.chain_variance
+        )
+    new_chain.zeta = new_chain.update_zeta()
+    new_chain.e_log_prob = new_chain.compute_expected_log_prob()
+
+
+def splice_ldaseq(model, new_model):
+    """
+    Append the time slices of `new_model`, trained on later documents with the same dictionary
+    and number of topics, to `model`
+    """
+    for chain, new_chain in zip(model.topic_chains, new_model.topic_chains):
+        for attrib, value in vars(chain).items():
+            if not isinstance(value, np.ndarray):
+                continue
+            new_value = getattr(new_chain, attrib)
+            if value.shape[-1] == model.num_time_slices + 1:
+                # Posterior arrays start with the chain's initial state, which the new chain's
+                # first slice follows on from
+                new_value = new_value[..., 1:]
+            setattr(chain, attrib, np.concatenate([value, new_value], axis=-1))
+        chain.num_time_slices += new_model.num_time_slices
+
+    model.gammas = np.vstack([model.gammas, new_model.gammas])
+    model.time_slice = list(model.time_slice) + list(new_model.time_slice)
+    model.num_time_slices += new_model.num_time_slices
+    model.corpus_len += new_model.corpus_len
+    model.max_doc_len = max(model.max_doc_len, new_model.max_doc_len)
+    return model
+
+
+def get_documents_path(model_savepath):
+    return model_savepath + "/documents.npy"
+
+
+def clear_documents(model_savepath):
+    # A model trained from scratch has every document of the data, in order
+    try:
+        os.remove(get_documents_path(model_savepath))
+    except FileNotFoundError:
+        pass
+
+
+def load_documents(model_savepath, model):
+    """
+    Row in the preprocessed data of the document behind each of the model's gammas. Models
+    extended with `--append` save them; a model trained from scratch has every row in order.
+    """
+    try:
+        return np.load(get_documents_path(model_savepath))
+    except FileNotFoundError:
+        return np.arange(model.corpus_len)
+
+
+def append_time_slices(trainer, setup_dict, model, metadata, documents, passes, timer):
+    """
+    Train the time slices of documents dated after the model's last slice, continuing each
+    topic's chain from its state at that slice, and splice them onto the model. Returns the new
+    slices' document counts and start dates, and the rows of their documents in the data.
+    """
+    n_slices = model.num_time_slices
+    boundary = to_datetime(metadata["time_" + str(n_slices - 1)]["start_time"]) + Timedelta(
+        days=setup_dict["days_in_interval"]
+    )
+    ts = trainer.data["__ts"].to_numpy()
+    n_late = int(np.sum(ts < boundary)) - len(documents)
+    if n_late > 0:
+        print(
+            n_late,
+            "documents dated before",
+            boundary.strftime("%Y-%m-%d"),
+            "weren't in the model; they're left out",
+        )
+
+    rows = np.flatnonzero(ts >= boundary)
+    rows = rows[np.argsort(ts[rows], kind="stable")]
+    if len(rows) == 0:
+        return [], [], rows
+    data = trainer.data.iloc[rows]
+
+    docs_quants, time_labels = get_time_slices(data, setup_dict, origin=boundary)
+
+    # Words outside the model's vocabulary can't be added to its topics, so they're dropped
+    corpus = [model.id2word.doc2bow(doc) for doc in data[setup_dict["text_key"]]]
+
+    with timer.stage("training", n_docs=len(corpus)):
+        params = get_ldaseq_params(setup_dict)
+        new_model = LdaSeqModel(
+            time_slice=docs_quants,
+            id2word=model.id2word,
+            alphas=float(model.alphas[0]),
+            num_topics=model.num_topics,
+            chain_variance=model.topic_chains[0].chain_variance,
+        )
+        new_model.corpus_len = len(corpus)
+        new_model.max_doc_len = max(len(doc) for doc in corpus)
+        for chain, new_chain in zip(model.topic_chains, new_model.topic_chains):
+            continue_chain(chain, new_chain)
+        new_model.fit_lda_seq(
+            corpus, params["lda_inference_max_iter"], 1, passes, params["chunksize"]
+        )
+        splice_ldaseq(model, new_model)
+
+    return docs_quants, time_labels, rows
+
+
+def get_append_engine(engines, texts, dictionary, cache_dir):
+    """
+    Coherence engine for scoring appended models against `texts`. Models keep the dictionary they
+    were trained with, which usually differs from the extended data's, so their statistics are
+    cached in a subdirectory of `cache_dir` named after the dictionary.
+    """
+    for engine in engines:
+        if engine.dictionary.token2id == dictionary.token2id:
+            return engine
+
+    key = hashlib.sha256(json.dumps(sorted(dictionary.token2id.items())).encode()).hexdigest()
+    stats_dir = cache_dir + "/dictionary_" + key[:16]
+    os.makedirs(stats_dir, exist_ok=True)
+    engine = CoherenceEngine(texts, None, dictionary, cache_dir=stats_dir)
+    engines.append(engine)
+    return engine
+
+
+def main(setup_dict, resume=False, append=False):
 
     # Look for input file at path and DATA_DIR if it's not there
     if not os.path.isfile(setup_dict["data_path"]):
@@ -26,24 +510,33 @@ def main(setup_dict):
     # Read in data and run the ogm preprocessing on it
     if "time_filter" not in setup_dict:
         raise ValueError("A time filter is required for training a sequential LDA")
-    preprocessed_data = text_data_preprocess(setup_dict, output=False)
+
+    timer = StageTimer(setup_dict.get("instrumentation_log"), experiment=setup_dict["name"])
 
     # Add to Trainer object
     trainer = TextTrainer(log=setup_dict["name"] + str(setup_dict["min_topics"]) + ".log")
-    trainer.data = preprocessed_data
+    trainer.data, trainer.dictionary, trainer.corpus = cache.load_preprocessed(
+        setup_dict,
+        setup_dict["data_path"],
+        lambda: preprocess.preprocess_file(setup_dict, setup_dict["data_path"], timer),
+        timer,
+    )
     print("Found", trainer.data.shape[0], "posts")
 
+    # Every time slice is scored against the whole corpus, so the co-occurrence statistics are
+    # gathered once and shared by all of them. Appended models keep the dictionary they were
+    # trained with, so each gets its own statistics.
+    texts = trainer.get_attribute_list(setup_dict["text_key"])
+    cache_dir = cache.get_entry_path(setup_dict, setup_dict["data_path"])
+    append_engines = []
+    if not append:
+        engine = CoherenceEngine(texts, trainer.corpus, trainer.dictionary, cache_dir=cache_dir)
+        with timer.stage("coherence_statistics", n_docs=len(trainer.corpus)):
+            engine.get_stats("c_v")
+
     # Order chronologically and split by time window
     trainer.data["__ts"] = to_datetime(trainer.data[setup_dict["time_filter"]["time_key"]])
-    ts_df = trainer.data.sort_values(by="__ts")[["__ts", setup_dict["time_filter"]["time_key"]]]
-    ts_df = (
-        ts_df.set_index("__ts")
-        .resample(str(setup_dict["days_in_interval"]) + "D")
-        .agg({setup_dict["time_filter"]["time_key"]: "count"})
-        .reset_index()
-    )
-    docs_quants = [y for y in ts_df[setup_dict["time_filter"]["time_key"]]]
-    time_labels = [x.strftime("%Y-%m-%d") for x in ts_df["__ts"]]
+    docs_quants, time_labels = get_time_slices(trainer.data.sort_values(by="__ts"), setup_dict)
 
     # Load hyperparameters
     topic_quants = range(setup_dict["min_topics"], setup_dict["max_topics"] + 1)
@@ -60,45 +553,177 @@ def main(setup_dict):
     for num_topics in topic_quants:
         metadata = {}
         coherences = []
+        topics_timer = timer.child(topics=num_topics)
 
         # Create directory where model files will be saved
         model_savepath = (
             os.getenv("MODEL_DIR") + "/" + experiment_name + "/" + str(num_topics) + "topics"
         )
-        os.makedirs(model_savepath, exist_ok=True)
-
-        # Train model
-        trainer.train_ldaseq(
-            col=text_key,
-            n_topics=num_topics,
-            output_path=model_savepath + "/ldaseq.model",
-            seq_counts=docs_quants,
-            passes=passes,
-        )
+        manifest_dir = model_savepath + "/manifests"
+        os.makedirs(manifest_dir, exist_ok=True)
+        trained = read_manifest(manifest_dir + "/training.json") if resume else None
 
-        # Loop through the different time slices and get coherence at each one
-        for i, quantity in enumerate(docs_quants):
-            model_output = trainer.model.dtm_coherence(i)
-            cm = CoherenceModel(
-                corpus=trainer.corpus,
-                texts=trainer.get_attribute_list(text_key),
-                topics=model_output,
-                coherence="c_v",
-                dictionary=trainer.dictionary,
+        # Manifests left by an earlier run describe a different model than the one about to be
+        # trained; a resumed run keeps its checkpoint
+        if not append and trained is None:
+            clear_manifests(manifest_dir, "time_" if resume else "")
+
+        # Extend the existing model with new time slices
+        if append:
+            with open(model_savepath + "/metadata.json", "r") as infile:
+                metadata = json.load(infile)
+            trainer.model = artifacts.load_ldaseq(model_savepath + "/ldaseq.model")
+            n_scored = len([k for k in metadata.keys() if k.startswith("time_")])
+            slices = [metadata["time_" + str(i)] for i in range(n_scored)]
+            docs_quants = [s["num_posts"] for s in slices]
+            time_labels = [s["start_time"] for s in slices]
+
+            appended = read_manifest(manifest_dir + "/append.json")
+            if (
+                trainer.model.num_time_slices > n_scored
+                and appended is not None
+                and appended["num_time_slices"] == trainer.model.num_time_slices
+            ):
+                # A previous run saved the extended model but didn't finish scoring it
+                print("[" + str(num_topics) + " topics] Time slices already appended")
+                docs_quants, time_labels = appended["num_posts"], appended["start_times"]
+            else:
+                if trainer.model.num_time_slices != n_scored:
+                    raise ValueError(
+                        model_savepath
+                        + "/ldaseq.model doesn't have the time slices listed in metadata.json"
+                    )
+                # Slices appended by an earlier, unfinished run are appended again
+                clear_manifests(manifest_dir, ("time_", "append"))
+                documents = load_documents(model_savepath, trainer.model)
+                new_quants, new_labels, new_documents = append_time_slices(
+                    trainer,
+                    setup_dict,
+                    trainer.model,
+                    metadata,
+                    documents,
+                    setup_dict.get("append", {}).get("passes", 5),
+                    topics_timer,
+                )
+                print("[" + str(num_topics) + " topics] Appending", len(new_quants), "time slices")
+                if not new_quants:
+                    continue
+
+                with topics_timer.stage("save"):
+                    artifacts.save_ldaseq(trainer.model, model_savepath + "/ldaseq.model")
+                    np.save(
+                        get_documents_path(model_savepath),
+                        np.concatenate([documents, new_documents]),
+                    )
+                docs_quants += new_quants
+                time_labels += new_labels
+                write_manifest(
+                    manifest_dir + "/append.json",
+                    {
+                        "num_time_slices": trainer.model.num_time_slices,
+                        "num_posts": docs_quants,
+                        "start_times": time_labels,
+                    },
+                )
+
+            # Only the new slices are scored; earlier ones keep their metadata, as do other keys
+            # such as `bounds`, and the aggregated and stage keys are rewritten below. Every topic
+            # count usually shares one dictionary, and so one set of statistics.
+            engine = get_append_engine(append_engines, texts, trainer.model.id2word, cache_dir)
+            with topics_timer.stage("coherence_statistics", n_docs=len(texts)):
+                engine.get_stats("c_v")
+
+        # Train model, or pick up the one a previous run finished
+        elif trained is not None:
+            print("[" + str(num_topics) + " topics] Model already trained, loading it")
+            trainer.model = artifacts.load_ldaseq(model_savepath + "/ldaseq.model")
+            if "bounds" in trained:
+                metadata["bounds"] = trained["bounds"]
+            metadata["ldaseq"] = get_ldaseq_params(setup_dict)
+        elif "checkpoint" in setup_dict:
+            trainer.model, bounds = train_checkpointed(
+                trainer.corpus,
+                trainer.dictionary,
+                setup_dict,
+                num_topics,
+                docs_quants,
+                model_savepath,
+                manifest_dir,
+                topics_timer,
+                resume,
+            )
+            with topics_timer.stage("save"):
+                artifacts.save_ldaseq(trainer.model, model_savepath + "/ldaseq.model")
+            clear_documents(model_savepath)
+            write_manifest(
+                manifest_dir + "/training.json",
+                {"path": model_savepath + "/ldaseq.model", "bounds": bounds},
             )
 
+            metadata["bounds"] = bounds
+            metadata["ldaseq"] = get_ldaseq_params(setup_dict)
+
+            # The finished model replaces the checkpoints; the checkpoint manifest keeps the bounds
+            for name in ["checkpoint_a", "checkpoint_b"]:
+                shutil.rmtree(model_savepath + "/" + name, ignore_errors=True)
+        else:
+            # Settings the experiment gives are handed on to gensim; the rest are its defaults
+            with topics_timer.stage("training", n_docs=len(trainer.corpus)):
+                trainer.train_ldaseq(
+                    col=text_key,
+                    n_topics=num_topics,
+                    output_path=None,
+                    seq_counts=docs_quants,
+                    passes=passes,
+                    **setup_dict.get("ldaseq", {}),
+                )
+            metadata["ldaseq"] = get_ldaseq_params(setup_dict)
+            with topics_timer.stage("save"):
+                artifacts.save_ldaseq(trainer.model, model_savepath + "/ldaseq.model")
+            clear_documents(model_savepath)
+            write_manifest(
+                manifest_dir + "/training.json", {"path": model_savepath + "/ldaseq.model"}
+            )
+
+        # Score the time slices a previous run didn't finish in a pool of processes
+        slice_infos = {}
+        c_savepaths = {}
+        jobs = []
+        for i, quantity in enumerate(docs_quants):
+            slice_manifest = manifest_dir + "/time_" + str(i) + ".json"
+            if "time_" + str(i) in metadata:
+                slice_infos[i] = metadata["time_" + str(i)]
+            else:
+                slice_infos[i] = read_manifest(slice_manifest) if resume else None
+            if slice_infos[i] is None:
+                # Full coherence models are only saved for debugging
+                if setup_dict.get("coherence_save"):
+                    c_savepaths[i] = model_savepath + "/coherence_" + str(i) + ".model"
+                else:
+                    c_savepaths[i] = None
+                slice_timer = topics_timer.child(time_slice=i)
+                jobs.append(
+                    (i, (trainer.model.dtm_coherence(i), c_savepaths[i], slice_timer, quantity))
+                )
+
+        for i, (coherence, topic_coherences, stages) in score_slices(
+            engine, jobs, setup_dict.get("coherence_processes", os.cpu_count())
+        ):
             # Save information about this time slice
-            coherence = cm.get_coherence()
-            coherences.append(coherence)
-            metadata["time_" + str(i)] = {
+            slice_infos[i] = {
                 "coherence": coherence,
+                "topic_coherences": topic_coherences,
                 "start_time": time_labels[i],
-                "num_posts": quantity,
-                "coherence_savepath": model_savepath + "/coherence_" + str(i) + ".model",
+                "num_posts": docs_quants[i],
+                "stages": stages,
             }
+            if c_savepaths[i] is not None:
+                slice_infos[i]["coherence_savepath"] = c_savepaths[i]
+            write_manifest(manifest_dir + "/time_" + str(i) + ".json", slice_infos[i])
 
-            # Save coherence model
-            cm.save(model_savepath + "/coherence_" + str(i) + ".model")
+        for i in range(len(docs_quants)):
+            coherences.append(slice_infos[i]["coherence"])
+            metadata["time_" + str(i)] = slice_infos[i]
 
         # Save information about the coherence scores over all the time slices
         coherences = np.array(coherences)
@@ -109,18 +734,13 @@ def main(setup_dict):
             "topics": num_topics,
         }
 
-        with open(
-            os.getenv("MODEL_DIR")
-            + "/"
-            + experiment_name
-            + "/"
-            + str(num_topics)
-            + "topics/metadata.json",
-            "w",
-        ) as output:
-            json.dump(metadata, output)
+        # Timings of the shared preprocessing, and of training and saving this model
+        metadata["preprocessing"] = timer.stages
+        metadata["stages"] = topics_timer.stages
+
+        results.save_metadata(experiment_name, num_topics, metadata)
 
 
 if __name__ == "__main__":
-    d = get_setup_dict()
-    main(d)
+    d, a = get_setup_dict()
+    main(d, a.resume, a.append)
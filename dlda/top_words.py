@@ -1,10 +1,13 @@
-import os, json, random, csv
+import os, sys, json, random, csv
 import argparse as ap
 from ogm.trainer import TextTrainer
 from gensim.models.coherencemodel import CoherenceModel
 import matplotlib.pyplot as plt
 from labellines import labelLines
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import artifacts, results
+
 
 def get_args():
     argparser = ap.ArgumentParser()
@@ -86,18 +89,19 @@ def main(setup_dict, args):
 
     main_path = os.getenv("MODEL_DIR") + "/" + experiment_name + "/" + str(n_topics) + "topics"
 
-    # Load metadata file
-    with open(main_path + "/metadata.json", "r") as json_file:
-        info = json.load(json_file)
+    # Each time slice's start time and coherence, and its topics' coherences
+    slices = results.get_time_slices(experiment_name, n_topics).get(n_topics, [])
+    slice_topic_coherences = results.get_topic_coherences(experiment_name, n_topics)
 
     # Load model
     model_path = main_path + "/ldaseq.model"
     print("Loading model from: " + model_path)
     trainer = TextTrainer()
-    trainer.load_model("ldaseq", model_path)
+    trainer.model = artifacts.load_ldaseq(model_path)
 
     # We will be keeping track of each individual topic's coherence for a plot later
-    individual_coherences = [[0] * (len(info.keys()) - 1) for x in range(n_topics)]
+    n_slices = len(slices)
+    individual_coherences = [[0] * n_slices for x in range(n_topics)]
     time_frame_labels = []
 
     # If a specific topic was specified, alert user about change in behavior
@@ -105,15 +109,18 @@ def main(setup_dict, args):
         print("KEYWORDS FOR TOPIC", only_topic)
 
     # For each topic, print the topic's top words and coherence
-    for i in range(len(info.keys()) - 1):
+    for i in range(n_slices):
         if only_topic is None:
             print("<details>")
             print("<summary> Click to expand time frame " + str(i) + " </summary>\n")
-            print("Average coherence for time frame:", info["time_" + str(i)]["coherence"])
-
-        cm = CoherenceModel.load(info["time_" + str(i)]["coherence_savepath"])
-        topic_coherences = cm.get_coherence_per_topic()
-        this_label = info["time_" + str(i)]["start_time"]
+            print("Average coherence for time frame:", slices[i]["coherence"])
+
+        # Models trained before per-topic coherences were recorded saved coherence models instead
+        topic_coherences = slice_topic_coherences.get("time_" + str(i))
+        if topic_coherences is None:
+            cm = CoherenceModel.load(slices[i]["coherence_savepath"])
+            topic_coherences = cm.get_coherence_per_topic()
+        this_label = slices[i]["start_time"]
         print("\nTime period start date:", this_label)
         if remove_from_label is not None:
             for item in remove_from_label:
@@ -166,7 +173,7 @@ def main(setup_dict, args):
         if only_topic is None:
             print("</details>\n")
 
-    print("Average coherence:", info["aggregated"]["avg_coherence"])
+    print("Average coherence:", results.get_aggregates(experiment_name)[n_topics]["avg_coherence"])
 
     if args.show_plot:
         ticks = [i for i in range(len(time_frame_labels))]
@@ -0,0 +1,37 @@
+import os
+import argparse as ap
+from contextlib import closing
+from common import results
+
+
+def get_args():
+    p = ap.ArgumentParser()
+    p.add_argument(
+        "experiments",
+        help="Names of the experiments to import; defaults to every experiment in $MODEL_DIR",
+        nargs="*",
+    )
+    return p.parse_args()
+
+
+def main(args):
+    experiments = args.experiments
+    if not experiments:
+        model_dir = os.getenv("MODEL_DIR")
+        experiments = [
+            d
+            for d in sorted(os.listdir(model_dir))
+            if os.path.isdir(model_dir + "/" + d) and not d.startswith(".")
+        ]
+
+    # Topic counts already in the database are replaced with what's in their metadata.json
+    with closing(results.connect()) as conn:
+        for experiment in experiments:
+            n_imported = results.import_experiment(conn, experiment)
+            print("Imported", n_imported, "topic counts of", experiment)
+
+    print("Results database:", results.get_db_path())
+
+
+if __name__ == "__main__":
+    main(get_args())
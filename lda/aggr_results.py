@@ -1,10 +1,13 @@
-import json, os
+import os, sys, json
 import numpy as np
 import argparse as ap
 import matplotlib.pyplot as plt
 from matplotlib import cm
 from matplotlib.ticker import MaxNLocator, FormatStrFormatter
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import results
+
 # Experiment parameters obtained by CLI args
 argparser = ap.ArgumentParser()
 argparser.add_argument("plot_title", help="Title to appear on plot")
@@ -78,22 +81,17 @@ if args.plot_3d:
             expt_config = json.load(infile)
         experiment_name = expt_config["name"]
 
-        # Read in all metadata files
-        models_parent_dir = os.getenv("MODEL_DIR") + "/" + experiment_name
-        topic_num_subdirs = os.listdir(models_parent_dir)
-        json_files = [models_parent_dir + "/" + x + "/metadata.json" for x in topic_num_subdirs]
+        # Aggregated scores of every topic count, from the results database
+        aggregates = results.get_aggregates(experiment_name)
+        if not aggregates:
+            print("Couldn't find results for " + experiment_name)
 
         x_topics = []
         y_coherence = []
 
-        for filename in json_files:
-            try:
-                with open(filename, "r") as json_file:
-                    info = json.load(json_file)
-                    x_topics.append(info["aggregated"]["topics"])
-                    y_coherence.append(info["aggregated"]["avg_coherence"])
-            except FileNotFoundError:
-                print("Couldn't find " + filename)
+        for aggregated in aggregates.values():
+            x_topics.append(aggregated["topics"])
+            y_coherence.append(aggregated["avg_coherence"])
 
         temp = zip(x_topics, y_coherence)
         res = sorted(temp, key=lambda x: x[0])
@@ -140,10 +138,10 @@ else:
             expt_config = json.load(infile)
         experiment_name = expt_config["name"]
 
-        # Read in all metadata files
-        models_parent_dir = os.getenv("MODEL_DIR") + "/" + experiment_name
-        topic_num_subdirs = os.listdir(models_parent_dir)
-        json_files = [models_parent_dir + "/" + x + "/metadata.json" for x in topic_num_subdirs]
+        # Aggregated scores of every topic count, from the results database
+        aggregates = results.get_aggregates(experiment_name)
+        if not aggregates:
+            print("Couldn't find results for " + experiment_name)
 
         # Process CLI args for requested coherence formula
         coherence_metrics = {"u_mass": "_u_mass", "c_uci": "_c_uci", "c_npmi": "_c_npmi", "c_v": ""}
@@ -157,21 +155,13 @@ else:
         plot_y_axes = {m: [] for m in to_find}
         plot_y_errs = {m: [] for m in to_find}
 
-        for filename in json_files:
-            try:
-                with open(filename, "r") as json_file:
-                    info = json.load(json_file)
-                    for metric in to_find:
-                        plot_x_axes[metric].append(info["aggregated"]["topics"])
-                        plot_y_axes[metric].append(
-                            info["aggregated"]["avg_coherence" + coherence_metrics[metric]]
-                        )
-                        plot_y_errs[metric].append(
-                            info["aggregated"]["coherence_stdev" + coherence_metrics[metric]]
-                        )
-
-            except FileNotFoundError:
-                print("Couldn't find " + filename)
+        for aggregated in aggregates.values():
+            for metric in to_find:
+                plot_x_axes[metric].append(aggregated["topics"])
+                plot_y_axes[metric].append(aggregated["avg_coherence" + coherence_metrics[metric]])
+                plot_y_errs[metric].append(
+                    aggregated["coherence_stdev" + coherence_metrics[metric]]
+                )
 
         for metric in to_find:
             # Pull the axis plots from the shared dictionary for this experiment
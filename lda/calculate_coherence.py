@@ -1,10 +1,19 @@
-import os, json
+import os, sys, json
 import argparse as ap
 import numpy as np
 from ogm.trainer import TextTrainer
-from ogm.utils import text_data_preprocess
 from gensim.models import CoherenceModel
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import artifacts, cache, preprocess, results
+from common.coherence import CoherenceEngine, get_model_topics
+
+# Suffix for each measure's keys in metadata.json; C_V scores use the keys lda.py writes
+KEY_SUFFIXES = {"u_mass": "_u_mass", "c_uci": "_c_uci", "c_npmi": "_c_npmi", "c_v": ""}
+
+# Measures `--measure all` computes
+ALL_MEASURES = {"u_mass", "c_uci", "c_npmi", "c_v"}
+
 
 def get_args():
     p = ap.ArgumentParser()
@@ -13,7 +22,7 @@ def get_args():
         "--measure",
         help="Which coherence measure should be used? Defaults to 'all'",
         default="all",
-        choices={"u_mass", "c_uci", "c_npmi", "all"},
+        choices={"u_mass", "c_uci", "c_npmi", "c_v", "all"},
     )
     p.add_argument(
         "--save_models",
@@ -31,33 +40,68 @@ def main(args):
     if not os.path.isfile(setup_dict["data_path"]):
         setup_dict["data_path"] = os.getenv("DATA_DIR") + "/" + setup_dict["data_path"]
 
-    # Read in data and run the ogm preprocessing on it
-    preprocessed_data = text_data_preprocess(setup_dict, output=False)
+    # Read in data and run the ogm preprocessing on it, unless it's already cached
     trainer = TextTrainer()
-    trainer.data = preprocessed_data
+    trainer.data, trainer.dictionary, trainer.corpus = cache.load_preprocessed(
+        setup_dict,
+        setup_dict["data_path"],
+        lambda: preprocess.preprocess_file(setup_dict, setup_dict["data_path"]),
+    )
     topic_quants = range(setup_dict["min_topics"], setup_dict["max_topics"] + 1)
     text_key = setup_dict["text_key"]
-    n_trials = setup_dict["n_trials"]
     experiment_name = setup_dict["name"]
 
-    # Loop through different topic quantities
-    for num_topics in topic_quants:
-
-        # Load previous metadata
-        with open(
-            os.getenv("MODEL_DIR")
-            + "/"
-            + experiment_name
-            + "/"
-            + str(num_topics)
-            + "topics/metadata.json",
-            "r",
-        ) as infile:
-            metadata = json.load(infile)
-
-        # For each topic quantity, run n_trials experiments
+    # Co-occurrence statistics are gathered once and shared by every model
+    engine = CoherenceEngine(
+        trainer.get_attribute_list(text_key),
+        trainer.corpus,
+        trainer.dictionary,
+        cache_dir=cache.get_entry_path(setup_dict, setup_dict["data_path"]),
+    )
+
+    # Load previous metadata of the topic quantities that were trained; a search may have
+    # skipped some
+    all_metadata = {}
+    for num_topics, metadata_path in sorted(results.list_metadata_files(experiment_name)):
+        if num_topics in topic_quants:
+            with open(metadata_path, "r") as infile:
+                all_metadata[num_topics] = json.load(infile)
+
+    if args.measure == "all":
+        to_measure = set(ALL_MEASURES)
+    else:
+        to_measure = {args.measure}
+
+    # With `all`, C_V is only computed for trials lda.py didn't already score, unless its
+    # coherence models are to be saved
+    def has_c_v(entry):
+        return (
+            args.measure == "all"
+            and not args.save_models
+            and "coherence" in entry
+            and "topic_coherences" in entry
+        )
+
+    if all(
+        has_c_v(entry)
+        for metadata in all_metadata.values()
+        for key, entry in metadata.items()
+        if key.startswith("model_")
+    ):
+        to_measure.discard("c_v")
+
+    # Gather the document and sliding window statistics for every measure in one pass
+    engine.precompute(to_measure)
+
+    for num_topics, metadata in all_metadata.items():
+        # Only the trials recorded for this topic quantity; a search may have run fewer than
+        # n_trials
+        trials = sorted(int(key[len("model_") :]) for key in metadata if key.startswith("model_"))
+        if not trials:
+            continue
+
         coherences = {}
-        for i in range(n_trials):
+        for i in trials:
             model_savepath = (
                 os.getenv("MODEL_DIR")
                 + "/"
@@ -67,34 +111,41 @@ def main(args):
                 + "topics/model_"
                 + str(i)
             )
-            trainer.load_model("lda", model_savepath + "/lda.model")
-
-            # Make a coherence model for this LDA model
-            if args.measure == "all":
-                to_measure = {"u_mass", "c_uci", "c_npmi"}
-            else:
-                to_measure = {args.measure}
+            # Memory-map the model and reuse the experiment's dictionary rather than its own copy
+            trainer.model = artifacts.load_lda(
+                model_savepath + "/lda.model", id2word=trainer.dictionary
+            )
+            topics = get_model_topics(trainer.model)
 
+            # Every measure is derived from the shared statistics
             for m in to_measure:
-                cm = CoherenceModel(
-                    model=trainer.model,
-                    corpus=trainer.corpus,
-                    texts=trainer.get_attribute_list(text_key),
-                    coherence=m,
-                )
-                coherence = cm.get_coherence()
-
                 if m not in coherences:
                     coherences[m] = []
 
+                if m == "c_v" and has_c_v(metadata["model_" + str(i)]):
+                    coherences[m].append(metadata["model_" + str(i)]["coherence"])
+                    continue
+
+                topic_coherences = engine.get_coherence_per_topic(topics, m)
+                coherence = float(np.mean(topic_coherences))
+
                 if np.isfinite(coherence):
                     coherences[m].append(coherence)
                 else:
                     coherences[m].append(None)
 
-                metadata["model_" + str(i)]["coherence_" + m] = coherences[m]
+                metadata["model_" + str(i)]["coherence" + KEY_SUFFIXES[m]] = coherences[m][-1]
+                metadata["model_" + str(i)]["topic_coherences" + KEY_SUFFIXES[m]] = [
+                    float(c) if np.isfinite(c) else None for c in topic_coherences
+                ]
 
                 if args.save_models:
+                    cm = CoherenceModel(
+                        model=trainer.model,
+                        corpus=trainer.corpus,
+                        texts=trainer.get_attribute_list(text_key),
+                        coherence=m,
+                    )
                     cm.save(model_savepath + "/coherence_" + m + ".model")
                 print("Finished", m, "coherence for trial", i, "in n_topics", num_topics)
 
@@ -102,21 +153,12 @@ def main(args):
         for m in to_measure:
             c = np.array([x for x in coherences[m] if x is not None])
             metadata["aggregated"] |= {
-                "avg_coherence_" + m: np.mean(c),
-                "coherence_stdev_" + m: np.std(c),
-                "coherence_variance_" + m: np.var(c),
+                "avg_coherence" + KEY_SUFFIXES[m]: np.mean(c),
+                "coherence_stdev" + KEY_SUFFIXES[m]: np.std(c),
+                "coherence_variance" + KEY_SUFFIXES[m]: np.var(c),
             }
 
-        with open(
-            os.getenv("MODEL_DIR")
-            + "/"
-            + experiment_name
-            + "/"
-            + str(num_topics)
-            + "topics/metadata.json",
-            "w",
-        ) as output:
-            json.dump(metadata, output)
+        results.save_metadata(experiment_name, num_topics, metadata)
 
 
 if __name__ == "__main__":
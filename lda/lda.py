@@ -1,172 +1,855 @@
-import os, json
+import os, sys, json, copy, random
 import argparse as ap
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from ogm.trainer import TextTrainer
-from gensim.models import CoherenceModel
+from gensim.models import CoherenceModel, LdaMulticore
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import artifacts, cache, preprocess, results, streaming
+from common.coherence import CoherenceEngine, get_model_topics
+from common.manifest import write_manifest, read_manifest, remove_manifest
+from common.instrument import StageTimer
+
+# Settings streamed models must be given, as LdaMulticore keyword arguments
+STREAMING_LDA_KEYS = ["passes", "chunksize", "alpha", "eta", "random_state"]
+
+# Trainer and coherence engine inherited by each worker process of the trial pool
+_job_trainer = None
+_job_engine = None
 
 
 def get_setup_dict():
     p = ap.ArgumentParser()
     p.add_argument("filepath", help="Path to experiment's JSON file")
+    p.add_argument(
+        "--resume",
+        help="Skip trials which already finished in a previous run of this experiment",
+        action="store_true",
+    )
+    p.add_argument(
+        "--update",
+        help="Data file of new documents to fold into each topic count's best model (or its "
+        + "latest update) with online updates, instead of running the sweep",
+        metavar="DATA_FILE",
+    )
     a = p.parse_args()
     with open(a.filepath, "r") as infile:
         input_dict = json.load(infile)
 
-    return input_dict
+    return input_dict, a
 
 
-def main(setup_dict):
+def get_model_savepath(setup_dict, num_topics, i):
+    return (
+        os.getenv("MODEL_DIR")
+        + "/"
+        + setup_dict["name"]
+        + "/"
+        + str(num_topics)
+        + "topics/model_"
+        + str(i)
+    )
 
-    # Look for input file at path and DATA_DIR if it's not there
-    if not os.path.isfile(setup_dict["data_path"]):
-        data_file = os.getenv("DATA_DIR") + "/" + setup_dict["data_path"]
+
+def get_finished_trials(setup_dict, num_topics):
+    # Trials with a manifest finished in an earlier run
+    finished = {}
+    for i in range(setup_dict["n_trials"]):
+        trial_info = read_manifest(get_model_savepath(setup_dict, num_topics, i) + "/trial.json")
+        if trial_info is not None:
+            finished[i] = trial_info
+
+    return finished
+
+
+def get_warm_start_sources(setup_dict, num_topics, finished):
+    """
+    Saved models to seed `num_topics` topics from, best first, one per trial of the source topic
+    count. The source is `warm_start.from_topics` if it's set, from any run (that topic count
+    itself trains from scratch); otherwise it's the nearest other topic count (preferring fewer
+    topics) with trials in `finished`, the trials finished so far in this run. Empty if there's
+    no source, to train from scratch.
+    """
+    if "from_topics" in setup_dict["warm_start"]:
+        source_topics = setup_dict["warm_start"]["from_topics"]
+        if source_topics == num_topics:
+            return []
+        try:
+            with open(results.get_metadata_path(setup_dict["name"], source_topics), "r") as infile:
+                metadata = json.load(infile)
+        except FileNotFoundError:
+            return []
+        trials = [v for key, v in metadata.items() if key.startswith("model_")]
     else:
-        data_file = setup_dict["data_path"]
+        candidates = [k for k in finished if k != num_topics and finished[k]]
+        if not candidates:
+            return []
+        source_topics = min(candidates, key=lambda k: (abs(k - num_topics), k > num_topics))
+        trials = list(finished[source_topics].values())
 
-    # Read in data and run the gensim preprocessing on it
-    trainer = TextTrainer()
-    trainer.parse_file(data_file)
-
-    if "time_filter" in setup_dict:
-        trainer.filter_within_time_range(
-            col=setup_dict["time_filter"]["time_key"],
-            data_format=setup_dict["time_filter"]["data_format"],
-            input_format=setup_dict["time_filter"]["arg_format"],
-            start=setup_dict["time_filter"]["start"],
-            end=setup_dict["time_filter"]["end"],
-        )
+    trials = [t for t in trials if t["coherence"] is not None and np.isfinite(t["coherence"])]
+    trials = sorted(trials, key=lambda t: (-t["coherence"], t["path"]))
+    return [t["path"] + "/lda.model" for t in trials if os.path.isfile(t["path"] + "/lda.model")]
 
-    if "attribute_filters" in setup_dict:
-        for attr_filter in setup_dict["attribute_filters"]:
-            trainer.filter_data(attr_filter["filter_key"], set(attr_filter["filter_vals"]))
 
-    print("Found " + str(trainer.data.shape[0]) + " posts")
+def get_warm_starts(setup_dict, jobs, finished):
+    # Source model of each (num_topics, trial) job; trials of a topic count take turns over
+    # its sources, so they don't all start from the same one
+    if "warm_start" not in setup_dict:
+        return {}
 
-    if "replace_before_stemming" in setup_dict:
-        trainer.replace_words(setup_dict["text_key"], setup_dict["replace_before_stemming"])
+    sources = {}
+    warm_starts = {}
+    for num_topics, i in jobs:
+        if num_topics not in sources:
+            sources[num_topics] = get_warm_start_sources(setup_dict, num_topics, finished)
+        if sources[num_topics]:
+            warm_starts[(num_topics, i)] = sources[num_topics][i % len(sources[num_topics])]
+    return warm_starts
 
-    if "remove_before_stemming" in setup_dict:
-        a = trainer.remove_words(setup_dict["text_key"], set(setup_dict["remove_before_stemming"]))
-        print("Removed " + str(a) + " instances of", setup_dict["remove_before_stemming"])
 
-    trainer.lemmatize_stem_words(setup_dict["text_key"])
+def get_warm_start_sstats(sstats, num_topics):
+    # Split the heaviest topics in two, or drop the lightest, until there are num_topics
+    sstats = np.array(sstats)
+    while sstats.shape[0] < num_topics:
+        j = np.argmax(sstats.sum(axis=1))
 
-    if "replace_after_stemming" in setup_dict:
-        trainer.replace_words(setup_dict["text_key"], setup_dict["replace_after_stemming"])
+        # Perturb the halves in opposite directions so they can drift apart during training
+        noise = np.random.uniform(0.9, 1.1, sstats.shape[1])
+        half = sstats[j] / 2
+        sstats[j] = half * noise
+        sstats = np.vstack([sstats, half * (2 - noise)])
 
-    if "remove_after_stemming" in setup_dict:
-        a = trainer.remove_words(setup_dict["text_key"], set(setup_dict["remove_after_stemming"]))
-        print("Removed " + str(a) + " instances of", setup_dict["remove_after_stemming"])
+    if sstats.shape[0] > num_topics:
+        keep = np.sort(np.argsort(sstats.sum(axis=1))[::-1][:num_topics])
+        sstats = sstats[keep]
 
-    topic_quants = range(setup_dict["min_topics"], setup_dict["max_topics"] + 1)
+    # Perturb every topic as well, so trials seeded from the same model still differ
+    return sstats * np.random.uniform(0.9, 1.1, sstats.shape)
+
+
+def get_lda_params(model):
+    """
+    Hyperparameters `model` was trained with, to train a model with another number of topics
+    the same way. Priors that depend on the number of topics are given by name.
+    """
+    alpha = np.asarray(model.alpha)
+    if np.allclose(alpha, 1.0 / model.num_topics):
+        alpha = "symmetric"
+    elif np.allclose(alpha, model.init_dir_prior("asymmetric", "alpha")[0]):
+        alpha = "asymmetric"
+    else:
+        # A custom prior per topic can't carry over to other topics; keep its average
+        alpha = float(alpha.mean())
+
+    eta = np.asarray(model.eta)
+    if np.allclose(eta, 1.0 / model.num_topics):
+        eta = "symmetric"
+
+    return {
+        "alpha": alpha,
+        "eta": eta,
+        "chunksize": model.chunksize,
+        "decay": model.decay,
+        "offset": model.offset,
+        "iterations": model.iterations,
+        "gamma_threshold": model.gamma_threshold,
+        "eval_every": model.eval_every,
+        "minimum_probability": model.minimum_probability,
+    }
+
+
+def train_warm_started(trainer, source_path, num_topics, n_workers, passes):
+    source = artifacts.load_lda(source_path, id2word=trainer.dictionary)
+
+    # Build an untrained model with the source's hyperparameters, replace its random topic-word
+    # state with the seeded one, then train on the corpus from there
+    model = LdaMulticore(
+        id2word=trainer.dictionary,
+        num_topics=num_topics,
+        workers=n_workers,
+        passes=passes,
+        **get_lda_params(source)
+    )
+    model.state.sstats = get_warm_start_sstats(source.state.sstats, num_topics).astype(model.dtype)
+    model.sync_state()
+    model.update(trainer.corpus)
+    return model
+
+
+def run_trial(trainer, engine, setup_dict, num_topics, i, n_workers, warm_start_path=None):
     text_key = setup_dict["text_key"]
     n_trials = setup_dict["n_trials"]
-    experiment_name = setup_dict["name"]
+    model_savepath = get_model_savepath(setup_dict, num_topics, i)
+    os.makedirs(model_savepath, exist_ok=True)
 
-    print("Training models for topic_nums:", topic_quants)
+    # This trial's files are about to be overwritten; an earlier run's manifest mustn't vouch for
+    # them if this run dies before writing its own
+    remove_manifest(model_savepath + "/trial.json")
 
-    # Loop through different topic quantities
-    for num_topics in topic_quants:
+    # Check whether to save LDA model to disk
+    if "lda_nosave" in setup_dict and setup_dict["lda_nosave"]:
+        lda_savepath = None
+    else:
+        lda_savepath = model_savepath + "/lda.model"
 
-        # For each topic quantity, run n_trials experiments
-        metadata = {}
-        coherences = []
-        for i in range(n_trials):
-            model_savepath = (
-                os.getenv("MODEL_DIR")
-                + "/"
-                + experiment_name
-                + "/"
-                + str(num_topics)
-                + "topics/model_"
-                + str(i)
-            )
-            os.makedirs(model_savepath, exist_ok=True)
+    # Full coherence models are only saved for debugging; per-topic scores are in the results
+    if setup_dict.get("coherence_save"):
+        c_savepath = model_savepath + "/coherence.model"
+    else:
+        c_savepath = None
 
-            # Check whether to save LDA model to disk
-            if "lda_nosave" in setup_dict and setup_dict["lda_nosave"]:
-                lda_savepath = None
-            else:
-                lda_savepath = model_savepath + "/lda.model"
+    timer = StageTimer(
+        setup_dict.get("instrumentation_log"),
+        experiment=setup_dict["name"],
+        topics=num_topics,
+        trial=i,
+    )
 
-            # Check whether to save coherence model to disk
-            if "coherence_nosave" in setup_dict and setup_dict["coherence_nosave"]:
-                c_savepath = None
-            else:
-                c_savepath = model_savepath + "/coherence.model"
-
-            # Train a parallelized LDA model
-            # ALPHA: has to do with the expected number of topics per document;
-            # can be set to a `num_topics` length array representing each topic's probability,
-            # or just a uniform distribution by default
-            # BETA (eta in this implementation): has to do with the number of words per topic;
-            # high beta means each topic has a mixture of most words,
-            # low beta means each topic has a mixture of just a few of the words
+    # Train a parallelized LDA model
+    # ALPHA: has to do with the expected number of topics per document;
+    # can be set to a `num_topics` length array representing each topic's probability,
+    # or just a uniform distribution by default
+    # BETA (eta in this implementation): has to do with the number of words per topic;
+    # high beta means each topic has a mixture of most words,
+    # low beta means each topic has a mixture of just a few of the words
+    with timer.stage("training", n_docs=len(trainer.corpus)):
+        if warm_start_path is not None:
+            print("[" + str(num_topics) + " topics] Warm-starting from", warm_start_path)
+            trainer.model = train_warm_started(
+                trainer,
+                warm_start_path,
+                num_topics,
+                n_workers,
+                setup_dict["warm_start"].get("passes", 1),
+            )
+        elif setup_dict.get("streaming"):
+            # There's no data table in memory; train straight from the corpus on disk with
+            # the experiment's own settings, as ogm's train_lda needs the data table
+            streaming_params = get_streaming_params(setup_dict, i)
+            trainer.model = LdaMulticore(
+                corpus=trainer.corpus,
+                id2word=trainer.dictionary,
+                num_topics=num_topics,
+                workers=n_workers,
+                **streaming_params,
+            )
+        else:
             trainer.train_lda(
-                col=text_key, n_topics=num_topics, output_path=lda_savepath, n_workers=8
+                col=text_key, n_topics=num_topics, output_path=None, n_workers=n_workers
             )
 
-            print(
-                "["
-                + str(i + 1)
-                + "/"
-                + str(n_trials)
-                + "]["
-                + str(num_topics)
-                + " topics] Model complete!"
+    # Large arrays are saved in their own files so analysis scripts can memory-map them
+    if lda_savepath:
+        with timer.stage("save"):
+            artifacts.save_lda(trainer.model, lda_savepath)
+
+    # Prepare the model's pyLDAvis data for `top_words.py --ldavis` while the corpus is loaded.
+    # It's a pass of inference over the whole corpus, so it's opt-in and skipped when streaming.
+    if (
+        lda_savepath
+        and setup_dict.get("ldavis", {}).get("after_training")
+        and not setup_dict.get("streaming")
+    ):
+        with timer.stage("ldavis", n_docs=len(trainer.corpus)):
+            artifacts.load_ldavis(
+                lda_savepath,
+                lambda: (trainer.model, trainer.corpus, trainer.dictionary),
+                get_ldavis_jobs(setup_dict),
             )
 
-            # Make a coherence model for this LDA model
+    print(
+        "[" + str(i + 1) + "/" + str(n_trials) + "][" + str(num_topics) + " topics] Model complete!"
+    )
+
+    # Score this LDA model against the corpus' shared co-occurrence statistics
+    with timer.stage("coherence"):
+        topic_coherences = engine.get_coherence_per_topic(get_model_topics(trainer.model), "c_v")
+        coherence = float(np.mean(topic_coherences))
+
+    # A coherence model holds all the texts in memory, so it's never saved when streaming
+    if c_savepath and not setup_dict.get("streaming"):
+        with timer.stage("save"):
             cm = CoherenceModel(
                 model=trainer.model,
                 corpus=trainer.corpus,
                 texts=trainer.get_attribute_list(text_key),
                 coherence="c_v",
             )
+            cm.save(c_savepath)
+
+    print(
+        "["
+        + str(i + 1)
+        + "/"
+        + str(n_trials)
+        + "]["
+        + str(num_topics)
+        + " topics] Coherence complete!"
+    )
 
-            # Save information about this model
-            coherence = cm.get_coherence()
-            coherences.append(coherence)
-            metadata["model_" + str(i)] = {
-                "path": model_savepath,
-                "coherence": coherence,
-            }
-
-            # Save coherence model
-            if c_savepath:
-                cm.save(c_savepath)
-
-            print(
-                "["
-                + str(i + 1)
-                + "/"
-                + str(n_trials)
-                + "]["
-                + str(num_topics)
-                + " topics] Coherence complete!"
+    # Record that this trial is done; metadata.json can be rebuilt from these manifests
+    trial_info = {
+        "path": model_savepath,
+        "coherence": coherence,
+        "topic_coherences": [float(c) for c in topic_coherences],
+        "stages": timer.stages,
+    }
+    # Record the model this trial was seeded from, or that it trained from scratch
+    if "warm_start" in setup_dict:
+        trial_info["warm_start"] = warm_start_path
+    if setup_dict.get("streaming") and warm_start_path is None:
+        trial_info["streaming_lda"] = streaming_params
+    write_manifest(model_savepath + "/trial.json", trial_info)
+    return trial_info
+
+
+def write_metadata(setup_dict, num_topics, trials, preprocessing=None):
+    # `trials` maps trial index -> that trial's metadata entry
+    metadata = {}
+    for i in sorted(trials):
+        metadata["model_" + str(i)] = trials[i]
+
+    # Save information about the coherence scores overall
+    coherences = np.array([trials[i]["coherence"] for i in sorted(trials)])
+    metadata["aggregated"] = {
+        "avg_coherence": np.mean(coherences),
+        "coherence_stdev": np.std(coherences),
+        "coherence_variance": np.var(coherences),
+        "topics": num_topics,
+    }
+
+    # Timings of the preprocessing shared by every model in the sweep
+    if preprocessing is not None:
+        metadata["preprocessing"] = preprocessing
+
+    # Models made with --update aren't part of the sweep; keep them when it's rewritten
+    try:
+        with open(results.get_metadata_path(setup_dict["name"], num_topics), "r") as infile:
+            previous = json.load(infile)
+    except (FileNotFoundError, json.JSONDecodeError):
+        previous = {}
+    for key, entry in previous.items():
+        if key.startswith("update_"):
+            metadata[key] = entry
+
+    results.save_metadata(setup_dict["name"], num_topics, metadata)
+
+
+def init_job_worker(trainer, engine):
+    global _job_trainer, _job_engine
+    _job_trainer = trainer
+    _job_engine = engine
+
+
+def run_job(setup_dict, num_topics, i, n_workers, warm_start_path):
+    # Forked workers start with identical RNG states; reseed so trials differ
+    np.random.seed()
+    random.seed()
+    return (
+        num_topics,
+        i,
+        run_trial(_job_trainer, _job_engine, setup_dict, num_topics, i, n_workers, warm_start_path),
+    )
+
+
+def get_scheduler_params(setup_dict):
+    scheduler = setup_dict["scheduler"]
+    pool_size = scheduler.get("pool_size", os.cpu_count())
+    max_jobs = scheduler.get("max_concurrent_jobs", pool_size)
+    if "gensim_workers" in scheduler:
+        n_workers = scheduler["gensim_workers"]
+    else:
+        n_workers = max(1, os.cpu_count() // pool_size)
+
+    return pool_size, max_jobs, n_workers
+
+
+def get_ldavis_jobs(setup_dict):
+    if "n_jobs" in setup_dict["ldavis"]:
+        return setup_dict["ldavis"]["n_jobs"]
+
+    # Concurrent trials share the CPUs rather than each taking all of them
+    if "scheduler" in setup_dict:
+        _, max_jobs, _ = get_scheduler_params(setup_dict)
+        return max(1, os.cpu_count() // max_jobs)
+    return -1
+
+
+def run_pooled(pool, setup_dict, jobs, max_jobs, n_workers, on_done, warm_starts):
+    # Keep at most `max_jobs` of the (num_topics, trial) jobs in flight
+    pending_jobs = list(reversed(jobs))
+    running = set()
+    while pending_jobs or running:
+        while pending_jobs and len(running) < max_jobs:
+            num_topics, i = pending_jobs.pop()
+            running.add(
+                pool.submit(
+                    run_job, setup_dict, num_topics, i, n_workers, warm_starts.get((num_topics, i))
+                )
             )
 
-        # Save information about the coherence scores overall
-        coherences = np.array(coherences)
-        metadata["aggregated"] = {
-            "avg_coherence": np.mean(coherences),
-            "coherence_stdev": np.std(coherences),
-            "coherence_variance": np.var(coherences),
-            "topics": num_topics,
+        done, running = wait(running, return_when=FIRST_COMPLETED)
+        for job in done:
+            on_done(*job.result())
+
+
+def run_scheduled(trainer, engine, setup_dict, topic_quants, resume=False, preprocessing=None):
+    pool_size, max_jobs, n_workers = get_scheduler_params(setup_dict)
+
+    n_trials = setup_dict["n_trials"]
+    if resume:
+        finished = {k: get_finished_trials(setup_dict, k) for k in topic_quants}
+    else:
+        finished = {k: {} for k in topic_quants}
+
+    pending_jobs = [(k, i) for k in topic_quants for i in range(n_trials) if i not in finished[k]]
+
+    # Topic counts finished entirely in a previous run only need their metadata rebuilt
+    for num_topics in topic_quants:
+        if len(finished[num_topics]) == n_trials:
+            write_metadata(setup_dict, num_topics, finished[num_topics], preprocessing)
+
+    print(
+        "Scheduling",
+        len(pending_jobs),
+        "trials on",
+        pool_size,
+        "processes,",
+        n_workers,
+        "gensim workers each",
+    )
+
+    def on_done(num_topics, i, trial_info):
+        finished[num_topics][i] = trial_info
+
+        # Metadata is written as soon as every trial for a topic count is in
+        if len(finished[num_topics]) == n_trials:
+            write_metadata(setup_dict, num_topics, finished[num_topics], preprocessing)
+
+    # Warm-started topic counts are seeded from the ones before them, so they run one after
+    # another (with their trials in parallel) to pick the same sources whatever the timing
+    if "warm_start" in setup_dict and "from_topics" not in setup_dict["warm_start"]:
+        waves = [
+            [(k, i) for k, i in pending_jobs if k == num_topics] for num_topics in topic_quants
+        ]
+    else:
+        waves = [pending_jobs]
+
+    # Workers only need the preprocessed trainer once, not once per job
+    with ProcessPoolExecutor(
+        max_workers=pool_size, initializer=init_job_worker, initargs=(trainer, engine)
+    ) as pool:
+        for jobs in waves:
+            warm_starts = get_warm_starts(setup_dict, jobs, finished)
+            run_pooled(pool, setup_dict, jobs, max_jobs, n_workers, on_done, warm_starts)
+
+
+def get_search_grid(setup_dict, best, step):
+    # Topic counts `step` apart, either across the whole range or either side of `best`
+    min_topics, max_topics = setup_dict["min_topics"], setup_dict["max_topics"]
+    if best is None:
+        grid = list(range(min_topics, max_topics + 1, step))
+        if grid[-1] != max_topics:
+            grid.append(max_topics)
+        return grid
+
+    return [k for k in (best - step, best, best + step) if min_topics <= k <= max_topics]
+
+
+def get_mean_coherence(trials):
+    coherences = [t["coherence"] for t in trials.values()]
+    if not coherences or not np.any(np.isfinite(coherences)):
+        return -np.inf
+    return np.nanmean(coherences)
+
+
+def get_streaming_params(setup_dict, trial=0):
+    """
+    Training settings of streamed models. In-memory models get theirs from ogm's train_lda, so
+    they have to be given explicitly for the two to be comparable; trial `i` is seeded with
+    `random_state + i`.
+    """
+    params = setup_dict.get("streaming_lda", {})
+    missing = [k for k in STREAMING_LDA_KEYS if k not in params]
+    if missing:
+        raise ValueError(
+            "Streamed models are trained with gensim directly, so streaming_lda has to set "
+            + ", ".join(missing)
+        )
+    params = {k: params[k] for k in STREAMING_LDA_KEYS}
+    if params["random_state"] is not None:
+        params["random_state"] += trial
+    return params
+
+
+def get_search_params(setup_dict):
+    # First step and grid of the search, its trial budget and halving factor
+    search = setup_dict["search"]
+    step = search.get(
+        "coarse_step", max(1, (setup_dict["max_topics"] - setup_dict["min_topics"]) // 8)
+    )
+    grid = get_search_grid(setup_dict, None, step)
+    budget = search.get("trial_budget", setup_dict["n_trials"] * len(grid))
+    if budget < 1:
+        raise ValueError("The search's trial budget must be at least 1, not " + str(budget))
+    eta = search.get("eta", 2)
+    if not isinstance(eta, int) or eta < 2:
+        raise ValueError("The search's eta must be an integer of at least 2, not " + str(eta))
+    return step, grid, budget, eta
+
+
+def run_search(trainer, engine, setup_dict, resume=False, preprocessing=None):
+    search = setup_dict["search"]
+    n_trials = setup_dict["n_trials"]
+    step, grid, budget, eta = get_search_params(setup_dict)
+
+    # Trials per topic count, including any finished in a previous run
+    finished = {}
+
+    def get_trials(num_topics):
+        if num_topics not in finished:
+            if resume:
+                finished[num_topics] = get_finished_trials(setup_dict, num_topics)
+            else:
+                finished[num_topics] = {}
+        return finished[num_topics]
+
+    def on_done(num_topics, i, trial_info):
+        get_trials(num_topics)[i] = trial_info
+
+    if "scheduler" in setup_dict:
+        pool_size, max_jobs, n_workers = get_scheduler_params(setup_dict)
+        pool = ProcessPoolExecutor(
+            max_workers=pool_size, initializer=init_job_worker, initargs=(trainer, engine)
+        )
+    else:
+        pool = None
+        n_workers = setup_dict.get("n_workers", 8)
+
+    spent = 0
+    try:
+        while True:
+            # Successive halving over this grid: every candidate gets a few trials, the best
+            # 1/eta get eta times as many, until the survivors have n_trials each
+            candidates = grid
+            rung_trials = min(search.get("min_trials", 1), n_trials)
+            while True:
+                jobs = [
+                    (k, i) for k in candidates for i in range(rung_trials) if i not in get_trials(k)
+                ]
+                exhausted = spent + len(jobs) >= budget
+                jobs = jobs[: budget - spent]
+                spent += len(jobs)
+
+                # Sources come from earlier rungs, which are finished whatever the timing
+                warm_starts = get_warm_starts(setup_dict, jobs, finished)
+                if pool is not None:
+                    run_pooled(pool, setup_dict, jobs, max_jobs, n_workers, on_done, warm_starts)
+                else:
+                    for num_topics, i in jobs:
+                        trial_info = run_trial(
+                            trainer,
+                            engine,
+                            setup_dict,
+                            num_topics,
+                            i,
+                            n_workers,
+                            warm_starts.get((num_topics, i)),
+                        )
+                        on_done(num_topics, i, trial_info)
+
+                # aggr_results.py reads whatever trials each topic count has so far
+                for num_topics in {k for k, _ in jobs}:
+                    write_metadata(setup_dict, num_topics, get_trials(num_topics), preprocessing)
+
+                ranked = sorted(
+                    [k for k in candidates if get_trials(k)],
+                    key=lambda k: get_mean_coherence(get_trials(k)),
+                    reverse=True,
+                )
+                print(
+                    "[search] Step",
+                    step,
+                    "with",
+                    rung_trials,
+                    "trials each:",
+                    ", ".join(
+                        str(k) + " topics " + str(round(get_mean_coherence(get_trials(k)), 4))
+                        for k in ranked
+                    ),
+                )
+                if exhausted or rung_trials >= n_trials or not ranked:
+                    break
+
+                candidates = ranked[: max(1, int(np.ceil(len(ranked) / eta)))]
+                rung_trials = min(n_trials, rung_trials * eta)
+
+            # Refine around the best topic count with a finer grid
+            tried = [k for k in finished if finished[k]]
+            if not tried:
+                best = None
+                break
+            best = max(tried, key=lambda k: get_mean_coherence(finished[k]))
+            if exhausted or step == 1:
+                break
+            step = max(1, step // eta)
+            grid = get_search_grid(setup_dict, best, step)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if best is None:
+        print("[search] No trials finished within the budget of", budget, "trials")
+        return
+
+    print(
+        "[search] Best topic count:",
+        best,
+        "with average coherence",
+        get_mean_coherence(finished[best]),
+        "after",
+        spent,
+        "trials",
+    )
+
+
+def run_sequential(trainer, engine, setup_dict, topic_quants, resume=False, preprocessing=None):
+    n_workers = setup_dict.get("n_workers", 8)
+    finished = {}
+
+    # Loop through different topic quantities
+    for num_topics in topic_quants:
+
+        # For each topic quantity, run n_trials experiments
+        trials = get_finished_trials(setup_dict, num_topics) if resume else {}
+        jobs = [(num_topics, i) for i in range(setup_dict["n_trials"])]
+        warm_starts = get_warm_starts(setup_dict, jobs, finished)
+        for i in range(setup_dict["n_trials"]):
+            if i in trials:
+                print("[" + str(num_topics) + " topics] Trial", i, "already finished, skipping")
+                continue
+            trials[i] = run_trial(
+                trainer, engine, setup_dict, num_topics, i, n_workers, warm_starts.get(jobs[i])
+            )
+
+        finished[num_topics] = trials
+        write_metadata(setup_dict, num_topics, trials, preprocessing)
+
+
+def get_update_source(metadata):
+    # Updates build on each other, starting from the best trial of the sweep
+    updates = [int(k[len("update_") :]) for k in metadata.keys() if k.startswith("update_")]
+    if updates:
+        return metadata["update_" + str(max(updates))]["path"], max(updates) + 1
+
+    trials = [v for k, v in metadata.items() if k.startswith("model_")]
+    trials = [t for t in trials if t["coherence"] is not None and np.isfinite(t["coherence"])]
+    if not trials:
+        return None, 0
+    return max(trials, key=lambda t: t["coherence"])["path"], 0
+
+
+def get_engine(engines, texts, dictionary):
+    # Models of different topic counts usually share a dictionary, and so coherence statistics
+    for e in engines:
+        if e.dictionary.token2id == dictionary.token2id:
+            return e
+    engine = CoherenceEngine(texts, None, dictionary)
+    engines.append(engine)
+    return engine
+
+
+def extend_vocabulary(model, texts, min_count, n_workers):
+    """
+    Add the words of `texts` seen at least `min_count` times to a copy of `model`. Their topic
+    weights start from the prior alone; existing words keep their IDs and weights. The copy's
+    dictionary counts `texts` among its documents.
+    """
+    dictionary = copy.deepcopy(model.id2word)
+    counts = {}
+    for text in texts:
+        for word in text:
+            if word not in dictionary.token2id:
+                counts[word] = counts.get(word, 0) + 1
+    new_words = {w for w, c in counts.items() if c >= min_count}
+
+    # Count the new documents as gensim would have if they'd been in the corpus, over the words
+    # the dictionary keeps, so document frequencies stay right for later filtering
+    for text in texts:
+        dictionary.doc2bow(
+            [w for w in text if w in new_words or w in dictionary.token2id], allow_update=True
+        )
+    n_new = len(dictionary) - len(model.id2word)
+    if n_new == 0:
+        return model, 0
+
+    eta = np.asarray(model.eta)
+    extended = LdaMulticore(
+        id2word=dictionary,
+        num_topics=model.num_topics,
+        workers=n_workers,
+        alpha=model.alpha,
+        eta=np.concatenate([eta, np.full(n_new, eta.mean())]),
+        decay=model.decay,
+        offset=model.offset,
+    )
+    sstats = np.zeros((model.num_topics, len(dictionary)), dtype=extended.dtype)
+    sstats[:, : len(model.id2word)] = model.state.sstats
+    extended.state.sstats = sstats
+    extended.state.numdocs = model.state.numdocs
+    extended.num_updates = model.num_updates
+    extended.sync_state()
+    return extended, n_new
+
+
+def run_update(texts, setup_dict, update_file, timer):
+    """
+    Fold the documents of `update_file` into the best model of every topic count and add the
+    updated models to metadata.json as `update_<n>`. Each updated model and the model it was
+    updated from are scored against the experiment's texts plus the new ones, under their own
+    keys: trials are scored against the experiment's texts alone, so the scores aren't comparable.
+    """
+    new_data, _, _ = cache.load_preprocessed(
+        setup_dict,
+        update_file,
+        lambda: preprocess.preprocess_file(setup_dict, update_file, timer),
+        timer,
+    )
+    new_texts = new_data[setup_dict["text_key"]].tolist()
+    all_texts = list(texts) + new_texts
+    update_config = setup_dict.get("update", {})
+    n_workers = setup_dict.get("n_workers", 8)
+
+    engines = []
+    for num_topics in range(setup_dict["min_topics"], setup_dict["max_topics"] + 1):
+        metadata_path = results.get_metadata_path(setup_dict["name"], num_topics)
+        if not os.path.isfile(metadata_path):
+            continue
+        with open(metadata_path, "r") as infile:
+            metadata = json.load(infile)
+
+        source_path, j = get_update_source(metadata)
+        if source_path is None:
+            print("[" + str(num_topics) + " topics] No trial with a finite coherence, skipping")
+            continue
+        update_path = os.path.dirname(metadata_path) + "/update_" + str(j)
+        update_timer = timer.child(topics=num_topics, update=j)
+        print("[" + str(num_topics) + " topics] Updating", source_path)
+
+        # Online updates write to the model's arrays, so they're loaded rather than mapped
+        model = artifacts.load_lda(source_path + "/lda.model", mmap=None)
+        with update_timer.stage("coherence"):
+            source_coherence = get_engine(engines, all_texts, model.id2word).get_coherence(
+                get_model_topics(model), "c_v"
+            )
+
+        n_new = 0
+        if update_config.get("extend_dictionary"):
+            model, n_new = extend_vocabulary(
+                model, new_texts, update_config.get("min_count", 5), n_workers
+            )
+
+        corpus = [model.id2word.doc2bow(text) for text in new_texts]
+        with update_timer.stage("training", n_docs=len(corpus)):
+            model.passes = update_config.get("passes", 1)
+            model.workers = n_workers
+            model.update(corpus)
+
+        os.makedirs(update_path, exist_ok=True)
+        with update_timer.stage("save"):
+            artifacts.save_lda(model, update_path + "/lda.model")
+
+        with update_timer.stage("coherence"):
+            engine = get_engine(engines, all_texts, model.id2word)
+            topic_coherences = engine.get_coherence_per_topic(get_model_topics(model), "c_v")
+            coherence = float(np.mean(topic_coherences))
+
+        metadata["update_" + str(j)] = {
+            "path": update_path,
+            "source": source_path,
+            "data_path": update_file,
+            "n_docs": len(corpus),
+            "new_words": n_new,
+            "update_coherence": coherence,
+            "topic_coherences_update": [float(c) for c in topic_coherences],
+            "source_update_coherence": source_coherence,
+            "stages": update_timer.stages,
         }
+        results.save_metadata(setup_dict["name"], num_topics, metadata)
+        print(
+            "[" + str(num_topics) + " topics] Coherence with the new documents:",
+            source_coherence,
+            "before the update,",
+            coherence,
+            "after",
+        )
 
-        with open(
-            os.getenv("MODEL_DIR")
-            + "/"
-            + experiment_name
-            + "/"
-            + str(num_topics)
-            + "topics/metadata.json",
-            "w",
-        ) as output:
-            json.dump(metadata, output)
+
+def main(setup_dict, resume=False, update_file=None):
+
+    # Look for input file at path and DATA_DIR if it's not there
+    if not os.path.isfile(setup_dict["data_path"]):
+        data_file = os.getenv("DATA_DIR") + "/" + setup_dict["data_path"]
+    else:
+        data_file = setup_dict["data_path"]
+
+    if update_file is not None and setup_dict.get("streaming"):
+        raise ValueError("Updating models isn't supported for streamed experiments")
+
+    # Fail before preprocessing if streamed models' settings are missing
+    if update_file is None and setup_dict.get("streaming"):
+        get_streaming_params(setup_dict)
+
+    # Fail before preprocessing if the search can't train anything
+    if update_file is None and "search" in setup_dict:
+        get_search_params(setup_dict)
+
+    timer = StageTimer(setup_dict.get("instrumentation_log"), experiment=setup_dict["name"])
+
+    # Read in data and run the gensim preprocessing on it, unless it's already cached
+    trainer = TextTrainer()
+    if setup_dict.get("streaming"):
+        # Preprocess chunk by chunk and keep the texts and corpus on disk
+        cache_dir, (texts, trainer.dictionary, trainer.corpus) = streaming.load_streamed(
+            setup_dict, data_file, timer
+        )
+    else:
+        trainer.data, trainer.dictionary, trainer.corpus = cache.load_preprocessed(
+            setup_dict,
+            data_file,
+            lambda: preprocess.preprocess_file(setup_dict, data_file, timer),
+            timer,
+        )
+        texts = trainer.get_attribute_list(setup_dict["text_key"])
+        cache_dir = cache.get_entry_path(setup_dict, data_file)
+
+    if update_file is not None:
+        if not os.path.isfile(update_file):
+            update_file = os.getenv("DATA_DIR") + "/" + update_file
+        run_update(texts, setup_dict, update_file, timer)
+        return
+
+    # Co-occurrence statistics are gathered once and shared by every model in the sweep
+    engine = CoherenceEngine(texts, trainer.corpus, trainer.dictionary, cache_dir=cache_dir)
+    with timer.stage("coherence_statistics", n_docs=len(trainer.corpus)):
+        engine.get_stats("c_v")
+
+    topic_quants = range(setup_dict["min_topics"], setup_dict["max_topics"] + 1)
+
+    print("Training models for topic_nums:", topic_quants)
+
+    # Search for the best topic count within a trial budget, or run the topic-count x trial
+    # grid, as a pool of independent jobs if requested
+    if "search" in setup_dict:
+        run_search(trainer, engine, setup_dict, resume, timer.stages)
+    elif "scheduler" in setup_dict:
+        run_scheduled(trainer, engine, setup_dict, topic_quants, resume, timer.stages)
+    else:
+        run_sequential(trainer, engine, setup_dict, topic_quants, resume, timer.stages)
 
 
 if __name__ == "__main__":
-    d = get_setup_dict()
-    main(d)
+    d, a = get_setup_dict()
+    main(d, a.resume, a.update)
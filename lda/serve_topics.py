@@ -0,0 +1,336 @@
+import os, sys, json, time, queue, signal, threading, socketserver, contextlib
+import argparse as ap
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import artifacts, preprocess
+from common.instrument import StageTimer
+
+
+def get_args():
+    p = ap.ArgumentParser()
+    p.add_argument("--experiment_config", help="Path to experiment JSON file", required=True)
+    p.add_argument(
+        "--n_topics", help="Number of topics of the model to serve", type=int, required=True
+    )
+    p.add_argument(
+        "--model_num",
+        help="Specific model to serve; if not specified, will use the highest-coherence model",
+        type=int,
+    )
+    p.add_argument(
+        "--mode",
+        help="stdio: JSON lines on stdin/stdout; socket: JSON lines over a Unix socket; "
+        + "http: POST to /topics",
+        choices=["stdio", "socket", "http"],
+        default="stdio",
+    )
+    p.add_argument("--socket_path", help="Unix socket to listen on", default="serve_topics.sock")
+    p.add_argument("--host", help="HTTP host to listen on", default="127.0.0.1")
+    p.add_argument("--port", help="HTTP port to listen on", type=int, default=8080)
+    p.add_argument("--batch_size", help="Most documents inferred at once", type=int, default=256)
+    p.add_argument(
+        "--max_wait_ms",
+        help="How long to wait for more documents before inferring a partial batch",
+        type=float,
+        default=10,
+    )
+    p.add_argument(
+        "--report_every",
+        help="Seconds between throughput reports on stderr; 0 to only report on exit",
+        type=float,
+        default=60,
+    )
+    return p.parse_args()
+
+
+def load_model(setup_dict, args):
+    if args.model_num is None:
+        model_dir, coherence = artifacts.get_best_lda_dir(setup_dict, args.n_topics)
+        print("Best coherence: " + str(coherence), file=sys.stderr)
+    else:
+        model_dir = (
+            os.getenv("MODEL_DIR")
+            + "/"
+            + setup_dict["name"]
+            + "/"
+            + str(args.n_topics)
+            + "topics/model_"
+            + str(args.model_num)
+        )
+
+    print("Loading model from: " + model_dir + "/lda.model", file=sys.stderr)
+    return artifacts.load_lda(model_dir + "/lda.model")
+
+
+class TopicBatcher:
+    """
+    Collects documents submitted from any thread into batches of up to `batch_size`, and infers
+    their topic distributions on one worker thread. The model, its dictionary and the lemma
+    memo stay in memory.
+    """
+
+    def __init__(self, model, setup_dict, batch_size, max_wait_ms):
+        self.model = model
+        self.setup_dict = setup_dict
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.memo = preprocess.load_memo()
+        self.n_memo_saved = len(self.memo)
+
+        # Checking lemmas against ogm is slow, so only the first documents served are checked
+        self.n_unchecked = preprocess.CHECK_SAMPLE_SIZE
+
+        self.timer = StageTimer()
+        self.lock = threading.Lock()
+        self.memo_lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.n_docs = 0
+        self.n_batches = 0
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, texts):
+        """
+        Returns a future of the topic distributions (one list per text) of `texts`
+        """
+        future = Future()
+        self.requests.put((list(texts), future))
+        return future
+
+    def get_batch(self):
+        # Block for the first request, then take whatever arrives before the batch is full or
+        # the wait is over
+        batch = [self.requests.get()]
+        n_docs = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while n_docs < self.batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+            n_docs += len(batch[-1][0])
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.get_batch()
+            texts = [t for request_texts, _ in batch for t in request_texts]
+            try:
+                dists = self.infer(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            start = 0
+            for request_texts, future in batch:
+                future.set_result(dists[start : start + len(request_texts)].tolist())
+                start += len(request_texts)
+
+    def infer(self, texts):
+        with self.lock:
+            n_check = min(self.n_unchecked, len(texts))
+            self.n_unchecked -= n_check
+
+        # stdout carries answers in stdio mode, so preprocessing's messages go to stderr
+        with self.timer.stage("preprocess", n_docs=len(texts)), self.memo_lock:
+            with contextlib.redirect_stdout(sys.stderr):
+                docs = preprocess.preprocess_texts(self.setup_dict, texts, self.memo, n_check)
+
+        # Normalized gammas, as `get_document_topics` computes them one document at a time
+        with self.timer.stage("inference", n_docs=len(texts)):
+            corpus = [self.model.id2word.doc2bow(d if isinstance(d, list) else []) for d in docs]
+            gamma, _ = self.model.inference(corpus)
+            dists = gamma / gamma.sum(axis=1, keepdims=True)
+
+        with self.lock:
+            self.n_docs += len(texts)
+            self.n_batches += 1
+        return dists
+
+    def save_memo(self):
+        with self.memo_lock:
+            if len(self.memo) > self.n_memo_saved:
+                preprocess.save_memo(self.memo)
+                self.n_memo_saved = len(self.memo)
+
+    def report(self):
+        with self.lock:
+            uptime = time.perf_counter() - self.start_time
+            return {
+                "uptime": uptime,
+                "n_docs": self.n_docs,
+                "n_batches": self.n_batches,
+                "mean_batch_size": self.n_docs / max(1, self.n_batches),
+                "docs_per_sec": self.n_docs / uptime if uptime > 0 else 0.0,
+                "stages": {k: dict(v) for k, v in self.timer.stages.items()},
+            }
+
+
+def parse_line(line):
+    # A line is either a JSON string, or an object with a "text" and an optional "id"
+    request = json.loads(line)
+    if isinstance(request, str):
+        return None, request
+    if not isinstance(request["text"], str):
+        raise ValueError('"text" must be a string')
+    return request.get("id"), request["text"]
+
+
+def serve_lines(batcher, infile, outfile):
+    """
+    Answer each JSON line of `infile` with a line of `{"id", "topics"}` (or `{"id", "error"}`),
+    in order. Lines are submitted as they're read, so a client can stream many documents
+    without waiting for each answer.
+    """
+    pending = queue.Queue()
+
+    def write_results():
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            doc_id, future = item
+            try:
+                result = {"id": doc_id, "topics": future.result()[0]}
+            except Exception as e:
+                result = {"id": doc_id, "error": str(e)}
+            outfile.write(json.dumps(result) + "\n")
+            outfile.flush()
+
+    writer = threading.Thread(target=write_results)
+    writer.start()
+    try:
+        for line in infile:
+            if not line.strip():
+                continue
+            try:
+                doc_id, text = parse_line(line)
+            except (ValueError, KeyError, AttributeError) as e:
+                future = Future()
+                future.set_exception(ValueError("Bad request: " + str(e)))
+                pending.put((None, future))
+                continue
+            pending.put((doc_id, batcher.submit([text])))
+    finally:
+        pending.put(None)
+        writer.join()
+
+
+class LineWriter:
+    # Text writes to a socket's binary stream
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        self.wfile.write(text.encode("utf-8"))
+
+    def flush(self):
+        self.wfile.flush()
+
+
+def serve_socket(batcher, socket_path):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            serve_lines(
+                batcher,
+                (line.decode("utf-8") for line in self.rfile),
+                LineWriter(self.wfile),
+            )
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as server:
+        print("Listening on " + socket_path, file=sys.stderr)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+def serve_http(batcher, host, port):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, code, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self.send_json(200, batcher.report())
+            else:
+                self.send_json(404, {"error": "Not found"})
+
+        def do_POST(self):
+            # {"texts": [...]} -> {"topics": [[...], ...]}
+            if self.path != "/topics":
+                self.send_json(404, {"error": "Not found"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                texts = body["texts"]
+                if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                    raise ValueError('"texts" must be a list of strings')
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_json(400, {"error": "Bad request: " + str(e)})
+                return
+            try:
+                self.send_json(200, {"topics": batcher.submit(texts).result()})
+            except Exception as e:
+                self.send_json(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            # Throughput reports are enough; don't log every request
+            pass
+
+    with ThreadingHTTPServer((host, port), Handler) as server:
+        print("Listening on http://" + host + ":" + str(port), file=sys.stderr)
+        server.serve_forever()
+
+
+def report_periodically(batcher, interval):
+    while True:
+        time.sleep(interval)
+        print(json.dumps(batcher.report()), file=sys.stderr)
+        batcher.save_memo()
+
+
+def main(args):
+    with open(args.experiment_config, "r") as infile:
+        setup_dict = json.load(infile)
+
+    model = load_model(setup_dict, args)
+    batcher = TopicBatcher(model, setup_dict, args.batch_size, args.max_wait_ms)
+    if args.report_every > 0:
+        threading.Thread(
+            target=report_periodically, args=(batcher, args.report_every), daemon=True
+        ).start()
+
+    # Shut down cleanly when killed, reporting and saving the memo
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        if args.mode == "stdio":
+            serve_lines(batcher, sys.stdin, sys.stdout)
+        elif args.mode == "socket":
+            serve_socket(batcher, args.socket_path)
+        else:
+            serve_http(batcher, args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        batcher.save_memo()
+        print(json.dumps(batcher.report()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(get_args())
@@ -1,8 +1,11 @@
-import os, json, pickle
+import os, sys, json, pickle
 from ogm.trainer import TextTrainer
 from gensim.models import CoherenceModel
 import argparse as ap
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import artifacts, cache, preprocess, results, streaming
+
 # Experiment parameters obtained by CLI args
 argparser = ap.ArgumentParser()
 argparser.add_argument(
@@ -44,6 +47,22 @@ argparser.add_argument(
 argparser.add_argument(
     "--wordcloud_noshow", help="Don't bother displaying wordclouds", action="store_true"
 )
+argparser.add_argument(
+    "--wordcloud_dir",
+    help="Render every topic's wordcloud to a file in this directory instead of displaying it",
+)
+argparser.add_argument(
+    "--wordcloud_format",
+    help="File format of wordclouds rendered to --wordcloud_dir",
+    choices=["png", "svg"],
+    default="png",
+)
+argparser.add_argument(
+    "--wordcloud_processes",
+    help="Number of processes rendering wordclouds to --wordcloud_dir",
+    type=int,
+    default=os.cpu_count(),
+)
 argparser.add_argument(
     "--ldavis",
     action="store_true",
@@ -51,6 +70,63 @@ argparser.add_argument(
 )
 args = argparser.parse_args()
 
+# Words printed per topic, as `print_topics` does
+PRINT_WORDS = 10
+
+
+def format_topic(weights, words):
+    # Same format as gensim's `print_topics`
+    return " + ".join('%.3f*"%s"' % (weight, word) for weight, word in zip(weights, words))
+
+
+def make_wordcloud(frequencies, mask):
+    from wordcloud import WordCloud
+
+    # Term weights are used as frequencies directly, so the words are never tokenized again
+    return WordCloud(
+        width=800,
+        height=800,
+        background_color="white",
+        min_font_size=10,
+        collocations=False,
+        mask=mask,
+    ).generate_from_frequencies(frequencies)
+
+
+def init_wordcloud_worker(mask):
+    # The mask is loaded once and handed to each worker when it starts
+    global wordcloud_mask
+    wordcloud_mask = mask
+
+
+def render_wordcloud(topic_id, frequencies, output_dir, output_format):
+    wordcloud = make_wordcloud(frequencies, wordcloud_mask)
+    path = output_dir + "/topic_" + str(topic_id) + "." + output_format
+    if output_format == "svg":
+        with open(path, "w") as output:
+            output.write(wordcloud.to_svg())
+    else:
+        wordcloud.to_file(path)
+    return path
+
+
+def render_wordclouds(all_frequencies, mask, output_dir, output_format, n_processes):
+    """
+    Render the wordcloud of every topic to `output_dir` in a pool of processes
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    os.makedirs(output_dir, exist_ok=True)
+    with ProcessPoolExecutor(
+        max_workers=n_processes, initializer=init_wordcloud_worker, initargs=(mask,)
+    ) as pool:
+        futures = [
+            pool.submit(render_wordcloud, topic_id, frequencies, output_dir, output_format)
+            for topic_id, frequencies in enumerate(all_frequencies)
+        ]
+        for future in futures:
+            print("Saved wordcloud to " + future.result())
+
 
 def main():
 
@@ -62,27 +138,7 @@ def main():
 
     # Loop through the metadata and find the model with the highest coherence if user didn't specify
     if args.model_num is None:
-        filename = (
-            os.getenv("MODEL_DIR")
-            + "/"
-            + experiment_name
-            + "/"
-            + str(args.n_topics)
-            + "topics"
-            + "/metadata.json"
-        )
-
-        info = {}
-        with open(filename, "r") as json_file:
-            info = json.load(json_file)
-
-        best_coherence = -1.0
-        main_path = None
-        for key in info.keys():
-            if "model" in key and float(info[key]["coherence"]) > best_coherence:
-                best_coherence = float(info[key]["coherence"])
-                main_path = info[key]["path"]
-
+        main_path, best_coherence = artifacts.get_best_lda_dir(setup_dict, args.n_topics)
         print("Best coherence: " + str(best_coherence))
 
     else:
@@ -100,101 +156,95 @@ def main():
     print("Loading model from: " + model_path)
 
     trainer = TextTrainer()
-    trainer.load_model("lda", model_path)
-    try:
+    trainer.model = artifacts.load_lda(model_path)
+
+    # Per-topic coherences recorded at training time; models trained before they were recorded
+    # may have a saved coherence model instead
+    topic_coherences = results.get_topic_coherences(experiment_name, args.n_topics).get(
+        os.path.basename(main_path)
+    )
+    if topic_coherences is None and os.path.isfile(main_path + "/coherence.model"):
         cm = CoherenceModel.load(main_path + "/coherence.model")
         topic_coherences = cm.get_coherence_per_topic()
+
+    if topic_coherences is not None:
+        topic_coherences = [float(c) for c in topic_coherences]
         print(topic_coherences)
-    except FileNotFoundError:
-        print("There was no coherence model saved for this topic model.")
-        topic_coherences = None
+    else:
+        print("There were no per-topic coherences recorded for this topic model.")
 
-    i = 0
-    for topic_id, topic in trainer.model.print_topics(-1):
+    # Top terms of every topic, enough for printing and the word clouds, cached next to the model
+    n_words = max(PRINT_WORDS, args.wordcloud_wordcount) if args.word_cloud else PRINT_WORDS
+    _, weights, words = artifacts.load_top_terms(trainer.model, model_path, n_words)
+
+    for topic_id in range(len(words)):
+        topic = format_topic(weights[topic_id, :PRINT_WORDS], words[topic_id, :PRINT_WORDS])
         print("* Topic: " + str(topic_id) + " \n\t* Words: " + topic)
         if topic_coherences is not None:
-            print("\t* Per-topic coherence:", topic_coherences[i])
-            i += 1
+            print("\t* Per-topic coherence:", topic_coherences[topic_id])
 
     if args.word_cloud:
-        import matplotlib.pyplot as plt
-        import numpy as np
-        from PIL import Image
-        from wordcloud import WordCloud
-
-        for topic_id, topic_words in trainer.model.print_topics(
-            num_topics=-1, num_words=args.wordcloud_wordcount
-        ):
-            # Data for plotting wordcloud as a bar chart
-            x_axis = []
-            y_axis = []
-
-            cloud_words = ""
-            for weight_word_pair in topic_words.split(" + "):
-                pairing = weight_word_pair.split("*")
-                adjusted_weight = int(float(pairing[0]) * 1000)
-                cleaned_word = pairing[1].replace('"', "")
-                for i in range(adjusted_weight):
-                    cloud_words += cleaned_word + " "
-
-                x_axis.append(cleaned_word)
-                y_axis.append(pairing[0])
+        all_frequencies = []
+        for topic_id in range(len(words)):
+            # Data for plotting wordcloud as a bar chart, with weights rounded as printed
+            x_axis = [str(w) for w in words[topic_id, : args.wordcloud_wordcount]]
+            y_axis = ["%.3f" % w for w in weights[topic_id, : args.wordcloud_wordcount]]
 
             if args.dump_wordcloud_data:
                 with open("axes_" + str(topic_id) + ".pkl", "wb") as outfile:
                     pickle.dump([x_axis, y_axis], outfile)
 
-            if not args.wordcloud_noshow:
-                cloud_shape = np.array(Image.open(args.wordcloud_mask))
-                wordcloud = WordCloud(
-                    width=800,
-                    height=800,
-                    background_color="white",
-                    min_font_size=10,
-                    collocations=False,
-                    mask=cloud_shape,
-                ).generate(cloud_words)
+            all_frequencies.append(
+                {
+                    word: float(weight)
+                    for word, weight in zip(x_axis, weights[topic_id, : args.wordcloud_wordcount])
+                }
+            )
+
+        if args.wordcloud_dir is not None or not args.wordcloud_noshow:
+            import numpy as np
+            from PIL import Image
 
+            cloud_shape = np.array(Image.open(args.wordcloud_mask))
+
+        if args.wordcloud_dir is not None:
+            render_wordclouds(
+                all_frequencies,
+                cloud_shape,
+                args.wordcloud_dir,
+                args.wordcloud_format,
+                args.wordcloud_processes,
+            )
+
+        elif not args.wordcloud_noshow:
+            import matplotlib.pyplot as plt
+
+            for frequencies in all_frequencies:
                 plt.figure(figsize=(8, 8), facecolor=None)
-                plt.imshow(wordcloud)
+                plt.imshow(make_wordcloud(frequencies, cloud_shape))
                 plt.axis("off")
                 plt.tight_layout(pad=0)
 
     if args.ldavis:
-        from pyLDAvis.gensim_models import prepare
         from pyLDAvis import save_html
 
-        data_path = os.getenv("DATA_DIR") + "/" + setup_dict["data_path"]
-        trainer.parse_file(data_path)
-        if "time_filter" in setup_dict:
-            trainer.filter_within_time_range(
-                col=setup_dict["time_filter"]["time_key"],
-                data_format=setup_dict["time_filter"]["data_format"],
-                input_format=setup_dict["time_filter"]["arg_format"],
-                start=setup_dict["time_filter"]["start"],
-                end=setup_dict["time_filter"]["end"],
+        def get_ldavis_inputs():
+            # Only needed the first time; the prepared data is cached next to the model
+            data_path = os.getenv("DATA_DIR") + "/" + setup_dict["data_path"]
+            if setup_dict.get("streaming"):
+                # Read the corpus from disk chunk by chunk, with the dictionary the model was
+                # trained with
+                _, (_, _, trainer.corpus) = streaming.load_streamed(setup_dict, data_path)
+                return trainer.model, trainer.corpus, trainer.model.id2word
+
+            trainer.data, trainer.dictionary, trainer.corpus = cache.load_preprocessed(
+                setup_dict, data_path, lambda: preprocess.preprocess_file(setup_dict, data_path)
             )
+            return trainer.model, trainer.corpus, trainer.dictionary
 
-        if "attribute_filters" in setup_dict:
-            for attr_filter in setup_dict["attribute_filters"]:
-                trainer.filter_data(attr_filter["filter_key"], set(attr_filter["filter_vals"]))
-
-        if "replace_before_stemming" in setup_dict:
-            trainer.replace_words(setup_dict["text_key"], setup_dict["replace_before_stemming"])
-
-        if "remove_before_stemming" in setup_dict:
-            trainer.remove_words(setup_dict["text_key"], set(setup_dict["remove_before_stemming"]))
-
-        trainer.lemmatize_stem_words(setup_dict["text_key"])
-
-        if "replace_after_stemming" in setup_dict:
-            trainer.replace_words(setup_dict["text_key"], setup_dict["replace_after_stemming"])
-
-        if "remove_after_stemming" in setup_dict:
-            trainer.remove_words(setup_dict["text_key"], set(setup_dict["remove_after_stemming"]))
-
-        trainer.make_dict_and_corpus(setup_dict["text_key"])
-        data = prepare(trainer.model, trainer.corpus, trainer.dictionary)
+        data = artifacts.load_ldavis(
+            model_path, get_ldavis_inputs, setup_dict.get("ldavis", {}).get("n_jobs", -1)
+        )
         save_html(data, setup_dict["name"] + "_" + str(args.n_topics) + ".html")
 
 
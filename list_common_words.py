@@ -1,79 +1,212 @@
-from ogm.parser import TextParser
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import argparse as ap
+import pandas as pd
 import os, json
+from common import cache, preprocess, streaming
 
 
 def get_setup_dict():
     p = ap.ArgumentParser()
     p.add_argument("filepath", help="Path to experiment's JSON file")
+    p.add_argument("--top_n", help="Number of words to list", type=int, default=50)
+    p.add_argument(
+        "--output_file",
+        help="CSV file to write the top words and their document frequencies to; "
+        + "defaults to <experiment name>_common_words.csv",
+    )
+    p.add_argument(
+        "--streaming",
+        help="Read and preprocess the data file in chunks instead of loading all of it",
+        action="store_true",
+    )
+    p.add_argument(
+        "--chunk_size",
+        help="Documents per chunk counted by a worker",
+        type=int,
+        default=100000,
+    )
+    p.add_argument(
+        "--n_processes",
+        help="Number of worker processes; defaults to the CPU count",
+        type=int,
+        default=os.cpu_count(),
+    )
+    p.add_argument(
+        "--approximate",
+        help="Only keep counts for about K words at a time (Misra-Gries heavy hitters). "
+        + "Counts are underestimated by at most (total count) / (K + 1)",
+        type=int,
+        metavar="K",
+    )
     a = p.parse_args()
     with open(a.filepath, "r") as infile:
         input_dict = json.load(infile)
 
-    return input_dict
-
-
-def main(setup_dict):
+    return input_dict, a
+
+
+def prune_counts(counts, max_words):
+    """
+    Misra-Gries: subtract the (K+1)th largest count from every count and drop what's left at 0.
+    Returns the pruned counts and the amount subtracted, which bounds how far any count is off.
+    """
+    if max_words is None or len(counts) <= max_words:
+        return counts, 0
+    threshold = sorted(counts.values(), reverse=True)[max_words]
+    return (
+        Counter({w: c - threshold for w, c in counts.items() if c > threshold}),
+        threshold,
+    )
+
+
+class WordCounts:
+    """
+    Token counts and document frequencies, either exact or limited to `max_words` heavy hitters.
+    Counts of separate chunks can be merged.
+    """
+
+    def __init__(self, max_words=None):
+        self.max_words = max_words
+        self.counts = Counter()
+        self.doc_freqs = Counter()
+        self.n_docs = 0
+        self.n_tokens = 0
+
+        # Most that any count or document frequency can be underestimated by
+        self.count_error = 0
+        self.doc_freq_error = 0
+
+    def add_documents(self, docs):
+        for doc in docs:
+            if not isinstance(doc, list):
+                continue
+            self.counts.update(doc)
+            self.doc_freqs.update(set(doc))
+            self.n_docs += 1
+            self.n_tokens += len(doc)
+        self.prune()
+        return self
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.doc_freqs += other.doc_freqs
+        self.n_docs += other.n_docs
+        self.n_tokens += other.n_tokens
+        self.count_error += other.count_error
+        self.doc_freq_error += other.doc_freq_error
+        self.prune()
+
+    def prune(self):
+        self.counts, error = prune_counts(self.counts, self.max_words)
+        self.count_error += error
+        self.doc_freqs, error = prune_counts(self.doc_freqs, self.max_words)
+        self.doc_freq_error += error
+
+
+def count_documents(docs, max_words):
+    return WordCounts(max_words).add_documents(docs)
+
+
+def init_chunk_worker():
+    # Each worker loads the lemma memo once and keeps it for all of its chunks
+    global lemma_memo
+    lemma_memo = preprocess.load_memo()
+
+
+def count_chunk(setup_dict, chunk, max_words):
+    # Each worker preprocesses its own chunk; it's already one of several processes
+    data = preprocess.preprocess_data(
+        setup_dict | {"preprocess_processes": 1}, chunk, memo=lemma_memo, verbose=False
+    )
+    return count_documents(data[setup_dict["text_key"]], max_words)
+
+
+def count_in_pool(jobs, n_processes, max_words, initializer=None):
+    """
+    Run (function, *args) jobs that each return WordCounts and merge their results. Only a few
+    jobs are in flight at once, so memory doesn't grow with the dataset.
+    """
+    totals = WordCounts(max_words)
+    with ProcessPoolExecutor(max_workers=n_processes, initializer=initializer) as pool:
+        running = set()
+        for job in jobs:
+            running.add(pool.submit(*job))
+            if len(running) >= 2 * n_processes:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for result in done:
+                    totals.merge(result.result())
+
+        for result in running:
+            totals.merge(result.result())
+
+    return totals
+
+
+def main(setup_dict, args):
 
     # Path to data file
     dataf = os.getenv("DATA_DIR")
     data_file = dataf + "/" + setup_dict["data_path"]
+    text_key = setup_dict["text_key"]
 
-    # Read in data and run the gensim preprocessing on it
-    trainer = TextParser()
-    trainer.parse_file(data_file)
-
-    if "time_filter" in setup_dict:
-        trainer.filter_within_time_range(
-            col=setup_dict["time_filter"]["time_key"],
-            data_format=setup_dict["time_filter"]["data_format"],
-            input_format=setup_dict["time_filter"]["arg_format"],
-            start=setup_dict["time_filter"]["start"],
-            end=setup_dict["time_filter"]["end"],
-        )
-
-    if "attribute_filters" in setup_dict:
-        for attr_filter in setup_dict["attribute_filters"]:
-            trainer.filter_data(
-                attr_filter["filter_key"], set(attr_filter["filter_vals"])
-            )
-
-    print("Found " + str(len(trainer.data)) + " posts")
-
-    if "replace_before_stemming" in setup_dict:
-        trainer.replace_words(
-            setup_dict["text_key"], setup_dict["replace_before_stemming"]
-        )
-
-    if "remove_before_stemming" in setup_dict:
-        trainer.remove_words(
-            setup_dict["text_key"], set(setup_dict["remove_before_stemming"])
+    if args.streaming:
+        # Only a few chunks are held in memory at once, and nothing is written to the cache
+        chunks = streaming.iter_data_chunks(data_file, args.chunk_size)
+        totals = count_in_pool(
+            ((count_chunk, setup_dict, chunk, args.approximate) for chunk in chunks),
+            args.n_processes,
+            args.approximate,
+            init_chunk_worker,
         )
-
-    trainer.lemmatize_stem_words(setup_dict["text_key"])
-
-    if "replace_after_stemming" in setup_dict:
-        trainer.replace_words(
-            setup_dict["text_key"], setup_dict["replace_after_stemming"]
+    else:
+        # Read in data and run the gensim preprocessing on it, unless it's already cached
+        data, _, _ = cache.load_preprocessed(
+            setup_dict,
+            data_file,
+            lambda: preprocess.preprocess_file(setup_dict, data_file),
         )
-
-    if "remove_after_stemming" in setup_dict:
-        trainer.remove_words(
-            setup_dict["text_key"], set(setup_dict["remove_after_stemming"])
+        texts = list(data[text_key])
+        totals = count_in_pool(
+            (
+                (count_documents, texts[i : i + args.chunk_size], args.approximate)
+                for i in range(0, len(texts), args.chunk_size)
+            ),
+            args.n_processes,
+            args.approximate,
         )
 
-    text_key = setup_dict["text_key"]
-
-    all_texts_concat = []
-    for x in trainer.data:
-        for word in x[text_key]:
-            all_texts_concat.append(word)
-
-    c = Counter(all_texts_concat)
-    print(c.most_common(50))
+    top_words = totals.counts.most_common(args.top_n)
+    print(top_words)
+    print(
+        "Counted",
+        totals.n_tokens,
+        "tokens in",
+        totals.n_docs,
+        "documents",
+        "" if args.approximate else "with a vocabulary of " + str(len(totals.counts)),
+    )
+
+    output = pd.DataFrame(
+        {
+            "word": [w for w, _ in top_words],
+            "count": [c for _, c in top_words],
+            "doc_freq": [totals.doc_freqs.get(w, 0) for w, _ in top_words],
+            "doc_fraction": [
+                totals.doc_freqs.get(w, 0) / max(1, totals.n_docs) for w, _ in top_words
+            ],
+        }
+    )
+    if args.approximate:
+        # Approximate counts are lower bounds; the true value is at most this much higher
+        output["count_error"] = totals.count_error
+        output["doc_freq_error"] = totals.doc_freq_error
+
+    output_file = args.output_file or setup_dict["name"] + "_common_words.csv"
+    output.to_csv(output_file, index=False)
+    print("Saved top", len(top_words), "words to", output_file)
 
 
 if __name__ == "__main__":
-    d = get_setup_dict()
-    main(d)
+    d, a = get_setup_dict()
+    main(d, a)
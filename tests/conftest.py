@@ -0,0 +1,4 @@
+import os, sys
+
+# Scripts import the shared modules as `common.*` from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,44 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("gensim")
+from gensim.corpora import Dictionary
+from gensim.models import LdaSeqModel
+from common.artifacts import load_ldaseq, save_ldaseq
+
+TEXTS = [
+    ["apple", "banana", "fruit"],
+    ["banana", "fruit", "juice"],
+    ["apple", "juice", "fruit"],
+    ["car", "road", "wheel"],
+    ["road", "wheel", "engine"],
+    ["car", "engine", "road"],
+]
+
+
+def test_ldaseq_round_trip(tmp_path):
+    dictionary = Dictionary(TEXTS)
+    corpus = [dictionary.doc2bow(text) for text in TEXTS]
+    model = LdaSeqModel(
+        corpus=corpus,
+        id2word=dictionary,
+        time_slice=[3, 3],
+        num_topics=2,
+        passes=1,
+        em_min_iter=1,
+        em_max_iter=1,
+        random_state=0,
+    )
+    path = str(tmp_path / "ldaseq.model")
+    save_ldaseq(model, path)
+
+    # The chain arrays are back on the model after saving
+    assert model.topic_chains[0].obs is not None
+
+    loaded = load_ldaseq(path)
+    np.testing.assert_allclose(loaded.gammas, model.gammas)
+    for chain, loaded_chain in zip(model.topic_chains, loaded.topic_chains):
+        for attrib, value in vars(chain).items():
+            if isinstance(value, np.ndarray):
+                np.testing.assert_allclose(getattr(loaded_chain, attrib), value)
+    assert loaded.print_topics(time=1) == model.print_topics(time=1)
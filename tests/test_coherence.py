@@ -0,0 +1,34 @@
+import pytest
+
+pytest.importorskip("gensim")
+from gensim.corpora import Dictionary
+from gensim.models import CoherenceModel
+from common.coherence import CoherenceEngine, get_word_topics
+
+TEXTS = [
+    ["human", "interface", "computer", "survey", "user"],
+    ["computer", "system", "response", "time", "user", "survey"],
+    ["user", "interface", "system", "eps", "human"],
+    ["system", "human", "system", "eps", "trees"],
+    ["user", "response", "time", "graph", "trees"],
+    ["trees", "graph", "minors", "survey"],
+    ["graph", "minors", "trees", "eps", "computer"],
+]
+TOPICS = [["human", "computer", "system", "user"], ["graph", "trees", "minors", "survey"]]
+
+
+@pytest.mark.parametrize("measure", ["u_mass", "c_v", "c_uci", "c_npmi"])
+def test_engine_matches_coherence_model(tmp_path, measure):
+    dictionary = Dictionary(TEXTS)
+    corpus = [dictionary.doc2bow(text) for text in TEXTS]
+    expected = CoherenceModel(
+        topics=TOPICS, texts=TEXTS, corpus=corpus, dictionary=dictionary, coherence=measure
+    ).get_coherence_per_topic()
+
+    engine = CoherenceEngine(TEXTS, corpus, dictionary, str(tmp_path))
+    topics = get_word_topics(TOPICS, dictionary)
+    assert engine.get_coherence_per_topic(topics, measure) == pytest.approx(expected, abs=1e-6)
+
+    # Statistics saved by one engine are loaded by the next
+    reloaded = CoherenceEngine(TEXTS, corpus, dictionary, str(tmp_path))
+    assert reloaded.get_coherence_per_topic(topics, measure) == pytest.approx(expected, abs=1e-6)
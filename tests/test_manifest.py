@@ -0,0 +1,40 @@
+import os
+from common.manifest import (
+    clear_manifests,
+    read_manifest,
+    remove_manifest,
+    write_json_atomic,
+    write_manifest,
+)
+
+
+def test_write_json_atomic_leaves_only_the_file(tmp_path):
+    path = str(tmp_path / "info.json")
+    write_json_atomic(path, {"n_docs": 3})
+    write_json_atomic(path, {"n_docs": 4})
+    assert os.listdir(tmp_path) == ["info.json"]
+
+
+def test_manifest_round_trip(tmp_path):
+    path = str(tmp_path / "trial.json")
+    write_manifest(path, {"coherence": 0.5})
+    assert read_manifest(path) == {"coherence": 0.5}
+
+
+def test_unfinished_work_is_not_resumed(tmp_path):
+    # Missing, half-written and foreign files all read as never finished
+    assert read_manifest(str(tmp_path / "missing.json")) is None
+    (tmp_path / "partial.json").write_text('{"completed": 1, "rec')
+    assert read_manifest(str(tmp_path / "partial.json")) is None
+    write_json_atomic(str(tmp_path / "other.json"), {"completed": 1})
+    assert read_manifest(str(tmp_path / "other.json")) is None
+
+
+def test_clear_manifests(tmp_path):
+    for name in ["time_0.json", "time_1.json", "training.json"]:
+        write_manifest(str(tmp_path / name), {})
+    clear_manifests(str(tmp_path), "time_")
+    assert os.listdir(tmp_path) == ["training.json"]
+    remove_manifest(str(tmp_path / "training.json"))
+    remove_manifest(str(tmp_path / "training.json"))
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,63 @@
+import random
+import pytest
+from common.rules import RuleSet
+
+
+def apply_sequentially(text, replacements, removals):
+    n_removed = 0
+    for key, output in replacements.items():
+        text = text.replace(key, output)
+    for key in removals:
+        n_removed += text.count(key)
+        text = text.replace(key, "")
+    return text, n_removed
+
+
+@pytest.mark.parametrize(
+    "text, replacements, removals",
+    [
+        ("new york is in new york state", {"new york": "nyc", "nyc state": "nys"}, []),
+        ("the theme of the thesis", {"the": "a"}, ["he", "a "]),
+        ("aaaa aaa", {"aa": "b"}, ["ba"]),
+        ("bafoor foo", {}, ["foo", "bar"]),
+        ("  ba b c abb ", {}, ["a", " b ", "bb", "b "]),
+        ("abcabc", {"ab": "", "ca": "x"}, ["c"]),
+        ("no matches here", {"xyz": "q"}, ["zzz"]),
+    ],
+)
+def test_text_rules_match_str_replace(text, replacements, removals):
+    rules = RuleSet(replacements, removals)
+    assert rules.apply_text(text) == apply_sequentially(text, replacements, removals)
+
+
+def test_text_rules_match_str_replace_on_random_rules():
+    rng = random.Random(0)
+
+    def word(n):
+        return "".join(rng.choice("ab c") for _ in range(rng.randint(1, n)))
+
+    for _ in range(2000):
+        replacements = {word(3): word(3) if rng.random() < 0.7 else "" for _ in range(3)}
+        removals = [word(3) for _ in range(3)]
+        rules = RuleSet(replacements, removals)
+        for _ in range(5):
+            text = word(15)
+            expected = apply_sequentially(
+                text, {k: v for k, v in replacements.items() if k}, [k for k in removals if k]
+            )
+            assert rules.apply_text(text) == expected, (text, replacements, removals)
+
+
+def test_token_rules():
+    rules = RuleSet({"a": "b", "b": "c", "d": "a"}, ["c"])
+    assert rules.single_token
+    # a -> b -> c is removed, b -> c is removed, d -> a stays a
+    assert rules.apply(["a", "b", "d", "e"]) == (["a", "e"], 2)
+
+
+@pytest.mark.parametrize(
+    "replacements, removals",
+    [({"new york": "nyc"}, []), ({"a": "b c"}, []), ({"a": ""}, []), ({}, ["new york"])],
+)
+def test_token_phrases_are_not_compiled(replacements, removals):
+    assert not RuleSet(replacements, removals).single_token